@@ -83,6 +83,7 @@ function App() {
     createNode,
     createChildNode,
     updateContextData,
+    applyContextDelta,
     getNodeById,
     setEdges,
     setNodes,
@@ -159,6 +160,11 @@ function App() {
       onLayout();
     });
 
+    socket.on("update_node_delta", (node_id, version, delta) => {
+      applyContextDelta(node_id, version, delta);
+      onLayout();
+    });
+
     socket.on("global_info", (info) => {
       setGlobalInfo(info);
     });
@@ -36,6 +36,7 @@ export type ContextData = {
   auxiliary: any;
   session_id: string | null;
   is_root?: boolean;
+  version?: number;
   state:
     | "normal"
     | "running"
@@ -71,6 +72,7 @@ export const proc_incoming = (incoming: any): ContextData => {
     state: incoming.state,
     lats_data: incoming.lats_data,
     session_id: null,
+    version: incoming.version ?? 0,
   };
 };
 
@@ -25,6 +25,7 @@ export type EditorState = {
   onEdgesChange: OnEdgesChange;
   onConnect: OnConnect;
   updateContextData: (nodeId: string, data: ContextData) => void;
+  applyContextDelta: (nodeId: string, version: number, delta: any) => void;
   getNodeById: (nodeId: string) => Node<ContextData> | undefined;
   createNode: (node: Node<ContextData>) => void;
   createChildNode: (node: Node<ContextData>, parentId: string) => void;
@@ -81,6 +82,40 @@ const useStore = create<EditorState>((set, get) => ({
       return { nodes };
     });
   },
+  applyContextDelta: (nodeId, version, delta) => {
+    set((state) => {
+      const nodes = state.nodes.map((node) => {
+        // deltas arrive in order; skip those already covered by a snapshot
+        if (node.id !== nodeId || version <= (node.data.version ?? 0)) {
+          return node;
+        }
+        const updatedData = { ...node.data, version };
+        // sent when an ancestor's messages changed, replacing the whole history
+        if (delta.cur_messages) {
+          updatedData.cur_messages = delta.cur_messages;
+        }
+        if (delta.messages) {
+          updatedData.cur_messages = [
+            ...updatedData.cur_messages,
+            ...delta.messages,
+          ];
+        }
+        if (delta.auxiliary) {
+          updatedData.auxiliary = {
+            ...updatedData.auxiliary,
+            ...delta.auxiliary,
+          };
+        }
+        for (const key of ["transition", "lats_data", "observation", "state"]) {
+          if (key in delta) {
+            updatedData[key] = delta[key];
+          }
+        }
+        return { ...node, data: updatedData };
+      });
+      return { nodes };
+    });
+  },
   getNodeById: (nodeId) => {
     return get().nodes.find((n) => n.id === nodeId);
   },
@@ -1,31 +1,40 @@
 import os
 import sys
+import asyncio
+import threading
 from pathlib import Path
-from typing import Tuple, Optional, List
+from typing import Tuple, Optional, List, Iterator, AsyncIterator, Set
 from enum import Enum
 import re
 import logging
-import threading
-from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
 from langchain.tools.render import render_text_description
 from langchain_core.agents import AgentAction, AgentFinish
 from langchain_core.tools import BaseTool
 import traceback
+import attr
 from rich import print
 
-from . import config, utils
+from . import config, utils, limits
 from .prompting import *
 from .connector.gptv import Gpt4Vision
 from .connector.fast_lm import Gpt35
-from .connector import LMM, Message
-from .messages import ProxiedMessage
+from .connector import LMM, AsyncLMM, Message
+from .connector.aio import on_io_loop
+from .connector.async_openai import AsyncGpt4Vision, AsyncGpt35
+from .messages import ProxiedMessage, ObservationMessage
 from .tools import TOOLS, proc_tools, ToolResponse
 from .context import Context, CtxState
 from .session import Session
 from .react_parser import ReActSingleInputOutputParser
 from .subscriber import Subscriber, SIOSubscriber, default_subscriber, SubscriberMessageType
 
+# sync | async, the async connectors share one pooled client and let `alats` await LLM calls without a thread
+OPENAI_CONNECTOR = os.getenv("OPENAI_CONNECTOR") or "sync"
+# sync | async, the LATS driver `Agent.run` uses
+LATS_DRIVER = os.getenv("LATS_DRIVER") or "sync"
+
 if os.getenv("FUNTRACE"):
     import functiontrace
     import _functiontrace
@@ -34,33 +43,39 @@ if os.getenv("FUNTRACE"):
     _functiontrace.begin_tracing("./trace")
 
 
-def select_node(node: Context):
-    while node and node.children:
-        logging.info(f"Selecting from {len(node.children)} children at depth {node.depth}.")
-
-        terminal_children = [child for child in node.children if child.is_terminal]
-        terminal_status = [child.is_terminal for child in node.children]
-
-        if len(terminal_children) == len(node.children):
-            logging.info(f"All children are terminal at depth {node.depth}. Backtracking...")
-            if node.parent:
-                node.parent.children.remove(node)
-            node = node.parent
-            continue
-
-        node_with_reward_1 = next((child for child in terminal_children if child.reward == 1), None)
-        if node_with_reward_1:
-            logging.info(f"Found terminal node with reward 1 at depth {node.depth}.")
-            return node_with_reward_1
-
-        node = max((child for child in node.children if not child.is_terminal), key=lambda child: child.uct(),
-                   default=None)
-
-        while node.is_terminal and node.reward != 1:
-            node = max((child for child in node.parent.children if not child.is_terminal),
-                       key=lambda child: child.uct(), default=None)
-        logging.info(f"Selected node at depth {node.depth} with UCT {node.uct()}.")
-    return node
+def select_node(node: Context) -> Context | None:
+    """
+    Descend by UCT to the leaf to expand next, skipping subtrees whose open leaves are all claimed by
+    in-flight iterations.
+    :return: the leaf, or None if every open leaf is claimed or the tree is exhausted
+    """
+    if node.in_flight:
+        return None
+    if not node.children:
+        return node
+    logging.info(f"Selecting from {len(node.children)} children at depth {node.depth}.")
+
+    terminal_children = [child for child in node.children if child.is_terminal]
+
+    if len(terminal_children) == len(node.children):
+        logging.info(f"All children are terminal at depth {node.depth}. Backtracking...")
+        if node.parent:
+            node.parent.children.remove(node)
+        return None
+
+    node_with_reward_1 = next((child for child in terminal_children if child.reward == 1), None)
+    if node_with_reward_1:
+        logging.info(f"Found terminal node with reward 1 at depth {node.depth}.")
+        return node_with_reward_1
+
+    candidates = [child for child in node.children if not child.is_terminal and not child.in_flight]
+    for child in sorted(candidates, key=lambda child: child.uct(), reverse=True):
+        logging.info(f"Selected node at depth {child.depth} with UCT {child.uct()}.")
+        selected = select_node(child)
+        if selected is not None:
+            return selected
+    logging.info(f"All open children are being expanded at depth {node.depth}.")
+    return None
 
 
 def backprop(node: Context, value):
@@ -77,6 +92,23 @@ def backprop(node: Context, value):
         node = node.parent
 
 
+def add_virtual_loss(node: Context):
+    """
+    Claim a node for an in-flight iteration, penalizing its path so that concurrent selections spread out.
+    """
+    node.in_flight = True
+    while node:
+        node.virtual_loss += 1
+        node = node.parent
+
+
+def release_virtual_loss(node: Context):
+    node.in_flight = False
+    while node:
+        node.virtual_loss -= 1
+        node = node.parent
+
+
 def collect_all_nodes(node: Context):
     nodes = [node]
     for child in node.children:
@@ -104,6 +136,9 @@ class Agent:
     ROLLOUT_THRESHOLD = 8
     BRANCH_CNT = 5
     RESCUE_THRESHOLD = 3
+    MAX_WORKERS = 16
+    # Iterations the async driver runs at once from the same root
+    PARALLEL_ITERATIONS = int(os.getenv("LATS_PARALLEL_ITERATIONS") or 1)
 
     def __init__(self, vllm: LMM, run_type: RunType = RunType.PARALLEL, subscriber: Optional[Subscriber] = None, fast_lm : Optional[LMM]=None):
         self.vllm = vllm
@@ -113,28 +148,99 @@ class Agent:
         subscriber = subscriber or default_subscriber()
         self.subscriber = subscriber
         self.session = Session(subscriber=subscriber).setup()
+        self.executor = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
+        self.tree_lock = threading.Lock()
+        self._running: Set[Future] = set()  # pool work started by the asyncio driver
+
+    def close(self):
+        """
+        Release the worker pool once the agent's session is over.
+        """
+        self.executor.shutdown(wait=True)
 
     def _push(self, *args, **kwargs):
         if self.subscriber:
             self.subscriber.push(*args, **kwargs)
 
+    def _prompt(self, lm: LMM, *args, **kwargs) -> List[Message]:
+        """
+        Prompt a language model, respecting the process-wide limit on in-flight LLM calls.
+        """
+        with limits.llm_limit:
+            return lm.prompt(*args, **kwargs)
+
+    async def _aprompt(self, lm: LMM, *args, **kwargs) -> List[Message]:
+        """
+        Async variant of `_prompt`. Async connectors are awaited on the connector loop without holding a thread,
+        others run on the worker pool.
+        """
+        if not isinstance(lm, AsyncLMM):
+            return await self._athread(self._prompt, lm, *args, **kwargs)
+        acquired = asyncio.get_running_loop().run_in_executor(None, limits.llm_limit.acquire)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # The waiting thread cannot be interrupted, hand the slot back once it gets it
+            acquired.add_done_callback(lambda f: f.cancelled() or f.exception() or limits.llm_limit.release())
+            raise
+        try:
+            return await on_io_loop(lm.aprompt(*args, **kwargs))
+        finally:
+            limits.llm_limit.release()
+
+    def _run_tool(self, tool: BaseTool, tool_input: str) -> ToolResponse:
+        """
+        Run a tool, respecting its process-wide concurrency limit.
+        """
+        with limits.tool_limit(tool.name):
+            return tool._run(*utils.get_args(tool, utils.sanitize(tool_input)))
+
+    def _submit(self, fn, *args, **kwargs) -> Future:
+        future = self.executor.submit(fn, *args, **kwargs)
+        self._running.add(future)
+        future.add_done_callback(self._running.discard)
+        return future
+
+    async def _athread(self, fn, *args, **kwargs):
+        """
+        Run a blocking agent step on the agent's worker pool without blocking the event loop.
+        """
+        return await asyncio.wrap_future(self._submit(fn, *args, **kwargs))
+
+    async def _await_running(self):
+        """
+        Wait for pool work whose awaiting task was cancelled, as threads cannot be interrupted
+        and would otherwise keep mutating the tree after the search returned.
+        """
+        while self._running:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in list(self._running)), return_exceptions=True)
+
     def backup(self):
         os.mkdir(f'bak/{self.session.id}')
         with open(f'bak/{self.session.id}/root.json', 'w') as f:
             f.write(str(self.session.root.serialize_recursive()))
         os.system(f'cp -r run/{self.session.id} bak/{self.session.id}')
 
-    @Context.wrap_state(CtxState.Expanding)
-    def expand_node(self, node: Context):
+    def _prompt_stream(self, lm: LMM, *args, **kwargs) -> Iterator[Message]:
+        """
+        Streaming variant of `_prompt`. The LLM slot is held until the stream is exhausted or closed.
+        """
+        with limits.llm_limit:
+            yield from lm.prompt_stream(*args, **kwargs)
+
+    def stream_children(self, node: Context) -> Iterator[Context]:
+        """
+        Sample and parse the children of a node, yielding each one as soon as its choice has been generated.
+        :param node:
+        :return: the children whose transitions still need to be observed
+        """
         logging.info(f"expanding node {hex(id(node))}.....")
         if node.depth >= self.DEPTH_THRESHOLD:
             node.is_terminal = True
             return
-        sampled = self.vllm.prompt(node, self.session, stop=["Observation"], n=self.BRANCH_CNT)
-        logging.info(f"Sampled {len(sampled)} messages")
-        tasks = []
         existing = set()
-        for s in sampled:
+        for s in self._prompt_stream(self.vllm, node, self.session, stop=["Observation"], n=self.BRANCH_CNT,
+                                     complete_prefix=self.output_parser.complete_prefix):
             logging.info(f"Sampled message: {s}")
             new_st = node.commit(message=s)
             try:
@@ -153,15 +259,23 @@ class Agent:
             existing.add(k)
             new_st.transition = parsed
             logging.info(f"Parsed message: {parsed}")
-            t = threading.Thread(target=self.run_observe, args=(new_st,))
-            t.start()
+            yield new_st
+
+    def sample_children(self, node: Context) -> List[Context]:
+        return list(self.stream_children(node))
+
+    @Context.wrap_state(CtxState.Expanding)
+    def expand_node(self, node: Context):
+        tasks = []
+        # Observations start while the remaining choices are still being generated
+        for new_st in self.stream_children(node):
+            t = self.executor.submit(self.run_observe, new_st)
             if self.run_type == RunType.INTERACTIVE:
-                t.join()
+                t.result()
             tasks.append(t)
 
         logging.info(f"Waiting for {len(tasks)} tasks to finish")
-        for t in tasks:
-            t.join()
+        wait(tasks)
 
     @Context.wrap_state(CtxState.Rollout)
     def rollout(self, node: Context) -> Tuple[float, Context]:
@@ -194,6 +308,41 @@ class Agent:
             c.value = votes[i]
         return sum(votes) / len(votes) if votes else 0
 
+    def run_tool_with_rescue(self, tool: BaseTool, tool_input: str) -> ToolResponse:
+        """
+        Run a tool, asking the fast LM to repair the input if the tool fails.
+        :param tool:
+        :param tool_input: the input as generated by the agent
+        :return: the tool response
+        """
+        tool_inp = tool_input
+        orig_inp = tool_inp
+        orig_e = None
+        fail_cnt = 0
+        tool_res = None
+        attempts = []
+        while fail_cnt <= self.RESCUE_THRESHOLD:
+            try:
+                tool_res: ToolResponse = self._run_tool(tool, tool_inp)
+                break
+            except Exception as e:
+                if orig_e is None:
+                    orig_e = e
+                if fail_cnt == self.RESCUE_THRESHOLD:
+                    raise e
+                fail_cnt += 1
+                rescut_pmpt = [Message(RESCUE_PROMPT.format(function_description=tool.description, inputs=tool_inp, error_message=str(e), attempts=attempts))]
+                tool_inp = self._prompt(
+                    self.fast_lm,
+                    rescut_pmpt,
+                    self.session
+                )[0].message.splitlines()[-1]
+                if "give_up" in tool_inp.lower():
+                    tool_inp = orig_inp
+                    raise orig_e
+                attempts.append(f"Attempt {fail_cnt}: tool input = {tool_inp}, error = {str(e)} \n")
+        return tool_res
+
     @Context.wrap_state(CtxState.Running)
     def run_observe(self, state: Context):
         """
@@ -222,7 +371,8 @@ class Agent:
             while fail_cnt <= self.RESCUE_THRESHOLD:
                 try:
                     tool = self.session.find_tool(
-                        self.fast_lm.prompt(
+                        self._prompt(
+                            self.fast_lm,
                             [Message(FUNCTION_NOT_FOUND_PROMPT.format(functions=", ".join([t.name for t in self.session.tools]), used_function=state.transition.tool))],
                             self.session
                         )[0].message.splitlines()[-1]
@@ -237,31 +387,18 @@ class Agent:
                 ))
                 return
         try:
-            tool_inp = state.transition.tool_input
-            orig_inp = tool_inp
-            orig_e = None
-            fail_cnt = 0
-            tool_res = None
-            attempts = []
-            while fail_cnt <= self.RESCUE_THRESHOLD:
-                try:
-                    tool_res: ToolResponse = tool._run(*utils.get_args(tool, utils.sanitize(tool_inp)))
-                    break
-                except Exception as e:
-                    if orig_e is None:
-                        orig_e = e
-                    if fail_cnt == self.RESCUE_THRESHOLD:
-                        raise e
-                    fail_cnt += 1
-                    rescut_pmpt = [Message(RESCUE_PROMPT.format(function_description=tool.description, inputs=tool_inp, error_message=str(e), attempts=attempts))]
-                    tool_inp = self.fast_lm.prompt(
-                        rescut_pmpt,
-                        self.session
-                    )[0].message.splitlines()[-1]
-                    if "give_up" in tool_inp.lower():
-                        tool_inp = orig_inp
-                        raise orig_e
-                    attempts.append(f"Attempt {fail_cnt}: tool input = {tool_inp}, error = {str(e)} \n")
+            table = self.session.transpositions
+            tool_res, origin = table.lookup_or_run(
+                table.key(tool.name, utils.sanitize(state.transition.tool_input)),
+                state.id(),
+                lambda: self.run_tool_with_rescue(tool, state.transition.tool_input)
+            )
+            # Copy, since the cached response is shared across nodes
+            tool_res = attr.evolve(tool_res, auxiliary=dict(tool_res.auxiliary))
+            if origin is not None:
+                logging.info(f"Reusing observation of {origin} for {tool.name}")
+                state.set_auxiliary("transposition", origin)
+            self.session.update_info({"transpositions": table.stats()})
         except Exception as e:
             print('[red]Error[/red]: ', e, traceback.format_exc())
             # ask if user would like to continue, if so, ask for potential feedback
@@ -298,7 +435,10 @@ class Agent:
             else:
                 state.reward = self.get_reward(state)
         state.add_message(
-            Message(f"Observation{state.depth}: {tool_res.raw}\nAnalyze{state.depth}: ")
+            ObservationMessage(
+                f"Observation{state.depth}: {tool_res.raw}\nAnalyze{state.depth}: ",
+                f"Observation{state.depth}: {tool_res.summarize()}\nAnalyze{state.depth}: "
+            )
         )
         state.set_observation(tool_res.raw)
 
@@ -306,7 +446,7 @@ class Agent:
     def get_value(self, node: Context):
         messages = node.messages
         messages.append(Message(VALUE_PROMPT))
-        res = self.vllm.prompt(messages, self.session, temperature=0.1)[0]
+        res = self._prompt(self.vllm, messages, self.session, temperature=0.1)[0]
         targ_line = res.message.splitlines()[-1]
         for i in range(10, 0, -1):
             if str(i) in targ_line:
@@ -315,7 +455,7 @@ class Agent:
                 return i / 10
         return -1
 
-    def get_values(self, nodes: List[Context]):
+    def _values_messages(self, nodes: List[Context]) -> List[Message]:
         messages = nodes[0].parent.messages
         for i, node in enumerate(nodes):
             messages.append(Message(f"Begin Branch {i}: "))
@@ -326,7 +466,10 @@ class Agent:
         messages.append(Message(f"Now, begin your evaluation for each of the {len(nodes)} branches."))
         for n in nodes:
             n.set_state(CtxState.Evaluating)
-        res = self.vllm.prompt(messages, self.session, temperature=0.1)[0]
+        return messages
+
+    @staticmethod
+    def _parse_values(nodes: List[Context], res: Message) -> List[float]:
         lines = res.message.splitlines()
         targ_lines = [line for line in lines if re.match(r"branch\s+(\d+):\s+(\d+)", line)]
         print('targ lines: ', targ_lines)
@@ -347,12 +490,22 @@ class Agent:
                 values.append(0)
         return values
 
+    def get_values(self, nodes: List[Context]):
+        messages = self._values_messages(nodes)
+        res = self._prompt(self.vllm, messages, self.session, temperature=0.1)[0]
+        return self._parse_values(nodes, res)
+
+    async def aget_values(self, nodes: List[Context]) -> List[float]:
+        messages = self._values_messages(nodes)
+        res = (await self._aprompt(self.vllm, messages, self.session, temperature=0.1))[0]
+        return self._parse_values(nodes, res)
+
     @Context.wrap_state(CtxState.Evaluating)
     def get_reward(self, node: Context):
         # TODO: augment the reward prompt with coordinate data etc.
         messages = node.messages
         messages.append(Message(REWARD_PROMPT))
-        res = self.vllm.prompt(messages, self.session, temperature=0.1)[0]
+        res = self._prompt(self.vllm, messages, self.session, temperature=0.1)[0]
         targ_line = res.message.splitlines()[-1]
         for i in range(10, 0, -1):
             if str(i) in targ_line:
@@ -365,7 +518,15 @@ class Agent:
     def get_reflection(self, node: Context):
         messages = node.messages
         messages.append(Message(REFLECTION_PROMPT))
-        res = self.vllm.prompt(messages, self.session)[0]
+        res = self._prompt(self.vllm, messages, self.session)[0]
+        node.set_auxiliary("reflection", res.message)
+        self.session.add_reflection(res.message)
+
+    @Context.wrap_state(CtxState.Reflecting)
+    async def aget_reflection(self, node: Context):
+        messages = node.messages
+        messages.append(Message(REFLECTION_PROMPT))
+        res = (await self._aprompt(self.vllm, messages, self.session))[0]
         node.set_auxiliary("reflection", res.message)
         self.session.add_reflection(res.message)
 
@@ -374,7 +535,7 @@ class Agent:
         self._push(SubscriberMessageType.SetSessionInfoKey, (self.session.id, "image_loc", image_loc))
         return f"{utils.image_to_prompt(image_loc, self.session)} Where is this image located? {additional}"
 
-    def lats(self, goal: str, set_cur=False) -> Context:
+    def setup_root(self, goal: str, set_cur=False) -> Context:
         self._push(SubscriberMessageType.GlobalInfoSet, ("latest_session", self.session.id))
         if set_cur:
             self._push(SubscriberMessageType.SetCurrentSession, self.session.id)
@@ -399,10 +560,31 @@ class Agent:
         root.add_messages(initial_msg)
         self.session.root = root
         self._push(SubscriberMessageType.SetSessionId, (root.id(), self.session.id))
+        return root
+
+    @staticmethod
+    def best_trajectory(root: Context, terminals: List[Context]) -> Context:
+        all_nodes_list = collect_all_nodes(root)
+        all_nodes_list.extend(terminals)
+        best_child = max(all_nodes_list, key=lambda x: x.reward)
+        if best_child.reward == 1:
+            logging.info("Successful trajectory found")
+        else:
+            logging.info("No successful trajectory found")
+        if best_child is None:
+            best_child = root
+        best_child.set_state(CtxState.Success)
+        return best_child
+
+    def lats(self, goal: str, set_cur=False) -> Context:
+        root = self.setup_root(goal, set_cur)
         terminals = []
 
         for i in range(1, self.DEPTH_THRESHOLD + 1):
             node = select_node(root)
+            if node is None:
+                logging.info("No open nodes left to expand")
+                break
             logging.info(f"Selected node at depth {node.depth}: {node.messages[-1]}")
             print("-----Before expansion-----")
             print_tree(root, highlight=node)
@@ -425,27 +607,186 @@ class Agent:
                 terminal.set_state(CtxState.Success)
                 return terminal
             self.get_reflection(terminal)
-            backprop(terminal, reward)
+            with self.tree_lock:
+                backprop(terminal, reward)
             terminal_nodes_with_reward_1 = [node for node in collect_all_nodes(root) if
                                             node.is_terminal and node.reward == 1]
             if terminal_nodes_with_reward_1:
                 return max(terminal_nodes_with_reward_1, key=lambda node: node.value)
-        all_nodes_list = collect_all_nodes(root)
-        all_nodes_list.extend(terminals)
-        best_child = max(all_nodes_list, key=lambda x: x.reward)
-        failed_trajectories = []
-        if best_child.reward == 1:
-            logging.info("Successful trajectory found")
-        else:
-            logging.info("No successful trajectory found")
-        if best_child is None:
-            best_child = root
-        best_child.set_state(CtxState.Success)
-        return best_child
+        return self.best_trajectory(root, terminals)
+
+    # Asyncio LATS driver. Blocking LLM and tool calls run on the agent's worker pool,
+    # bounded by the process-wide limits in `limits`, so independent steps overlap.
+
+    async def astream_children(self, node: Context) -> AsyncIterator[Context]:
+        """
+        Async bridge over `stream_children`, which runs on the worker pool.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                for child in self.stream_children(node):
+                    loop.call_soon_threadsafe(queue.put_nowait, child)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = asyncio.wrap_future(self._submit(produce))
+        while (child := await queue.get()) is not done:
+            yield child
+        await producer
+
+    @Context.wrap_state(CtxState.Expanding)
+    async def aexpand_node(self, node: Context):
+        tasks = []
+        async for new_st in self.astream_children(node):
+            if self.run_type == RunType.INTERACTIVE:
+                await self._athread(self.run_observe, new_st)
+                continue
+            tasks.append(asyncio.ensure_future(self._athread(self.run_observe, new_st)))
+        logging.info(f"Waiting for {len(tasks)} tasks to finish")
+        await asyncio.gather(*tasks)
+
+    @Context.wrap_state(CtxState.Rollout)
+    async def arollout(self, node: Context) -> Tuple[float, Context]:
+        dep = 0
+        rewards = [0]
+        while not node.is_terminal and dep < self.ROLLOUT_THRESHOLD:
+            await self.aexpand_node(node)
+            if len(node.children) == 0:
+                break
+            for c in node.children:
+                if c.is_terminal: return c.reward, c
+            values = await self.aget_values(node.children)
+            mx_ind = values.index(max(values))
+            rewards.append(max(values))
+            node = node.children[mx_ind]
+            dep += 1
+            if dep == self.ROLLOUT_THRESHOLD:
+                rewards = [-1]
+        return sum(rewards) / len(rewards), node
+
+    async def aclaim_node(self, root: Context, cond: asyncio.Condition) -> Context | None:
+        """
+        Select a leaf that no other iteration is working on, and apply virtual loss along its path.
+        Waits for in-flight iterations to finish if every open branch is claimed.
+        :return: the claimed node, or None if the tree is exhausted
+        """
+        async with cond:
+            while True:
+                with self.tree_lock:
+                    node = select_node(root)
+                    if node is not None and not node.in_flight:
+                        add_virtual_loss(node)
+                        return node
+                    if root.virtual_loss == 0:
+                        return None
+                await cond.wait()
+
+    async def aiterate(self, node: Context) -> Tuple[float, Context] | None:
+        """
+        One expand -> evaluate -> rollout cycle from a selected node.
+        """
+        await self.aexpand_node(node)
+        if len(node.children) == 0:
+            logging.info(f"No children found for node {node}")
+            return None
+        values = await self.aget_values(node.children)
+        if len(values) == 0:
+            logging.info(f"No values found for node {node}")
+            return None
+        return await self.arollout(max(enumerate(node.children), key=lambda v: values[v[0]])[1])
+
+    async def alats(self, goal: str, set_cur=False, parallel: int | None = None) -> Context:
+        """
+        Asyncio variant of `lats`.
+        Reflections are generated in the background while the search continues,
+        so a reflection may only reach the prompts of later iterations.
+        :param parallel: number of iterations to run at once from the same root.
+        Concurrent selections are spread across branches by virtual loss.
+        """
+        parallel = parallel or self.PARALLEL_ITERATIONS
+        root = await self._athread(self.setup_root, goal, set_cur)
+        terminals = []
+        reflections = []
+        solution: Context | None = None
+        iterations = iter(range(self.DEPTH_THRESHOLD))
+        cond = asyncio.Condition()
+
+        async def worker():
+            nonlocal solution
+            for _ in iterations:
+                if solution is not None:
+                    return
+                node = await self.aclaim_node(root, cond)
+                if node is None:
+                    return
+                logging.info(f"Selected node at depth {node.depth}")
+                try:
+                    res = await self.aiterate(node)
+                finally:
+                    with self.tree_lock:
+                        release_virtual_loss(node)
+                    async with cond:
+                        cond.notify_all()
+                if res is None:
+                    continue
+                reward, terminal = res
+                terminals.append(terminal)
+                if terminal.reward == 1:
+                    print(f"successful solution has been found: {terminal.transition.tool_input}")
+                    terminal.set_state(CtxState.Success)
+                    solution = terminal
+                    return
+                reflections.append(asyncio.ensure_future(self.aget_reflection(terminal)))
+                with self.tree_lock:
+                    backprop(terminal, reward)
+                    terminal_nodes_with_reward_1 = [node for node in collect_all_nodes(root) if
+                                                    node.is_terminal and node.reward == 1]
+                if terminal_nodes_with_reward_1 and solution is None:
+                    solution = max(terminal_nodes_with_reward_1, key=lambda node: node.value)
+                    return
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(parallel)]
+        try:
+            pending = set(workers)
+            while pending and solution is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    t.result()
+        finally:
+            # On a solution or a failing worker, stop the others
+            for t in workers:
+                t.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await asyncio.gather(*reflections, return_exceptions=True)
+            await self._await_running()
+        if solution is not None:
+            return solution
+        return self.best_trajectory(root, terminals)
+
+    def lats_async(self, goal: str, set_cur=False, parallel: int | None = None) -> Context:
+        try:
+            return asyncio.run(self.alats(goal, set_cur, parallel))
+        finally:
+            self.close()
+
+    def run(self, goal: str, set_cur=False, parallel: int | None = None) -> Context:
+        """
+        Search with the driver selected by LATS_DRIVER.
+        :param parallel: iterations run at once by the async driver, LATS_PARALLEL_ITERATIONS by default
+        """
+        if LATS_DRIVER == "async":
+            return self.lats_async(goal, set_cur, parallel)
+        return self.lats(goal, set_cur)
 
 
 def default_agent(sio):
     sub = default_subscriber(sio)
+    if OPENAI_CONNECTOR == "async":
+        return Agent(AsyncGpt4Vision(debug=True), subscriber=sub, fast_lm=AsyncGpt35(debug=True))
     agent = Agent(Gpt4Vision(debug=True), subscriber=sub, fast_lm=Gpt35(debug=True))
     return agent
 
@@ -458,7 +799,9 @@ def main():
     sub.push(SubscriberMessageType.GlobalInfoSet, ("task", "Geolocating Image"))
     logging.basicConfig(level=logging.INFO)
     img_loc = sys.argv[1] if len(sys.argv) else "./images/anon/12.png"
-    res = agent.lats(agent.image_pmpt(img_loc, additional_info))
+    res = agent.run(agent.image_pmpt(img_loc, additional_info))
+    agent.close()
+    sub.close()
     print(res)
     input("success! Press enter to exit.")
 
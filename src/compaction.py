@@ -0,0 +1,233 @@
+"""
+History compaction, applied to the message history before it is sent to the model.
+
+Deep branches otherwise resend every image and every raw observation on each call.
+`BudgetCompactor` keeps the history within a token and image budget:
+stale observations are replaced by their summary, older images are downsampled and then dropped.
+The first messages (task prompt and query image) are never compacted.
+
+Configured with HISTORY_COMPACTION (off | budget), HISTORY_MAX_TOKENS, HISTORY_MAX_IMAGES and HISTORY_MAX_THUMBNAILS.
+"""
+import logging
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock, get_ident
+from typing import List, Sequence, Tuple, Dict
+
+import attr
+from PIL import Image
+
+from .context import Context, Message, MessageHistory
+from .messages import ObservationMessage
+from .session import Session
+
+IMG_TAG_PATTERN = re.compile(r"<img (.*?)>")
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 1000  # A full resolution image, roughly
+THUMBNAIL_TOKENS = 100
+THUMBNAIL_SIZE = 256
+CACHE_SIZE = 1024
+
+
+def text_tokens(text: str) -> int:
+    return len(IMG_TAG_PATTERN.sub("", text)) // CHARS_PER_TOKEN
+
+
+def thumbnail(path: str) -> str:
+    """
+    A downsampled copy of a local image, stored next to it.
+    """
+    src = Path(path)
+    dst = src.with_name(f"{src.stem}_thumb{THUMBNAIL_SIZE}.jpg")
+    if not dst.exists():
+        im = Image.open(src)
+        im.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        tmp = dst.with_suffix(f".{os.getpid()}.{get_ident()}.tmp")
+        im.convert("RGB").save(tmp, format="JPEG")
+        os.replace(tmp, dst)
+    return str(dst)
+
+
+@attr.s(frozen=True)
+class CompactionReport:
+    tokens_before: int = attr.ib()
+    tokens_after: int = attr.ib()
+    images_before: int = attr.ib()
+    images_after: int = attr.ib()
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def __add__(self, other: "CompactionReport") -> "CompactionReport":
+        return CompactionReport(
+            self.tokens_before + other.tokens_before,
+            self.tokens_after + other.tokens_after,
+            self.images_before + other.images_before,
+            self.images_after + other.images_after,
+        )
+
+
+class HistoryCompactor:
+    """
+    Compacts a message history. The base class leaves it untouched.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self._totals: Dict[str, CompactionReport] = {}
+
+    def compact_prefix(self, messages: Tuple[Message, ...]) -> Tuple[List[Message], CompactionReport | None]:
+        return list(messages), None
+
+    def __call__(self, context: Context | Sequence[Message], session: Session) -> List[Message]:
+        """
+        Compact the history of a node, or a list of messages.
+        Messages appended to a node's history (e.g. evaluation prompts) are kept as is.
+        """
+        messages = context.messages if isinstance(context, Context) else context
+        if isinstance(messages, MessageHistory):
+            prefix, extra = messages._base, list(messages._extra)
+        else:
+            prefix, extra = tuple(messages), []
+        res, report = self.compact_prefix(prefix)
+        if report is None:
+            return res + extra
+        if report.tokens_saved:
+            logging.info(f"Compacted history: {report.tokens_before} -> {report.tokens_after} tokens, "
+                         f"{report.images_before} -> {report.images_after} images")
+        with self.lock:
+            total = self._totals.get(session.id)
+            total = report if total is None else total + report
+            self._totals[session.id] = total
+        session.update_info({"compaction": {
+            "tokens_saved": report.tokens_saved,
+            "total_tokens_saved": total.tokens_saved,
+            "total_tokens_sent": total.tokens_after,
+        }})
+        return res + extra
+
+
+class BudgetCompactor(HistoryCompactor):
+    def __init__(self,
+                 max_tokens: int = 60_000,
+                 max_images: int = 6,
+                 max_thumbnails: int = 6,
+                 keep_first: int = 2,
+                 keep_recent: int = 4):
+        """
+        :param max_tokens: token budget of the history, images included
+        :param max_images: images kept at full resolution, most recent first
+        :param max_thumbnails: images kept downsampled after those, the rest are dropped
+        :param keep_first: leading messages that are never compacted
+        :param keep_recent: trailing messages whose observations are kept in full while within budget
+        """
+        super().__init__()
+        self.max_tokens = max_tokens
+        self.max_images = max_images
+        self.max_thumbnails = max_thumbnails
+        self.keep_first = keep_first
+        self.keep_recent = keep_recent
+        # The compacted prefix of each node's history, keyed by the identity of its cached history tuple
+        self._cache: OrderedDict[int, Tuple[Tuple[Message, ...], List[Message], CompactionReport]] = OrderedDict()
+
+    def compact_prefix(self, messages: Tuple[Message, ...]) -> Tuple[List[Message], CompactionReport]:
+        with self.lock:
+            cached = self._cache.get(id(messages))
+            if cached is not None and cached[0] is messages:
+                self._cache.move_to_end(id(messages))
+                return cached[1], cached[2]
+        res, report = self._compact(messages)
+        with self.lock:
+            self._cache[id(messages)] = (messages, res, report)
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return res, report
+
+    def _compact(self, messages: Tuple[Message, ...]) -> Tuple[List[Message], CompactionReport]:
+        n = len(messages)
+        texts = [m.message for m in messages]
+        pinned = min(self.keep_first, n)
+        images_before = sum(len(IMG_TAG_PATTERN.findall(t)) for t in texts)
+        tokens_before = sum(text_tokens(t) for t in texts) + images_before * IMAGE_TOKENS
+
+        summarized = [False] * n
+        observations = [i for i in range(pinned, n) if isinstance(messages[i], ObservationMessage)]
+        for i in observations:
+            if i < n - self.keep_recent:
+                texts[i] = messages[i].summary
+                summarized[i] = True
+
+        # Rank the remaining images, newest first
+        ranked = [(i, tag) for i in range(n - 1, pinned - 1, -1) for tag in reversed(IMG_TAG_PATTERN.findall(texts[i]))]
+        thumbs = set(ranked[self.max_images:self.max_images + self.max_thumbnails])
+        dropped = set(ranked[self.max_images + self.max_thumbnails:])
+
+        def cost():
+            tokens = 0
+            for i, t in enumerate(texts):
+                tokens += text_tokens(t)
+                for tag in IMG_TAG_PATTERN.findall(t):
+                    if (i, tag) in dropped:
+                        continue
+                    tokens += THUMBNAIL_TOKENS if (i, tag) in thumbs else IMAGE_TOKENS
+            return tokens
+
+        # Over budget: summarize recent observations too, oldest first, except the latest
+        for i in observations[:-1]:
+            if cost() <= self.max_tokens:
+                break
+            if not summarized[i]:
+                texts[i] = messages[i].summary
+                summarized[i] = True
+        # Still over budget: drop images, oldest first, except the latest
+        for key in reversed(ranked[1:]):
+            if cost() <= self.max_tokens:
+                break
+            thumbs.discard(key)
+            dropped.add(key)
+
+        res = []
+        for i, message in enumerate(messages):
+            text = texts[i]
+            if i >= pinned:
+                text = IMG_TAG_PATTERN.sub(lambda m: self._render_image(i, m.group(1), thumbs, dropped), text)
+            res.append(message if text == message.message else self._variant(message, text))
+        images_after = sum(len(IMG_TAG_PATTERN.findall(m.message)) for m in res)
+        return res, CompactionReport(tokens_before, cost(), images_before, images_after)
+
+    @staticmethod
+    def _render_image(i: int, tag: str, thumbs, dropped) -> str:
+        if (i, tag) in dropped:
+            return "(image omitted)"
+        if (i, tag) in thumbs and not tag.startswith("http"):
+            try:
+                return f"<img {thumbnail(tag)}>"
+            except OSError as e:
+                logging.warning(f"Could not downsample {tag}: {e}")
+                return "(image omitted)"
+        return f"<img {tag}>"
+
+    @staticmethod
+    def _variant(message: Message, text: str) -> Message:
+        """
+        The compacted form of a message, reused across calls so its processed form stays cached.
+        """
+        variants = message.__dict__.setdefault("_compacted", {})
+        if text not in variants:
+            variants[text] = Message(text, message.role)
+        return variants[text]
+
+
+def default_compactor() -> HistoryCompactor:
+    match os.getenv("HISTORY_COMPACTION") or "off":
+        case "budget":
+            return BudgetCompactor(
+                max_tokens=int(os.getenv("HISTORY_MAX_TOKENS") or 60_000),
+                max_images=int(os.getenv("HISTORY_MAX_IMAGES") or 6),
+                max_thumbnails=int(os.getenv("HISTORY_MAX_THUMBNAILS") or 6),
+            )
+        case _:
+            return HistoryCompactor()
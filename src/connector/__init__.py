@@ -1,6 +1,8 @@
-from typing import List, Optional
+from abc import ABC, abstractmethod
+from typing import List, Optional, Iterator, Callable
 from ..context import Context, Message
 from ..session import Session
+from .aio import run_sync
 
 
 class LMM:
@@ -8,5 +10,26 @@ class LMM:
         pass
 
 
+    def prompt_stream(self, context: Context | List[Message], session: Session, stop: Optional[List[str]] = None, n: int = 1, temperature: float|None = None,
+                      complete_prefix: Optional[Callable[[str], Optional[str]]] = None) -> Iterator[Message]:
+        """
+        Yield responses as soon as each one is available.
+        :param complete_prefix: given a response generated so far, returns the part that is already usable, if any
+        """
+        yield from self.prompt(context, session, stop=stop, n=n, temperature=temperature)
+
     def heartbeat(self) -> bool:
         pass
+
+
+class AsyncLMM(LMM, ABC):
+    """
+    An LMM whose requests are coroutines, so many prompts can be in flight without a thread each.
+    `prompt` blocks on `aprompt`, so it can stand in for any other LMM.
+    """
+    @abstractmethod
+    async def aprompt(self, context: Context | List[Message], session: Session, stop: Optional[List[str]] = None, n: int = 1, temperature: float|None = None) -> List[Message]:
+        pass
+
+    def prompt(self, context: Context | List[Message], session: Session, stop: Optional[List[str]] = None, n: int = 1, temperature: float|None = None) -> List[Message]:
+        return run_sync(self.aprompt(context, session, stop=stop, n=n, temperature=temperature))
@@ -0,0 +1,48 @@
+"""
+The event loop shared by the async connectors.
+
+Every async HTTP client lives on this loop, in a daemon thread, so that connection pools are shared
+by all sessions and agent threads in the process, whichever loop (if any) the caller runs on.
+"""
+import asyncio
+import threading
+from typing import Coroutine, TypeVar
+
+T = TypeVar("T")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_lock = threading.Lock()
+
+
+def io_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="connector-io", daemon=True).start()
+        return _loop
+
+
+def run_sync(coro: Coroutine[None, None, T]) -> T:
+    """
+    Run a coroutine on the shared loop, blocking the calling thread until it is done.
+    """
+    loop = io_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("run_sync called from the connector loop, await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+async def on_io_loop(coro: Coroutine[None, None, T]) -> T:
+    """
+    Await a coroutine on the shared loop from any event loop.
+    """
+    loop = io_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
@@ -0,0 +1,210 @@
+"""
+Async OpenAI connectors.
+
+All requests go through one pooled `AsyncOpenAI` client per process, living on the shared connector loop,
+and are metered by a `RateLimiter` fed from the provider's rate-limit headers.
+Only 429 and 5xx responses are retried; anything else (bad requests, our own bugs) fails immediately.
+
+For offline load tests, point OPENAI_API_BASE at `python -m src.connector.mock_openai`.
+"""
+import asyncio
+import logging
+import os
+from typing import List, Dict
+
+import backoff
+import httpx
+import openai
+from openai import AsyncOpenAI
+from openai._types import NOT_GIVEN, NotGiven
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from rich import print
+
+from . import AsyncLMM, Message, Context
+from .aio import on_io_loop
+from .gptv import MultiGenStrategy, proc_messages, _batch_messages, _split_batch
+from .rate_limit import RateLimiter, estimate_tokens, is_retryable
+from .response_cache import response_cache
+from ..session import Session
+from ..compaction import HistoryCompactor, default_compactor
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS") or 64)
+try:
+    import h2  # noqa: F401
+
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+_clients: Dict[bool, AsyncOpenAI] = {}
+limiter = RateLimiter()
+
+
+def shared_client(verify: bool = True) -> AsyncOpenAI:
+    """
+    The process-wide async client. Must be used from the connector loop.
+    """
+    if verify not in _clients:
+        _clients[verify] = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_API_BASE") or None,
+            timeout=360,
+            max_retries=0,  # Retries are ours, so they respect the rate limiter
+            http_client=httpx.AsyncClient(
+                http2=HTTP2,
+                verify=verify,
+                limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS),
+            )
+        )
+    return _clients[verify]
+
+
+def _on_backoff(details):
+    e = details["exception"]
+    logging.warning(f"OpenAI request failed with {e.status_code}, retry {details['tries']}")
+
+
+@backoff.on_exception(backoff.expo, openai.APIStatusError, max_tries=5, max_value=30,
+                      giveup=lambda e: not is_retryable(e), on_backoff=_on_backoff)
+async def _request(verify: bool, **params) -> ChatCompletion:
+    messages = params["messages"]
+    max_tokens = params.get("max_tokens")
+    n = params.get("n")
+    estimated = estimate_tokens(
+        messages,
+        None if isinstance(max_tokens, NotGiven) else max_tokens,
+        1 if isinstance(n, NotGiven) or n is None else n
+    )
+    await limiter.acquire(estimated)
+    try:
+        raw = await shared_client(verify).chat.completions.with_raw_response.create(**params)
+    except openai.APIStatusError as e:
+        limiter.settle(estimated, 0)
+        if e.status_code == 429:
+            limiter.throttled(e.response.headers)
+        raise
+    limiter.update(raw.headers)
+    res = raw.parse()
+    limiter.settle(estimated, res.usage.total_tokens if res.usage else estimated)
+    return res
+
+
+async def acomplete(verify: bool = True, **params) -> ChatCompletion:
+    """
+    Create a chat completion with the shared client, through the response cache.
+    """
+    async def request(**kwargs):
+        return await on_io_loop(_request(verify, **kwargs))
+
+    res = await response_cache.acreate(request, **params)
+    if not res.choices:
+        raise Exception("No response from OpenAI")
+    return res
+
+
+class AsyncGpt4Vision(AsyncLMM):
+    MODEL = "gpt-4o"
+
+    def __init__(self,
+                 debug: bool = False,
+                 max_tokens: int = 3000,
+                 multi_gen_strategy: MultiGenStrategy = MultiGenStrategy.BATCH,
+                 disable_cert_verification: bool = False,
+                 compactor: HistoryCompactor | None = None
+                 ):
+        self.debug = debug
+        self.max_tokens = max_tokens
+        self.multi_gen_strategy = multi_gen_strategy
+        self.compactor = compactor or default_compactor()
+        self.verify = not disable_cert_verification
+
+    async def _complete(self, messages: List[Message], session: Session, **params) -> ChatCompletion:
+        # Image processing may upload files, so it stays off the event loop
+        processed = await asyncio.to_thread(proc_messages, messages, session)
+        return await acomplete(
+            self.verify,
+            model=self.MODEL,
+            messages=processed,
+            max_tokens=self.max_tokens,
+            timeout=360,
+            **params
+        )
+
+    async def aprompt(self, context: Context | List[Message],
+                      session: Session,
+                      stop: List[str] | NotGiven = NOT_GIVEN,
+                      n: int = 1,
+                      temperature: float | NotGiven = NOT_GIVEN,
+                      multi_gen_strategy: MultiGenStrategy | None = None
+                      ) -> List[Message]:
+        """
+        Prompt GPT-4 Vision
+        :param temperature: temperature of generation
+        :param context: the state of the conversation
+        :param stop: stop tokens
+        :param n: number of responses
+        :return: List of messages
+        """
+        multi_gen_strategy = multi_gen_strategy or self.multi_gen_strategy
+        # Compaction opens and re-encodes images, so it stays off the event loop
+        msg: List[Message] = await asyncio.to_thread(self.compactor, context, session)
+        stop = NOT_GIVEN if stop is None else stop
+        temperature = NOT_GIVEN if temperature is None else temperature
+        if multi_gen_strategy == MultiGenStrategy.BATCH and n == 1:
+            multi_gen_strategy = MultiGenStrategy.SEQUENTIAL
+        choices: List[ChatCompletionMessage] = []
+        match multi_gen_strategy:
+            case MultiGenStrategy.SAMPLE:
+                res = await self._complete(msg, session, stop=stop, temperature=temperature, n=n)
+                choices = [r.message for r in res.choices]
+            case MultiGenStrategy.SEQUENTIAL:
+                for i in range(n):
+                    cur_msg = list(msg)
+                    if i > 0:
+                        cur_msg.append(Message(f"Previously Generated messages: {list(map(lambda x: x.content, choices))}. "
+                                               f"Now, generate a different choice:"))
+                    res = await self._complete(cur_msg, session, stop=stop, temperature=temperature)
+                    choices.append(res.choices[0].message)
+            case MultiGenStrategy.BATCH:
+                res = await self._complete(_batch_messages(list(msg), n), session, stop=["<END>"],
+                                           temperature=temperature)
+                choices = _split_batch(res.choices[0].message.content, n)
+
+        if self.debug:
+            print("Choices:")
+            for c in choices:
+                print(c.content)
+                print("---")
+        return [Message(c.content, c.role) for c in choices]
+
+
+class AsyncGpt35(AsyncLMM):
+    def __init__(self, model_name: str = "gpt-3.5-turbo", debug: bool = False):
+        self.model_name = model_name
+        self.debug = debug
+
+    async def aprompt(self, context: Context | List[Message], session: Session,
+                      stop: List[str] | NotGiven = NOT_GIVEN, n: int = 1,
+                      temperature: float | NotGiven = NOT_GIVEN) -> List[Message]:
+        """
+        Prompt GPT-3.5
+        :param context: the state of the conversation
+        :param n: number of responses
+        :return: List of messages
+        """
+        msg: List[Message] = context.messages if isinstance(context, Context) else context
+        messages = list(map(lambda x: {
+            "role": x.role or "user",
+            "content": x.message
+        }, msg))
+        if self.debug:
+            print(messages)
+        res = await acomplete(
+            model=self.model_name,
+            messages=messages,
+            stop=NOT_GIVEN if stop is None else stop,
+            temperature=NOT_GIVEN if temperature is None else temperature,
+            n=n
+        )
+        return [Message(r.message.content, r.message.role) for r in res.choices]
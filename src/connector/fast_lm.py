@@ -6,7 +6,10 @@ from openai import OpenAI
 from openai._types import NOT_GIVEN, NotGiven
 from typing import List, Dict
 import backoff
+import openai
 from . import LMM
+from .rate_limit import is_retryable
+from .response_cache import response_cache
 from .. import config
 from ..context import Context, Message
 from ..session import Session
@@ -22,10 +25,24 @@ class Gpt35(LMM):
         )
         self.debug = debug
 
-    @backoff.on_exception(backoff.expo, Exception, max_tries=5)
     def _create_completions(self, model: str, messages: List[Dict], max_tokens: int | NotGiven = NOT_GIVEN,
                             stop: List[str] | NotGiven = NOT_GIVEN, temperature: float | NotGiven = NOT_GIVEN,
                             timeout: float | NotGiven = NOT_GIVEN, n: int | NotGiven = NOT_GIVEN) -> ChatCompletion:
+        return response_cache.create(
+            self._request_completions,
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stop=stop,
+            temperature=temperature,
+            timeout=timeout,
+            n=n
+        )
+
+    @backoff.on_exception(backoff.expo, openai.APIStatusError, max_tries=5, giveup=lambda e: not is_retryable(e))
+    def _request_completions(self, model: str, messages: List[Dict], max_tokens: int | NotGiven = NOT_GIVEN,
+                             stop: List[str] | NotGiven = NOT_GIVEN, temperature: float | NotGiven = NOT_GIVEN,
+                             timeout: float | NotGiven = NOT_GIVEN, n: int | NotGiven = NOT_GIVEN) -> ChatCompletion:
         res = self.client.chat.completions.create(
             model=model,
             messages=messages,
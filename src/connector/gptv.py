@@ -1,6 +1,6 @@
 import re
 from io import BytesIO
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, Callable, Tuple
 from enum import Enum
 from functools import partial
 
@@ -17,8 +17,12 @@ from rich import print
 import logging
 from ..utils import encode_image, DEBUG_DIR
 from ..session import Session
+from ..compaction import HistoryCompactor, default_compactor
+from .rate_limit import is_retryable
+from .response_cache import response_cache, CacheMode
 import hashlib
 import backoff
+import openai
 import httpx
 
 
@@ -28,44 +32,53 @@ class MultiGenStrategy(Enum):
     BATCH = 3
 
 
+IMG_TAG_PATTERN = re.compile(r"<img (.*?)>")
+# Shared pool for resolving image urls, rather than one executor per message
+image_executor = ThreadPoolExecutor(max_workers=8)
+
+
+def _parse_content(m: str) -> Tuple[Tuple[bool, str], ...]:
+    """
+    Split a message into text and image tag parts, as (is_image, text or tag) pairs.
+    """
+    img_tags = set(IMG_TAG_PATTERN.findall(m))
+    return tuple((block in img_tags, block) for block in IMG_TAG_PATTERN.split(m) if block != "")
+
+
+def _to_content(parts: Tuple[Tuple[bool, str], ...], im_urls: Dict[str, str]) -> List[Dict]:
+    return [
+        {"type": "image_url", "image_url": {"url": im_urls[block]}} if is_image else {"type": "text", "text": block}
+        for is_image, block in parts
+    ]
+
+
 def proc_messages(messages: List[Message], session: Session) -> List[Dict]:
     """
     Process messages from the chat history to a HumanMessage object. Cuz Gemini does not support chat mode yet.
+    The split into text and image tags is cached on each message, keyed by the message text, which keeps
+    ProxiedMessage entries fresh. Image payloads are not: they are resolved through `utils.im_cache` on every call,
+    so they stay within its memory bound however many messages refer to them.
     :param messages:
     :return:
     """
-    img_tag_pattern = re.compile(r"<img (.*?)>")
-    res = []
+    parts = []
     for message in messages:
         m = message.message
-        img_tags = img_tag_pattern.findall(m)
-        im_urls = {}
-        executor = ThreadPoolExecutor()
-        for tag in img_tags:
-            im_urls[tag] = executor.submit(utils.proc_image_url, tag, session)
-        for tag, future in im_urls.items():
-            im_urls[tag] = future.result()
-        blocks = img_tag_pattern.split(m)
-        output = []
-        for block in blocks:
-            if block == "":
-                continue
-            if block in img_tags:
-                image_object = {
-                    "type": "image_url",
-                    "image_url": {"url": im_urls[block]},
-                }
-                output.append(image_object)
-            else:
-                output.append({"type": "text", "text": block})
-        res.append({"role": message.role or "user", "content": output})
-    return res
+        cached = getattr(message, "_proc_cache", None)
+        if cached is None or cached[0] != m:
+            cached = (m, _parse_content(m))
+            message._proc_cache = cached
+        parts.append(cached[1])
+    tags = {block for p in parts for is_image, block in p if is_image}
+    futures = {tag: image_executor.submit(utils.proc_image_url, tag, session) for tag in tags}
+    im_urls = {tag: future.result() for tag, future in futures.items()}
+    return [
+        {"role": message.role or "user", "content": _to_content(p, im_urls)}
+        for message, p in zip(messages, parts)
+    ]
 
 
-def _generate_batch(lm, messages: List[Message], session: Session, n: int) -> List[ChatCompletionMessage]:
-    # this should only be used with the ReACT flow
-    if n == 1:
-        return _generate_sequential(lm, messages, session, n)
+def _batch_messages(messages: List[Message], n: int) -> List[Message]:
     msg_mod = messages.copy()
     msg_mod.append(Message(f"Please generate up to {n} different choices."
                            f"For each choice, follow the same format, "
@@ -78,13 +91,24 @@ def _generate_batch(lm, messages: List[Message], session: Session, n: int) -> Li
                            f"ALWAYS include the exact letters `<Sep>` between each choice."
                            f"Remember, <Sep> is case sensitive."
                            f"Now, generate your choices: "))
-    res = lm(messages=proc_messages(msg_mod, session), stop=["<END>"])
+    return msg_mod
+
+
+def _generate_batch(lm, messages: List[Message], session: Session, n: int) -> List[ChatCompletionMessage]:
+    # this should only be used with the ReACT flow
+    if n == 1:
+        return _generate_sequential(lm, messages, session, n)
+    res = lm(messages=proc_messages(_batch_messages(messages, n), session), stop=["<END>"])
     if not res.choices:
         print(res)
         raise Exception("No response from GPT-4 Vision")
+    return _split_batch(res.choices[0].message.content, n)
+
+
+def _split_batch(content: str, n: int) -> List[ChatCompletionMessage]:
     choices = list(map(
         lambda x: ChatCompletionMessage(content=x, role="assistant"),
-        res.choices[0].message.content.split("<Sep>")
+        content.split("<Sep>")
     ))
     res = []
     for choice in choices:
@@ -94,6 +118,35 @@ def _generate_batch(lm, messages: List[Message], session: Session, n: int) -> Li
     return res[:n]
 
 
+def _stream_batch(lm_stream, messages: List[Message], session: Session, n: int,
+                  complete_prefix: Optional[Callable[[str], Optional[str]]] = None) -> Iterator[str]:
+    """
+    Streaming variant of `_generate_batch`.
+    Each choice is yielded once `complete_prefix` reports it usable, or at the next `<Sep>` otherwise.
+    """
+    cur = ""
+    sent = False
+    count = 0
+    for delta in lm_stream(messages=proc_messages(_batch_messages(messages, n), session), stop=["<END>"]):
+        cur += delta
+        while "<Sep>" in cur:
+            choice, cur = cur.split("<Sep>", 1)
+            if not sent and choice.strip() != "":
+                yield choice
+                count += 1
+            sent = False
+            if count >= n:
+                return
+        if not sent and complete_prefix is not None and (prefix := complete_prefix(cur)) is not None:
+            yield prefix
+            sent = True
+            count += 1
+            if count >= n:
+                return
+    if not sent and cur.strip() != "" and count < n:
+        yield cur
+
+
 def _generate_sample(lm, messages: List[Message], session: Session, n: int) -> List[ChatCompletionMessage]:
     res = lm(messages=proc_messages(messages, session), n=n)
     if not res.choices:
@@ -119,11 +172,14 @@ def _generate_sequential(lm, messages: List[Message], session: Session, n: int)
 
 
 class Gpt4Vision(LMM):
+    MODEL = "gpt-4o"
+
     def __init__(self,
                  debug: bool = False,
                  max_tokens: int = 3000,
                  multi_gen_strategy: MultiGenStrategy = MultiGenStrategy.BATCH,
-                 disable_cert_verification: bool = False
+                 disable_cert_verification: bool = False,
+                 compactor: HistoryCompactor | None = None
                  ):
         # Adds black bar containing the location of the image, since gpt-vision api does not recognize image order.
         # utils.toggle_blackbar()
@@ -135,11 +191,26 @@ class Gpt4Vision(LMM):
         self.debug = debug
         self.max_tokens = max_tokens
         self.multi_gen_strategy = multi_gen_strategy
+        self.compactor = compactor or default_compactor()
 
-    @backoff.on_exception(backoff.expo, Exception, max_tries=5)
     def _create_completions(self, model: str, messages: List[Dict], max_tokens: int | NotGiven = NOT_GIVEN,
                             stop: List[str] | NotGiven = NOT_GIVEN, temperature: float | NotGiven = NOT_GIVEN,
                             timeout: float | NotGiven = NOT_GIVEN, n: int | NotGiven = NOT_GIVEN) -> ChatCompletion:
+        return response_cache.create(
+            self._request_completions,
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stop=stop,
+            temperature=temperature,
+            timeout=timeout,
+            n=n
+        )
+
+    @backoff.on_exception(backoff.expo, openai.APIStatusError, max_tries=5, giveup=lambda e: not is_retryable(e))
+    def _request_completions(self, model: str, messages: List[Dict], max_tokens: int | NotGiven = NOT_GIVEN,
+                             stop: List[str] | NotGiven = NOT_GIVEN, temperature: float | NotGiven = NOT_GIVEN,
+                             timeout: float | NotGiven = NOT_GIVEN, n: int | NotGiven = NOT_GIVEN) -> ChatCompletion:
         res = self.client.chat.completions.create(
             model=model,
             messages=messages,
@@ -153,6 +224,59 @@ class Gpt4Vision(LMM):
             raise Exception("No response from GPT-4 Vision")
         return res
 
+    @backoff.on_exception(backoff.expo, openai.APIStatusError, max_tries=5, giveup=lambda e: not is_retryable(e))
+    def _request_stream(self, model: str, messages: List[Dict], max_tokens: int | NotGiven = NOT_GIVEN,
+                        stop: List[str] | NotGiven = NOT_GIVEN, temperature: float | NotGiven = NOT_GIVEN,
+                        timeout: float | NotGiven = NOT_GIVEN):
+        return self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stop=stop,
+            temperature=temperature,
+            timeout=timeout,
+            stream=True
+        )
+
+    def _create_stream(self, **kwargs) -> Iterator[str]:
+        """
+        Stream the content of a completion. Closing the generator early closes the connection.
+        """
+        stream = self._request_stream(**kwargs)
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+
+    def prompt_stream(self, context: Context | List[Message],
+                      session: Session,
+                      stop: List[str] | NotGiven = NOT_GIVEN,
+                      n: int = 1,
+                      temperature: float | NotGiven = NOT_GIVEN,
+                      complete_prefix: Optional[Callable[[str], Optional[str]]] = None
+                      ) -> Iterator[Message]:
+        """
+        Prompt GPT-4 Vision, yielding each choice as soon as it is usable.
+        Only the batch strategy streams; other strategies, and recorded/replayed runs, fall back to `prompt`.
+        :param complete_prefix: returns the usable part of a choice that is still being generated, if any
+        """
+        if n == 1 or self.multi_gen_strategy != MultiGenStrategy.BATCH or response_cache.mode != CacheMode.PASSTHROUGH:
+            yield from self.prompt(context, session, stop=stop, n=n, temperature=temperature)
+            return
+        msg: List[Message] = self.compactor(context, session)
+        lm_stream = partial(self._create_stream,
+                            model=self.MODEL,
+                            max_tokens=self.max_tokens,
+                            temperature=temperature,
+                            timeout=360
+                            )
+        for choice in _stream_batch(lm_stream, msg, session, n, complete_prefix):
+            if self.debug:
+                print(f"Streamed choice: {choice}")
+            yield Message(choice, "assistant")
+
     def prompt(self, context: Context | List[Message],
                session: Session,
                stop: List[str] | NotGiven = NOT_GIVEN,
@@ -169,22 +293,22 @@ class Gpt4Vision(LMM):
         :return: List of messages
         """
         multi_gen_strategy = multi_gen_strategy or self.multi_gen_strategy
-        msg: List[Message] = context.messages if isinstance(context, Context) else context
+        msg: List[Message] = self.compactor(context, session)
         if self.debug and isinstance(context, Context):
             tar_path = DEBUG_DIR / f"{context.id()}.json"
             context.dump(tar_path)
             print(f"Dumped context to {tar_path}")
         if self.debug:
             print(msg)
-        messages = proc_messages(msg, session)
         if self.debug:
+            messages = proc_messages(msg, session)
             print(messages)
             print(
                 f"HASH of messages: {hashlib.md5(str(messages).encode()).hexdigest()}"
             )
         choices = []
         pmpt = partial(self._create_completions,
-                       model="gpt-4o",
+                       model=self.MODEL,
                        max_tokens=self.max_tokens,
                        stop=stop,
                        temperature=temperature,
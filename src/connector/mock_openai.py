@@ -0,0 +1,153 @@
+"""
+A local OpenAI-compatible chat completion server, for load testing the connectors offline.
+It enforces per-minute request and token limits, answering with the same rate-limit headers and 429s as the real API.
+
+Usage: python -m src.connector.mock_openai [--port 8089] [--latency 1.0] [--rpm 500] [--tpm 300000] [--error-rate 0.0]
+then set OPENAI_API_BASE=http://localhost:8089/v1
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+
+from aiohttp import web
+
+from .rate_limit import TokenBucket, estimate_tokens
+
+CHOICE = ("Thought: I should look at the image more closely.\n"
+          "Action: {tool}\n"
+          "Action Input: {input}\n")
+TOOLS = ["Geoclip", "Get StreetViews", "Satellite Locate"]
+
+
+def completion_text(body: dict) -> str:
+    messages = body["messages"]
+    last = messages[-1]["content"]
+    if not isinstance(last, str):
+        last = " ".join(block.get("text", "") for block in last)
+    batch = re.search(r"generate up to (\d+) different choices", last)
+    n = int(batch.group(1)) if batch else 1
+    choices = [CHOICE.format(tool=random.choice(TOOLS), input=f"image_{i}.png") for i in range(n)]
+    return "<Sep>".join(choices)
+
+
+class MockOpenAI:
+    def __init__(self, latency: float, rpm: float, tpm: float, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.served = 0
+        self.throttled = 0
+
+    def headers(self) -> dict:
+        self.requests._refill()
+        self.tokens._refill()
+        return {
+            "x-ratelimit-limit-requests": str(int(self.requests.limit)),
+            "x-ratelimit-remaining-requests": str(int(self.requests.level)),
+            "x-ratelimit-reset-requests": f"{60 / self.requests.limit:.3f}s",
+            "x-ratelimit-limit-tokens": str(int(self.tokens.limit)),
+            "x-ratelimit-remaining-tokens": str(int(self.tokens.level)),
+            "x-ratelimit-reset-tokens": f"{60 / self.tokens.limit:.3f}s",
+        }
+
+    def admit(self, cost: int) -> float | None:
+        """
+        Charge a request against the limits.
+        :return: None if admitted, otherwise the seconds to wait before retrying
+        """
+        self.requests._refill()
+        self.tokens._refill()
+        if self.requests.level < 1:
+            return (1 - self.requests.level) * 60 / self.requests.limit
+        if self.tokens.level < cost:
+            return (cost - self.tokens.level) * 60 / self.tokens.limit
+        self.requests.level -= 1
+        self.tokens.level -= cost
+        return None
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        n = body.get("n") or 1
+        cost = estimate_tokens(body["messages"], body.get("max_tokens"), n)
+        wait = self.admit(cost)
+        if wait is not None:
+            self.throttled += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={**self.headers(), "retry-after-ms": str(int(wait * 1000))}
+            )
+        if random.random() < self.error_rate:
+            return web.json_response({"error": {"message": "Mock server error", "type": "server_error"}}, status=500)
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        self.served += 1
+        texts = [completion_text(body) for _ in range(n)]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        if body.get("stream"):
+            return await self.stream(request, completion_id, created, body["model"], texts[0])
+        prompt_tokens = cost - (body.get("max_tokens") or 500) * n
+        completion_tokens = sum(len(t) // 4 for t in texts)
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": body["model"],
+            "choices": [
+                {"index": i, "message": {"role": "assistant", "content": t}, "finish_reason": "stop"}
+                for i, t in enumerate(texts)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }, headers=self.headers())
+
+    async def stream(self, request: web.Request, completion_id: str, created: int, model: str,
+                     text: str) -> web.StreamResponse:
+        res = web.StreamResponse(headers={**self.headers(), "Content-Type": "text/event-stream"})
+        await res.prepare(request)
+        for i in range(0, len(text), 16):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": text[i:i + 16]}, "finish_reason": None}],
+            }
+            await res.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(0.01)
+        await res.write(b"data: [DONE]\n\n")
+        await res.write_eof()
+        return res
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"served": self.served, "throttled": self.throttled})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.completions)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=1.0, help="mean response latency in seconds")
+    parser.add_argument("--rpm", type=float, default=500)
+    parser.add_argument("--tpm", type=float, default=300_000)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    args = parser.parse_args()
+    server = MockOpenAI(args.latency, args.rpm, args.tpm, args.error_rate)
+    web.run_app(server.app(), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Client-side rate limiting for OpenAI-compatible APIs.
+
+Requests and tokens are each metered by a token bucket. The buckets start from the configured
+per-minute limits (OPENAI_RPM, OPENAI_TPM) and are corrected from the provider's rate-limit headers
+after every response, so concurrent sessions wait locally instead of running into 429s together.
+"""
+import asyncio
+import os
+import re
+import time
+from typing import Mapping, Dict, List
+
+import openai
+
+OPENAI_RPM = float(os.getenv("OPENAI_RPM") or 500)
+OPENAI_TPM = float(os.getenv("OPENAI_TPM") or 300_000)
+IMAGE_TOKENS = 1000  # Rough cost of an image block, for estimating a request before it is sent
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 1e-3, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parse a reset duration as sent in x-ratelimit-reset-* headers, e.g. `20ms`, `1s`, `6m0s`.
+    :return: the duration in seconds
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in _DURATION_PATTERN.findall(value))
+
+
+def is_retryable(e: Exception) -> bool:
+    """
+    Only rate limiting and server errors are worth retrying.
+    """
+    return isinstance(e, openai.APIStatusError) and (e.status_code == 429 or e.status_code >= 500)
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: int | None = None, n: int = 1) -> int:
+    """
+    Estimate the tokens a request will be charged for, about 4 characters per token.
+    """
+    res = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            res += len(content) // 4
+            continue
+        for block in content:
+            if block.get("type") == "text":
+                res += len(block["text"]) // 4
+            else:
+                res += IMAGE_TOKENS
+    return res + (max_tokens or 500) * n
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `limit` per minute.
+    Only used from a single event loop, so it needs no locking.
+    """
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.level = limit
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.limit, self.level + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        # Requests larger than the bucket would never fit, so they only wait for a full bucket
+        amount = min(amount, self.limit)
+        while True:
+            self._refill()
+            wait = self.blocked_until - time.monotonic()
+            if wait <= 0:
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                wait = (amount - self.level) * 60 / self.limit
+            await asyncio.sleep(wait)
+
+    def refund(self, amount: float):
+        self._refill()
+        self.level = min(self.limit, self.level + amount)
+
+    def update(self, limit: str | None, remaining: str | None, reset: str | None):
+        """
+        Correct the bucket from the provider's view of the quota.
+        """
+        self._refill()
+        if limit is not None:
+            self.limit = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+        if reset is not None and remaining is not None and float(remaining) <= 0:
+            self.block(parse_duration(reset))
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """
+    Request and token buckets for one API endpoint.
+    """
+
+    def __init__(self, rpm: float = OPENAI_RPM, tpm: float = OPENAI_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    async def acquire(self, tokens: int):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+    def settle(self, estimated: int, used: int):
+        """
+        Return the difference between the estimated and the actual token usage of a request.
+        """
+        if used < estimated:
+            self.tokens.refund(estimated - used)
+        else:
+            self.tokens.level -= used - estimated
+
+    def update(self, headers: Mapping[str, str]):
+        self.requests.update(
+            headers.get("x-ratelimit-limit-requests"),
+            headers.get("x-ratelimit-remaining-requests"),
+            headers.get("x-ratelimit-reset-requests"),
+        )
+        self.tokens.update(
+            headers.get("x-ratelimit-limit-tokens"),
+            headers.get("x-ratelimit-remaining-tokens"),
+            headers.get("x-ratelimit-reset-tokens"),
+        )
+
+    def throttled(self, headers: Mapping[str, str]):
+        """
+        Handle a 429. Every pending request waits out the retry-after period, instead of retrying into the limit.
+        """
+        self.update(headers)
+        retry_after = headers.get("retry-after-ms")
+        if retry_after is not None:
+            seconds = float(retry_after) / 1000
+        else:
+            seconds = parse_duration(headers.get("retry-after") or "1")
+        self.requests.block(seconds)
+        self.tokens.block(seconds)
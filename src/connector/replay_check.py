@@ -0,0 +1,93 @@
+"""
+Check that a recorded session replays offline.
+
+Records a short conversation with the mock OpenAI server (LLM_CACHE=record), then replays it in a fresh process
+(LLM_CACHE=replay) whose OPENAI_API_BASE points nowhere, so any request that misses the cache fails.
+Each process has its own session, so the prompts differ by session id and run/<session id>/ paths, as real runs do.
+
+Usage: python -m src.connector.replay_check [--port 8091] [--steps 3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import List
+
+UNREACHABLE_API_BASE = "http://127.0.0.1:9/v1"
+
+
+def conversation(steps: int) -> List[str]:
+    from .fast_lm import Gpt35
+    from ..context import Message
+    from ..session import Session
+
+    session = Session()
+    lm = Gpt35()
+    history = [Message(f"Where is this image located?\nAvailable directory of access: run/{session.id}\n")]
+    outputs = []
+    for step in range(steps):
+        res = lm.prompt(history, session)[0]
+        outputs.append(res.message)
+        history += [res, Message(f"Observation{step}: results saved to run/{session.id}/step{step}.csv\n")]
+    return outputs
+
+
+def run_child(mode: str, cache_dir: str, api_base: str, steps: int, out: Path):
+    env = {
+        **os.environ,
+        "LLM_CACHE": mode,
+        "LLM_CACHE_DIR": cache_dir,
+        "OPENAI_API_BASE": api_base,
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "replay-check",
+    }
+    subprocess.run([sys.executable, "-m", "src.connector.replay_check", "--child", str(out), "--steps", str(steps)],
+                   env=env, check=True)
+
+
+def wait_for(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that a recorded session replays offline")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        Path(args.child).write_text(json.dumps(conversation(args.steps)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mock = subprocess.Popen([sys.executable, "-m", "src.connector.mock_openai", "--port", str(args.port),
+                                 "--latency", "0.05"])
+        try:
+            wait_for(f"http://127.0.0.1:{args.port}/stats")
+            run_child("record", tmp, f"http://127.0.0.1:{args.port}/v1", args.steps, Path(tmp) / "recorded.json")
+        finally:
+            mock.terminate()
+            mock.wait()
+        run_child("replay", tmp, UNREACHABLE_API_BASE, args.steps, Path(tmp) / "replayed.json")
+        recorded = json.loads((Path(tmp) / "recorded.json").read_text())
+        replayed = json.loads((Path(tmp) / "replayed.json").read_text())
+    if recorded != replayed:
+        print("Replayed responses differ from the recorded ones")
+        sys.exit(1)
+    print(f"Replayed {len(recorded)} responses offline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Opt-in on-disk cache of chat completions, for replayable runs.
+
+Set LLM_CACHE to one of:
+- passthrough (default): no caching.
+- record: serve cached responses, call the API on a miss and store the response.
+- replay: serve cached responses only, a miss raises `ResponseCacheMiss`. Runs fully offline.
+
+The n-th identical request made by a process maps to the n-th recorded response,
+so repeated prompts in a search (e.g. re-expanding a node) replay the same sequence as the recorded run.
+"""
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+from enum import Enum
+from pathlib import Path
+from threading import Lock, get_ident
+from typing import Callable, Dict, List, Any, Awaitable
+
+from openai._types import NotGiven
+from openai.types.chat import ChatCompletion
+
+from .. import utils
+
+
+class CacheMode(Enum):
+    PASSTHROUGH = "passthrough"
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+class ResponseCacheMiss(Exception):
+    pass
+
+
+# Object ids, e.g. session ids (also in run/<session id>/ paths) and node ids, which differ from run to run
+OBJECT_ID_REGEX = re.compile(r"\b0x[0-9a-f]{8,}\b")
+
+
+def canonical_text(text: str, ids: Dict[str, str]) -> str:
+    """
+    Replace object ids by placeholders numbered in order of first appearance.
+    :param ids: the placeholders assigned so far, shared by all the texts of a request
+    """
+    return OBJECT_ID_REGEX.sub(lambda m: ids.setdefault(m.group(0), f"<id{len(ids)}>"), text)
+
+
+def canonical_messages(messages: List[Dict]) -> List[Dict]:
+    """
+    Replace image payloads by a hash of the image content, so keys do not depend on upload urls,
+    and object ids by placeholders, so keys do not depend on the session.
+    """
+    res = []
+    ids: Dict[str, str] = {}
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            content = canonical_text(content, ids)
+        elif isinstance(content, list):
+            blocks = []
+            for block in content:
+                if block.get("type") == "text":
+                    block = {**block, "text": canonical_text(block["text"], ids)}
+                elif block.get("type") == "image_url":
+                    url = block["image_url"]["url"]
+                    if url.startswith("data:"):
+                        digest = hashlib.sha256(url.encode()).hexdigest()
+                    else:
+                        digest = utils.im_cache.source(url) or url
+                    block = {"type": "image", "digest": digest}
+                blocks.append(block)
+            content = blocks
+        res.append({"role": message["role"], "content": content})
+    return res
+
+
+class ResponseCache:
+    def __init__(self, mode: CacheMode = CacheMode.PASSTHROUGH, cache_dir: str | Path = "cache/llm"):
+        self.mode = mode
+        self.cache_dir = Path(cache_dir)
+        self.occurrences = Counter()
+        self.lock = Lock()
+
+    @staticmethod
+    def from_env() -> "ResponseCache":
+        return ResponseCache(
+            CacheMode(os.getenv("LLM_CACHE") or "passthrough"),
+            os.getenv("LLM_CACHE_DIR") or "cache/llm"
+        )
+
+    def key(self, model: str, messages: List[Dict], **params) -> str:
+        params = {k: v for k, v in params.items() if not isinstance(v, NotGiven)}
+        params.pop("timeout", None)
+        payload = json.dumps(
+            {"model": model, "messages": canonical_messages(messages), "params": params},
+            sort_keys=True
+        )
+        digest = hashlib.sha256(payload.encode()).hexdigest()
+        with self.lock:
+            occurrence = self.occurrences[digest]
+            self.occurrences[digest] += 1
+        return f"{digest}-{occurrence}"
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> ChatCompletion | None:
+        try:
+            with open(self._path(key)) as f:
+                return ChatCompletion.model_validate(json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, completion: ChatCompletion):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{get_ident()}.tmp")
+        tmp.write_text(completion.model_dump_json())
+        os.replace(tmp, path)
+
+    def create(self, fn: Callable[..., ChatCompletion], model: str, messages: List[Dict], **params) -> ChatCompletion:
+        """
+        Create a completion through the cache.
+        :param fn: the uncached completion function
+        """
+        if self.mode == CacheMode.PASSTHROUGH:
+            return fn(model=model, messages=messages, **params)
+        key = self.key(model, messages, **params)
+        res = self.get(key)
+        if res is not None:
+            return res
+        if self.mode == CacheMode.REPLAY:
+            raise ResponseCacheMiss(f"No recorded response for {key}")
+        res = fn(model=model, messages=messages, **params)
+        self.put(key, res)
+        return res
+
+    async def acreate(self, fn: Callable[..., Awaitable[ChatCompletion]], model: str, messages: List[Dict],
+                      **params) -> ChatCompletion:
+        """
+        Async variant of `create`.
+        :param fn: the uncached completion coroutine function
+        """
+        if self.mode == CacheMode.PASSTHROUGH:
+            return await fn(model=model, messages=messages, **params)
+        key = self.key(model, messages, **params)
+        res = self.get(key)
+        if res is not None:
+            return res
+        if self.mode == CacheMode.REPLAY:
+            raise ResponseCacheMiss(f"No recorded response for {key}")
+        res = await fn(model=model, messages=messages, **params)
+        self.put(key, res)
+        return res
+
+
+response_cache = ResponseCache.from_env()
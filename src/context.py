@@ -1,5 +1,8 @@
 import functools
-from typing import List, Optional
+import inspect
+import itertools
+import threading
+from typing import List, Optional, Tuple, Iterable, Sequence
 from pathlib import Path
 import json
 import hashlib
@@ -26,6 +29,53 @@ class Message:
             "role": self.role
         }
 
+class MessageHistory(Sequence):
+    """
+    Copy-on-write view over a node's message history.
+    The shared prefix is an immutable tuple cached on the node, so creating a view is O(1);
+    messages appended to the view (e.g. evaluation prompts) only live in the view.
+    """
+    __slots__ = ("_base", "_extra")
+
+    def __init__(self, base: Tuple[Message, ...] = (), extra: List[Message] | None = None):
+        self._base = base
+        self._extra = extra or []
+
+    def __len__(self):
+        return len(self._base) + len(self._extra)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return list(self)[item]
+        if item < 0:
+            item += len(self)
+        if item < len(self._base):
+            return self._base[item]
+        return self._extra[item - len(self._base)]
+
+    def __iter__(self):
+        return itertools.chain(self._base, self._extra)
+
+    def append(self, msg: Message):
+        self._extra.append(msg)
+
+    def extend(self, messages: Iterable[Message]):
+        self._extra.extend(messages)
+
+    def __iadd__(self, messages: Iterable[Message]) -> Self:
+        self.extend(messages)
+        return self
+
+    def __add__(self, messages: Iterable[Message]) -> Self:
+        return MessageHistory(self._base, self._extra + list(messages))
+
+    def copy(self) -> Self:
+        return MessageHistory(self._base, list(self._extra))
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class CtxState(Enum):
     Normal = 'normal'
     Running = 'running'
@@ -40,6 +90,7 @@ class Context:
     Context represents the state of an agent.
     In the frame of a LATS search, this can also be seen as a node of the search tree.
     """
+    VIRTUAL_LOSS = 1.0  # UCT penalty per concurrent worker whose path runs through this node
 
     def __init__(self,
                  parent: Self | None = None,
@@ -50,12 +101,20 @@ class Context:
                  state: CtxState = CtxState.Normal
                  ):
         self.cur_messages = cur_messages or []
+        self._history: Tuple[Message, ...] | None = None  # Materialized history, shared by reference with children
         self.transition = transition  # The last action or action-equivalent taken by the agent
         self.observation = observation  # The last observation made by the agent
         self.subscriber = subscriber
         self.run_state = state
         self.auxiliary = {}
 
+        # Delta updates
+        self.version = 0
+        self._delta_lock = threading.RLock()
+        self._new_messages: List[Message] = []
+        self._changed_fields = set()
+        self._changed_auxiliary = set()
+
         # LATS stuff
         self.parent = parent
         self.visits = 0
@@ -66,6 +125,8 @@ class Context:
         self.reward = 0.0
         self.exhausted = False  # If all children are terminal
         self.em = 0  # Exact match, evaluation metric
+        self.virtual_loss = 0  # Number of in-flight iterations passing through this node
+        self.in_flight = False  # Whether this node is currently claimed by an iteration
 
         if self.parent:
             self._push(SubscriberMessageType.AddNode, (
@@ -80,29 +141,86 @@ class Context:
                 ))
 
     def uct(self):
+        penalty = self.VIRTUAL_LOSS * self.virtual_loss
         if self.visits == 0:
-            return self.value
-        return self.value / self.visits + np.sqrt(2 * np.log(self.parent.visits) / self.visits)
+            return self.value - penalty
+        visits = self.visits + self.virtual_loss
+        parent_visits = self.parent.visits + self.parent.virtual_loss
+        return (self.value - penalty) / visits + np.sqrt(2 * np.log(parent_visits) / visits)
 
     @staticmethod
     def notify_update(func):
+        """
+        Push the changes made by a mutating method as a delta, tagged with the node's new version.
+        Mutating methods record what they changed with `_mark`.
+        """
         def wrapper(self, *args, **kwargs):
-            res = func(self, *args, **kwargs)
-            self._push(SubscriberMessageType.UpdateNode, (
-                hex(id(self)),
-                self.to_json()
-            ))
+            with self._delta_lock:
+                res = func(self, *args, **kwargs)
+                self.version += 1
+                self._push(SubscriberMessageType.UpdateNodeDelta, (
+                    hex(id(self)),
+                    self.version,
+                    self._take_delta()
+                ))
             return res
 
         return wrapper
 
+    def _mark(self, field: str, aux_keys=()):
+        self._changed_fields.add(field)
+        self._changed_auxiliary.update(aux_keys)
+
+    def _take_delta(self):
+        """
+        Collect the fields changed since the last delta.
+        transition and lats_data are small and can be assigned directly by the search, so they are always sent.
+        """
+        delta = {
+            "transition": self.transition_json(),
+            "lats_data": self.lats_json(),
+        }
+        if "history" in self._changed_fields:
+            # Includes the node's own new messages
+            delta["cur_messages"] = [m.to_json() for m in self.messages]
+        elif self._new_messages:
+            delta["messages"] = [m.to_json() for m in self._new_messages]
+        if "observation" in self._changed_fields:
+            delta["observation"] = self.observation
+        if "state" in self._changed_fields:
+            delta["state"] = self.run_state.value
+        if self._changed_auxiliary:
+            delta["auxiliary"] = {k: self.auxiliary[k] for k in self._changed_auxiliary if k in self.auxiliary}
+        self._new_messages = []
+        self._changed_fields = set()
+        self._changed_auxiliary = set()
+        return delta
+
     @notify_update
     def add_message(self, msg: Message):
         self.cur_messages.append(msg)
+        self._new_messages.append(msg)
+        self._invalidate_history()
 
     @notify_update
     def add_messages(self, messages: List[Message]):
         self.cur_messages.extend(messages)
+        self._new_messages.extend(messages)
+        self._invalidate_history()
+
+    def _invalidate_history(self):
+        self._history = None
+        for child in self.children:
+            child._ancestor_changed()
+
+    @notify_update
+    def _ancestor_changed(self):
+        """
+        Messages were added to an ancestor. Clients hold the full history of each node,
+        so it is sent again as `cur_messages`.
+        """
+        self._invalidate_history()
+        self._mark("history")
 
     def commit(self, message: List[Message] | Message | None = None, transition=None) -> Self:
         """
@@ -127,33 +245,40 @@ class Context:
     def digest(self):
         return hashlib.md5(str(self.messages).encode()).hexdigest()
 
-    def to_json(self):
-        transition = {
-            "type": "NO_ACTION"
-        }
+    def transition_json(self):
         match self.transition:
             case AgentAction():
-                transition = {
+                return {
                     "type": "AgentAction",
                     "tool": self.transition.tool,
                     "tool_input": self.transition.tool_input
                 }
             case AgentFinish():
-                transition = {
+                return {
                     "type": "AgentFinish",
                     "return_values": self.transition.return_values,
                 }
+        return {
+            "type": "NO_ACTION"
+        }
+
+    def lats_json(self):
+        return {
+            "visits": self.visits,
+            "value": self.value,
+            "depth": self.depth,
+        }
+
+    def to_json(self):
         return {
             "cur_messages": [m.to_json() for m in self.messages],
-            "transition": transition,
+            "transition": self.transition_json(),
             "observation": self.observation,
             "state": self.run_state.value,
-            "lats_data": {
-                "visits": self.visits,
-                "value": self.value,
-                "depth": self.depth,
-            },
-            "auxiliary": self.auxiliary
+            "lats_data": self.lats_json(),
+            # A copy, as queued subscribers serialize it later while the node keeps changing
+            "auxiliary": dict(self.auxiliary),
+            "version": self.version
         }
 
     def serialize_recursive(self):
@@ -196,25 +321,39 @@ class Context:
             ctx.visits = dat['visits']
             return ctx
 
+    def history(self) -> Tuple[Message, ...]:
+        """
+        The full message history, materialized once per node from the parent's cached history.
+        """
+        res = self._history
+        if res is None:
+            res = (self.parent.history() if self.parent else ()) + tuple(self.cur_messages)
+            self._history = res
+        return res
+
     @property
-    def messages(self) -> List[Message]:
-        return (self.parent.messages if self.parent else []) + self.cur_messages
+    def messages(self) -> MessageHistory:
+        return MessageHistory(self.history())
 
     @notify_update
     def set_observation(self, obs):
         self.observation = obs
+        self._mark("observation")
 
     @notify_update
     def set_auxiliary(self, key, value):
         self.auxiliary[key] = value
+        self._mark("auxiliary", [key])
 
     @notify_update
     def update_auxiliary(self, data):
         self.auxiliary.update(data)
+        self._mark("auxiliary", data.keys())
 
     @notify_update
     def set_state(self, state: CtxState):
         self.run_state = state
+        self._mark("state")
 
     @notify_update
     def notify(self):
@@ -222,14 +361,31 @@ class Context:
 
     @staticmethod
     def wrap_state(state: CtxState):
+        def find_node(args, kwargs):
+            possible_nodes = ([arg for arg in args if isinstance(arg, Context)]
+                              + [v for v in kwargs.values() if isinstance(v, Context)])
+            return possible_nodes[0] if possible_nodes else None
+
         def wrapper(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def awrapped(*args, **kwargs):
+                    node = find_node(args, kwargs)
+                    if node is None:
+                        return await func(*args, **kwargs)
+                    prev_state = node.run_state
+                    node.set_state(state)
+                    res = await func(*args, **kwargs)
+                    node.set_state(prev_state)
+                    return res
+
+                return awrapped
+
             @functools.wraps(func)
             def wrapped(*args, **kwargs):
-                possible_nodes = ([arg for arg in args if isinstance(arg, Context)]
-                                  + [v for v in kwargs.values() if isinstance(v, Context)])
-                if not possible_nodes:
+                node = find_node(args, kwargs)
+                if node is None:
                     return func(*args, **kwargs)
-                node = possible_nodes[0]
                 prev_state = node.run_state
                 node.set_state(state)
                 res = func(*args, **kwargs)
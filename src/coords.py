@@ -1,36 +1,205 @@
 from pathlib import Path
 from pydantic import BaseModel
 from PIL import Image
-from typing import List, Tuple, Any
+from typing import List, Tuple, Any, Dict, Iterable, Sequence
+import numpy as np
 import pandas as pd
-import io
-import folium
 import json
 
-from . import utils
+from . import utils, map_render
 from .session import Session
 
-PADDING = 0.001
+EARTH_RADIUS_M = 6_371_008.8
+_MISSING = object()  # Marks keys absent from a point's auxiliary data
+
+
+def _to_py(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _object_array(values: Iterable[Any], n: int) -> np.ndarray:
+    return np.fromiter(values, dtype=object, count=n)
+
+
+class Auxiliary(Sequence):
+    """
+    Columnar per-point auxiliary data. Indexing with an int gives the point's data as a dict,
+    indexing with a slice, an index array or a mask gives the auxiliary data of that subset (a view, for slices).
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray] | None = None, n: int = 0):
+        self.columns = columns or {}
+        self.n = n
+
+    @staticmethod
+    def from_rows(rows: Sequence[Dict], n: int | None = None) -> "Auxiliary":
+        n = len(rows) if n is None else n
+        if not rows:
+            return Auxiliary({}, n)
+        keys = dict.fromkeys(k for row in rows for k in row)
+        return Auxiliary({k: _object_array((row.get(k, _MISSING) for row in rows), n) for k in keys}, n)
+
+    def column(self, key: str) -> np.ndarray:
+        """
+        The values of a key for every point, None for points that do not have it.
+        """
+        col = self.columns[key]
+        if col.dtype != object:
+            return col
+        missing = np.fromiter((v is _MISSING for v in col), dtype=bool, count=len(col))
+        if not missing.any():
+            return col
+        col = col.copy()
+        col[missing] = None
+        return col
+
+    def with_column(self, key: str, values: Sequence[Any] | np.ndarray) -> "Auxiliary":
+        values = values if isinstance(values, np.ndarray) else _object_array(values, self.n)
+        if len(values) != self.n:
+            raise ValueError(f"Column {key} has {len(values)} values for {self.n} points")
+        return Auxiliary({**self.columns, key: values}, self.n)
+
+    def row(self, i: int) -> Dict:
+        return {k: _to_py(v[i]) for k, v in self.columns.items() if v[i] is not _MISSING}
+
+    def rows(self) -> List[Dict]:
+        cols = {k: v.tolist() for k, v in self.columns.items()}
+        return [{k: v[i] for k, v in cols.items() if v[i] is not _MISSING} for i in range(self.n)]
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            if item < 0:
+                item += self.n
+            if not 0 <= item < self.n:
+                raise IndexError(item)
+            return self.row(item)
+        if isinstance(item, slice):
+            n = len(range(self.n)[item])
+        else:
+            item = np.asarray(item)
+            n = int(item.sum()) if item.dtype == bool else len(item)
+        return Auxiliary({k: v[item] for k, v in self.columns.items()}, n)
+
+    def __iter__(self):
+        yield from self.rows()
 
 
 class Coords:
-    coords: List[Tuple[float, float]]  # lat, lon
-    auxiliary: List[Any]
+    """
+    A set of points, stored as an (N, 2) float64 array of lat, lon with columnar auxiliary data.
+    """
+    latlon: np.ndarray
+    auxiliary: Auxiliary
 
     def __init__(
-        self, coords: List[Tuple[float, float]], auxiliary: List[Any] | None = None
+        self, coords: Sequence[Tuple[float, float]] | np.ndarray, auxiliary: Sequence[Dict] | Auxiliary | None = None
     ):
-        self.coords = coords
-        self.auxiliary = auxiliary or [{}] * len(coords)
+        self.latlon = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if isinstance(auxiliary, Auxiliary):
+            self.auxiliary = auxiliary
+        else:
+            self.auxiliary = Auxiliary.from_rows(auxiliary or [], len(self.latlon))
+        self._index = None
+
+    @property
+    def coords(self) -> List[Tuple[float, float]]:
+        return list(map(tuple, self.latlon.tolist()))
+
+    @property
+    def lats(self) -> np.ndarray:
+        return self.latlon[:, 0]
+
+    @property
+    def lons(self) -> np.ndarray:
+        return self.latlon[:, 1]
 
     def split_latlon(self) -> Tuple[List[float], List[float]]:
-        return list(map(lambda x: x[0], self.coords)), list(
-            map(lambda x: x[1], self.coords)
-        )
+        return self.lats.tolist(), self.lons.tolist()
 
     def bbox(self):
-        x_cords, y_cords = self.split_latlon()
-        return [[min(x_cords), min(y_cords)], [max(x_cords), max(y_cords)]]
+        return [self.latlon.min(axis=0).tolist(), self.latlon.max(axis=0).tolist()]
+
+    def centroid(self) -> Tuple[float, float]:
+        """
+        The mean position on the sphere, so points across the antimeridian average correctly.
+        """
+        lat, lon = np.radians(self.lats), np.radians(self.lons)
+        x, y, z = (np.cos(lat) * np.cos(lon)).mean(), (np.cos(lat) * np.sin(lon)).mean(), np.sin(lat).mean()
+        return float(np.degrees(np.arctan2(z, np.hypot(x, y)))), float(np.degrees(np.arctan2(y, x)))
+
+    def distances(self, other: "Coords | None" = None) -> np.ndarray:
+        """
+        Haversine distance matrix in meters, between these points and another set (or themselves).
+        """
+        other = self if other is None else other
+        lat1, lon1 = np.radians(self.lats)[:, None], np.radians(self.lons)[:, None]
+        lat2, lon2 = np.radians(other.lats)[None, :], np.radians(other.lons)[None, :]
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    def distances_to(self, lat: float, lon: float) -> np.ndarray:
+        return self.distances(Coords([(lat, lon)]))[:, 0]
+
+    def index(self):
+        """
+        A haversine BallTree over the points, built on first use.
+        """
+        if self._index is None:
+            # Imported here, sklearn is slow to import and most tools never need the index
+            from sklearn.neighbors import BallTree
+            self._index = BallTree(np.radians(self.latlon), metric="haversine")
+        return self._index
+
+    def within(self, lat: float, lon: float, radius_m: float) -> "Coords":
+        """
+        The points within a radius of a location
+        """
+        if self._index is None:
+            return self[self.distances_to(lat, lon) <= radius_m]
+        idx = self._index.query_radius(np.radians([[lat, lon]]), r=radius_m / EARTH_RADIUS_M)[0]
+        return self[np.sort(idx)]
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> Tuple[np.ndarray, "Coords"]:
+        """
+        The k points nearest to a location, closest first
+        :return: their distances in meters, and the points
+        """
+        k = min(k, len(self))
+        dist, idx = self.index().query(np.radians([[lat, lon]]), k=k)
+        return dist[0] * EARTH_RADIUS_M, self[idx[0]]
+
+    def thin(self, min_distance_m: float) -> "Coords":
+        """
+        Drop points closer than `min_distance_m` to an earlier point, keeping the earlier one.
+        Order is preserved, so results sorted by relevance keep their best points.
+        """
+        if len(self) < 2:
+            return self
+        tree = self.index()
+        neighbours = tree.query_radius(np.radians(self.latlon), r=min_distance_m / EARTH_RADIUS_M)
+        dropped = np.zeros(len(self), dtype=bool)
+        kept = []
+        for i in range(len(self)):
+            if dropped[i]:
+                continue
+            kept.append(i)
+            dropped[neighbours[i]] = True
+        return self[np.asarray(kept)]
+
+    def top_k(self, scores: np.ndarray, k: int) -> "Coords":
+        """
+        The k highest scoring points, best first
+        """
+        scores = np.asarray(scores)
+        k = min(k, len(scores))
+        idx = np.argpartition(-scores, k - 1)[:k] if k else np.arange(0)
+        return self[idx[np.argsort(-scores[idx], kind="stable")]]
+
+    def with_column(self, key: str, values: Sequence[Any] | np.ndarray) -> "Coords":
+        return Coords(self.latlon, self.auxiliary.with_column(key, values))
 
     def render(self) -> Image.Image:
         """
@@ -38,14 +207,14 @@ class Coords:
         :param coords:
         :return:
         """
-        bbox = self.bbox()
-        m = folium.Map()
-        m.fit_bounds(bbox, padding=[PADDING] * 4)
-        for coord in self.coords:
-            folium.Marker(coord).add_to(m)
-        imdat = m._to_png(5)
-        im = Image.open(io.BytesIO(imdat))
-        return im
+        return map_render.render(self.coords)
+
+    @staticmethod
+    def render_many(coord_sets: List["Coords"]) -> List[Image.Image]:
+        """
+        Visualizes several sets of coordinates at once, sharing basemap tiles between them
+        """
+        return map_render.render_many([c.coords for c in coord_sets])
 
     def to_prompt(self, session: Session, prefix="", plain=False, render=True, store=True):
         res = ""
@@ -62,15 +231,15 @@ class Coords:
         return res
 
     def to_csv(self, path: str | Path):
-        df = pd.DataFrame(self.coords, columns=["lat", "lon"])
-        df["auxiliary"] = [json.dumps(x) for x in self.auxiliary]
+        df = pd.DataFrame(self.latlon, columns=["lat", "lon"])
+        df["auxiliary"] = [json.dumps(x) for x in self.auxiliary.rows()]
         df.to_csv(path, index=False)
 
     @staticmethod
     def from_csv(path: str | Path):
         df = pd.read_csv(path)
         return Coords(
-            coords=df[["lat", "lon"]].values.tolist(),
+            coords=df[["lat", "lon"]].to_numpy(dtype=np.float64),
             auxiliary=[json.loads(x) for x in df["auxiliary"]]
             if "auxiliary" in df.columns
             else None,
@@ -78,13 +247,13 @@ class Coords:
 
     def to_geojson(self):
         features = []
-        for coord, aux in zip(self.coords, self.auxiliary):
+        for coord, aux in zip(self.latlon[:, ::-1].tolist(), self.auxiliary.rows()):
             features.append(
                 {
                     "type": "Feature",
                     "geometry": {
                         "type": "Point",
-                        "coordinates": coord[::-1]
+                        "coordinates": coord
                     },
                     "properties": aux
                 }
@@ -123,8 +292,18 @@ class Coords:
                 return Coords.from_geojson(path)
             case _:
                 raise ValueError("Unsupported file format")
+
+    def __getitem__(self, item):
+        """
+        An int gives the point as a (lat, lon) tuple. Slices, index arrays and masks give the subset as Coords;
+        slices share memory with this instance.
+        """
+        if isinstance(item, (int, np.integer)):
+            return tuple(self.latlon[item].tolist())
+        return Coords(self.latlon[item], self.auxiliary[item])
+
     def __len__(self):
-        return len(self.coords)
+        return len(self.latlon)
 
     def __repr__(self):
         return str(self.coords)
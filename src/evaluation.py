@@ -62,7 +62,7 @@ def evaluate(target_folder: Path):
         img_path = target_folder / row['image']
         sio_sub.push(SubscriberMessageType.GlobalInfoSet, ("image", str(img_path)))
         try:
-            res = agent.lats(agent.image_pmpt(img_path))
+            res = agent.run(agent.image_pmpt(img_path))
             pred = utils.sanitize(res.transition.tool_input)
             cords.loc[i, 'pred'] = pred
             print(f"Predicted: {pred} for image {row['image']}")
@@ -71,6 +71,8 @@ def evaluate(target_folder: Path):
             cords.to_csv(target_folder / "coords.csv", index=False)  # Save after each prediction
         except Exception as e:
             logging.error(f"Error in {img_path}: {e}")
+        finally:
+            agent.close()
 
 
 def evaluate_image(row, target_folder, sio_sub, session_ids):
@@ -80,7 +82,7 @@ def evaluate_image(row, target_folder, sio_sub, session_ids):
     sio_sub.push(SubscriberMessageType.GlobalInfoSet, ("image", str(img_path)))
     pred = ""
     try:
-        res = agent.lats(agent.image_pmpt(img_path))
+        res = agent.run(agent.image_pmpt(img_path))
         agent.backup()
         sio_sub.push(SubscriberMessageType.SetSessionInfoKey, (agent.session.id, "completed", True))
         session_ids.append(agent.session.id)  # Add session ID to the list
@@ -104,6 +106,8 @@ def evaluate_image(row, target_folder, sio_sub, session_ids):
         agent.backup()
         logging.error(f"Session ID: {agent.session.id}, Backed up.")
         sio_sub.push(SubscriberMessageType.SetSessionInfoKey, (agent.session.id, "error", str(e)))
+    finally:
+        agent.close()
 
 def write_session_log(session_ids, target_folder):
     timestamp = time.strftime("%Y-%m-%d-%H-%M-%S")
@@ -0,0 +1,110 @@
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock, get_ident
+from typing import Dict, Tuple
+
+IMAGE_CACHE_MB = float(os.getenv("IMAGE_CACHE_MB") or 256)
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR") or None  # Optional on-disk tier, can be shared by several processes
+DIGEST_MEMO_SIZE = 4096
+
+
+class ImageCache:
+    """
+    Thread-safe LRU cache of processed image payloads (data urls or uploaded urls), bounded by bytes.
+    Entries are keyed by the hash of the file content, so the same image saved under different paths is processed once.
+    """
+
+    def __init__(self, max_bytes: int = int(IMAGE_CACHE_MB * 1e6), disk_dir: str | Path | None = IMAGE_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.entries: OrderedDict[str, str] = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # (path, mtime, size) -> content digest, so unchanged files are not re-read for hashing
+        self._digests: OrderedDict[Tuple[str, int, int], str] = OrderedDict()
+        # uploaded url -> cache key, so uploads can be identified by content
+        self._sources: Dict[str, str] = {}
+
+    def digest(self, path: str | Path) -> str:
+        st = os.stat(path)
+        memo_key = (str(path), st.st_mtime_ns, st.st_size)
+        with self.lock:
+            if memo_key in self._digests:
+                self._digests.move_to_end(memo_key)
+                return self._digests[memo_key]
+        with open(path, "rb") as f:
+            res = hashlib.sha256(f.read()).hexdigest()
+        with self.lock:
+            self._digests[memo_key] = res
+            if len(self._digests) > DIGEST_MEMO_SIZE:
+                self._digests.popitem(last=False)
+        return res
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.txt"
+
+    def get(self, key: str) -> str | None:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        if self.disk_dir is not None:
+            try:
+                value = self._disk_path(key).read_text()
+            except FileNotFoundError:
+                pass
+            else:
+                self._put_memory(key, value)
+                with self.lock:
+                    self.disk_hits += 1
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def _put_memory(self, key: str, value: str):
+        with self.lock:
+            # Also for disk hits, whose uploads were made by another process or run
+            if not value.startswith("data:"):
+                self._sources[value] = key
+            if key in self.entries:
+                return
+            if len(value) > self.max_bytes:
+                return
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def source(self, payload: str) -> str | None:
+        """
+        The cache key a processed payload was stored under, if it is an uploaded url.
+        """
+        return self._sources.get(payload)
+
+    def put(self, key: str, value: str):
+        self._put_memory(key, value)
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename, so concurrent readers never see a partial entry
+            tmp = path.with_suffix(f".{os.getpid()}.{get_ident()}.tmp")
+            tmp.write_text(value)
+            os.replace(tmp, path)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
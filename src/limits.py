@@ -0,0 +1,34 @@
+"""
+Process-wide concurrency limits shared by every agent session running on this host.
+These are plain threading semaphores, so they hold for both the threaded and the asyncio LATS drivers.
+"""
+import os
+from threading import BoundedSemaphore, Lock
+from typing import Dict
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY") or 16)
+DEFAULT_TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY") or 4)
+# Heavier tools (model inference, bulk downloads) get tighter limits
+TOOL_CONCURRENCY: Dict[str, int] = {
+    "Get StreetViews": 2,
+    "Streetview Locate": 1,
+    "Satellite Locate": 1,
+    "Geoclip": 1,
+    "plot_satellite": 2,
+}
+
+llm_limit = BoundedSemaphore(LLM_CONCURRENCY)
+_tool_limits: Dict[str, BoundedSemaphore] = {}
+_tool_limits_lock = Lock()
+
+
+def tool_limit(name: str) -> BoundedSemaphore:
+    """
+    Get the semaphore guarding concurrent invocations of a tool
+    :param name: the tool name
+    :return:
+    """
+    with _tool_limits_lock:
+        if name not in _tool_limits:
+            _tool_limits[name] = BoundedSemaphore(TOOL_CONCURRENCY.get(name, DEFAULT_TOOL_CONCURRENCY))
+        return _tool_limits[name]
@@ -0,0 +1,236 @@
+"""
+Offline map rendering with PIL.
+
+Coordinates are drawn in web mercator over basemap tiles read from a local XYZ tile cache (MAP_TILE_DIR).
+Areas without cached tiles are drawn as a plain lat/lon grid. If MAP_TILE_URL is set (default `off`), missing tiles
+are fetched from it and stored in the cache, at most MAP_TILE_RATE requests per second and identified by
+MAP_TILE_USER_AGENT, as tile usage policies such as OpenStreetMap's require. Prefer a self-hosted or commercial
+tile server to the public OpenStreetMap one. No browser is involved, so a rendering takes milliseconds once the tiles
+are cached.
+"""
+import functools
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from threading import Lock
+from typing import List, Tuple, Sequence, Dict
+
+import requests
+from PIL import Image, ImageDraw, ImageFont
+
+TILE_SIZE = 256
+MAX_ZOOM = 17
+WIDTH, HEIGHT = 800, 600
+MARGIN = 40  # pixels kept free around the bounding box
+MAP_TILE_URL = os.getenv("MAP_TILE_URL") or "off"  # e.g. https://tile.openstreetmap.org/{z}/{x}/{y}.png
+MAP_TILE_DIR = Path(os.getenv("MAP_TILE_DIR") or "cache/tiles")
+MAP_TILE_RATE = float(os.getenv("MAP_TILE_RATE") or 2)  # requests per second
+MAP_TILE_USER_AGENT = os.getenv("MAP_TILE_USER_AGENT") or "geolocation-agent-map-renderer/1.0"
+ATTRIBUTION = "© OpenStreetMap contributors"
+BACKGROUND = (222, 230, 236)
+GRID = (190, 200, 210)
+GRID_LABEL = (110, 120, 130)
+MARKER = (214, 48, 49)
+BOX = (9, 132, 227)
+
+TILE_MEMO_SIZE = 512
+TILE_RETRY_AFTER = 300
+
+tile_executor = ThreadPoolExecutor(max_workers=8)
+_tiles: OrderedDict[Tuple[int, int, int], Image.Image] = OrderedDict()
+_failed: Dict[Tuple[int, int, int], float] = {}
+_tile_lock = Lock()
+_fetch_lock = Lock()
+_next_fetch = 0.0
+
+
+def project(lat: float, lon: float, zoom: int) -> Tuple[float, float]:
+    """
+    Web mercator projection to global pixel coordinates at a zoom level.
+    """
+    lat = max(min(lat, 85.0511), -85.0511)
+    scale = TILE_SIZE * 2 ** zoom
+    x = (lon + 180) / 360 * scale
+    s = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def unproject(x: float, y: float, zoom: int) -> Tuple[float, float]:
+    scale = TILE_SIZE * 2 ** zoom
+    lon = x / scale * 360 - 180
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / scale))))
+    return lat, lon
+
+
+def fit_zoom(coords: Sequence[Tuple[float, float]], width: int, height: int) -> int:
+    """
+    The largest zoom at which all coordinates fit in the image.
+    """
+    for zoom in range(MAX_ZOOM, -1, -1):
+        xs, ys = zip(*(project(lat, lon, zoom) for lat, lon in coords))
+        if max(xs) - min(xs) <= width - 2 * MARGIN and max(ys) - min(ys) <= height - 2 * MARGIN:
+            return zoom
+    return 0
+
+
+def load_tile(z: int, x: int, y: int) -> Image.Image | None:
+    """
+    Get a basemap tile from memory or the tile cache, fetching it if allowed.
+    Tiles that could not be fetched are not retried for TILE_RETRY_AFTER seconds, so rendering stays fast offline.
+    """
+    key = (z, x, y)
+    with _tile_lock:
+        if key in _tiles:
+            _tiles.move_to_end(key)
+            return _tiles[key]
+        if time.monotonic() < _failed.get(key, 0):
+            return None
+    im = _read_tile(z, x, y)
+    with _tile_lock:
+        if im is None:
+            _failed[key] = time.monotonic() + TILE_RETRY_AFTER
+        else:
+            _failed.pop(key, None)
+            _tiles[key] = im
+            if len(_tiles) > TILE_MEMO_SIZE:
+                _tiles.popitem(last=False)
+    return im
+
+
+def _throttle():
+    """
+    Space tile requests MAP_TILE_RATE per second apart, across all rendering threads.
+    """
+    global _next_fetch
+    with _fetch_lock:
+        now = time.monotonic()
+        wait = _next_fetch - now
+        _next_fetch = max(now, _next_fetch) + 1 / MAP_TILE_RATE
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _read_tile(z: int, x: int, y: int) -> Image.Image | None:
+    path = MAP_TILE_DIR / str(z) / str(x) / f"{y}.png"
+    if path.exists():
+        return Image.open(path).convert("RGB")
+    if MAP_TILE_URL == "off":
+        return None
+    _throttle()
+    try:
+        r = requests.get(MAP_TILE_URL.format(z=z, x=x, y=y), timeout=10,
+                         headers={"User-Agent": MAP_TILE_USER_AGENT})
+        r.raise_for_status()
+        im = Image.open(BytesIO(r.content)).convert("RGB")
+    except Exception as e:
+        logging.warning(f"Could not fetch tile {z}/{x}/{y}: {e}")
+        return None
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    im.save(tmp, format="PNG")
+    os.replace(tmp, path)
+    return im
+
+
+def _tile_grid(zoom: int, origin: Tuple[float, float], width: int, height: int) -> List[Tuple[int, int]]:
+    """
+    The tile columns and rows covering the image. Columns are not wrapped around the antimeridian.
+    """
+    n = 2 ** zoom
+    x0, y0 = int(origin[0] // TILE_SIZE), int(origin[1] // TILE_SIZE)
+    x1, y1 = int((origin[0] + width) // TILE_SIZE), int((origin[1] + height) // TILE_SIZE)
+    return [(col, row) for col in range(x0, x1 + 1) for row in range(y0, y1 + 1) if 0 <= row < n]
+
+
+def _tiles_for(zoom: int, origin: Tuple[float, float], width: int, height: int) -> List[Tuple[int, int, int]]:
+    n = 2 ** zoom
+    return [(zoom, col % n, row) for col, row in _tile_grid(zoom, origin, width, height)]
+
+
+def _draw_grid(draw: ImageDraw.ImageDraw, zoom: int, origin: Tuple[float, float], width: int, height: int):
+    """
+    Labelled lat/lon lines, drawn where no basemap is available.
+    """
+    lat_top, lon_left = unproject(origin[0], origin[1], zoom)
+    lat_bottom, lon_right = unproject(origin[0] + width, origin[1] + height, zoom)
+    span = max(lon_right - lon_left, 1e-6)
+    step = 10 ** math.floor(math.log10(span / 2))
+    decimals = max(0, -math.floor(math.log10(step)))
+    font = _font()
+    lon = math.floor(lon_left / step) * step
+    while lon <= lon_right:
+        x = project(0, lon, zoom)[0] - origin[0]
+        draw.line([(x, 0), (x, height)], fill=GRID)
+        draw.text((x + 2, 2), f"{(lon + 180) % 360 - 180:.{decimals}f}", fill=GRID_LABEL, font=font)
+        lon += step
+    lat = math.floor(lat_bottom / step) * step
+    while lat <= lat_top:
+        y = project(lat, 0, zoom)[1] - origin[1]
+        draw.line([(0, y), (width, y)], fill=GRID)
+        draw.text((2, y + 2), f"{lat:.{decimals}f}", fill=GRID_LABEL, font=font)
+        lat += step
+
+
+@functools.lru_cache(maxsize=1)
+def _font() -> ImageFont.ImageFont:
+    try:
+        return ImageFont.truetype("./fonts/Inter-Regular.ttf", 12)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _layout(coords: Sequence[Tuple[float, float]], width: int, height: int) -> Tuple[int, Tuple[float, float]]:
+    zoom = fit_zoom(coords, width, height)
+    xs, ys = zip(*(project(lat, lon, zoom) for lat, lon in coords))
+    origin = ((max(xs) + min(xs)) / 2 - width / 2, (max(ys) + min(ys)) / 2 - height / 2)
+    return zoom, origin
+
+
+def _compose(coords: Sequence[Tuple[float, float]], zoom: int, origin: Tuple[float, float],
+             tiles: Dict[Tuple[int, int, int], Image.Image | None], width: int, height: int) -> Image.Image:
+    im = Image.new("RGB", (width, height), BACKGROUND)
+    draw = ImageDraw.Draw(im)
+    n = 2 ** zoom
+    grid = _tile_grid(zoom, origin, width, height)
+    found = [(col, row, tiles.get((zoom, col % n, row))) for col, row in grid]
+    if any(tile is None for _, _, tile in found):
+        _draw_grid(draw, zoom, origin, width, height)
+    for col, row, tile in found:
+        if tile is not None:
+            im.paste(tile, (int(col * TILE_SIZE - origin[0]), int(row * TILE_SIZE - origin[1])))
+
+    points = [project(lat, lon, zoom) for lat, lon in coords]
+    points = [(x - origin[0], y - origin[1]) for x, y in points]
+    if len(points) > 1:
+        xs, ys = zip(*points)
+        draw.rectangle([min(xs) - 8, min(ys) - 8, max(xs) + 8, max(ys) + 8], outline=BOX, width=2)
+    font = _font()
+    for i, (x, y) in enumerate(points):
+        draw.ellipse([x - 6, y - 6, x + 6, y + 6], fill=MARKER, outline="white", width=2)
+        draw.text((x + 8, y - 8), str(i + 1), fill="black", font=font, stroke_width=2, stroke_fill="white")
+    if any(tile is not None for _, _, tile in found):
+        draw.text((width - 4, height - 4), ATTRIBUTION, fill="black", font=font, anchor="rb")
+    return im
+
+
+def render_many(coord_sets: Sequence[Sequence[Tuple[float, float]]],
+                width: int = WIDTH, height: int = HEIGHT) -> List[Image.Image]:
+    """
+    Render several coordinate sets, fetching the tiles they need once and in parallel.
+    :return: one image per coordinate set
+    """
+    layouts = [_layout(coords, width, height) if len(coords) else (0, (0.0, 0.0)) for coords in coord_sets]
+    needed = list({t for zoom, origin in layouts for t in _tiles_for(zoom, origin, width, height)})
+    tiles = dict(zip(needed, tile_executor.map(lambda t: load_tile(*t), needed)))
+    return [_compose(coords, zoom, origin, tiles, width, height)
+            for coords, (zoom, origin) in zip(coord_sets, layouts)]
+
+
+def render(coords: Sequence[Tuple[float, float]], width: int = WIDTH, height: int = HEIGHT) -> Image.Image:
+    return render_many([coords], width, height)[0]
@@ -12,3 +12,12 @@ class ProxiedMessage(Message):
     @property
     def message(self):
         return self.msg_fn(self.session)
+
+
+class ObservationMessage(Message):
+    """
+    An observation made by the agent, along with a shorter form that history compaction can substitute for it.
+    """
+    def __init__(self, msg: str, summary: str, role: str | None = None):
+        super().__init__(msg, role)
+        self.summary = summary
@@ -0,0 +1,81 @@
+"""
+Process-wide registry of the ML models used by the tools.
+
+Tool modules register a loader per model, and `get` loads each model once, on first use, in eval mode.
+Every session on this host then shares the same instance. MODEL_WARMUP (a comma separated list of names, or `all`)
+selects models to load in the background when the server starts, so the first tool call does not pay for it.
+"""
+import logging
+import os
+import time
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List
+
+_loaders: Dict[str, Callable[[], Any]] = {}
+_models: Dict[str, Any] = {}
+_locks: Dict[str, Lock] = {}
+_lock = Lock()
+
+
+def register(name: str, loader: Callable[[], Any] | None = None):
+    """
+    Register the loader of a model, can be used as a decorator
+    :param name: the model name
+    :param loader: builds the model, weights loaded and on its device
+    """
+    def wrap(fn: Callable[[], Any]) -> Callable[[], Any]:
+        with _lock:
+            _loaders[name] = fn
+            _locks.setdefault(name, Lock())
+        return fn
+
+    return wrap if loader is None else wrap(loader)
+
+
+def get(name: str) -> Any:
+    """
+    The model, loaded on first use. Concurrent callers wait for the same load.
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        if name not in _loaders:
+            raise KeyError(f"No model registered as {name}")
+        lock = _locks[name]
+    with lock:
+        if name not in _models:
+            start = time.perf_counter()
+            model = _loaders[name]()
+            if hasattr(model, "eval"):
+                model.eval()
+            _models[name] = model
+            logging.info(f"Loaded model {name} in {time.perf_counter() - start:.1f}s")
+    return _models[name]
+
+
+def loaded() -> List[str]:
+    return list(_models)
+
+
+def warmup(names: List[str] | None = None) -> Thread:
+    """
+    Load models in a background thread.
+    :param names: the models to load, MODEL_WARMUP by default
+    """
+    from . import tools  # noqa: F401, registers the loaders
+
+    if names is None:
+        setting = os.getenv("MODEL_WARMUP") or ""
+        names = list(_loaders) if setting == "all" else [n.strip() for n in setting.split(",") if n.strip()]
+
+    def run():
+        for name in names:
+            try:
+                get(name)
+            except Exception as e:
+                logging.warning(f"Could not warm up model {name}: {e}")
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    return thread
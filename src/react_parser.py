@@ -19,6 +19,9 @@ MISSING_ACTION_INPUT_AFTER_ACTION_ERROR_MESSAGE = (
 FINAL_ANSWER_AND_PARSABLE_ACTION_ERROR_MESSAGE = (
     "Parsing LLM output produced both a final answer and a parse-able action:"
 )
+ACTION_INPUT_REGEX = re.compile(r"Action\s*\w*\s*:[\s]*(.*?)[\s]*Action\s*\w*\s*Input\s*\w*\s*:", re.DOTALL)
+# The line after an action input, once it is streamed the input will not grow any further
+ACTION_INPUT_END_REGEX = re.compile(r"\n[\s]*(?:Observation|Thought)")
 
 
 class ReActSingleInputOutputParser(AgentOutputParser):
@@ -92,6 +95,24 @@ class ReActSingleInputOutputParser(AgentOutputParser):
         else:
             raise OutputParserException(f"Could not parse LLM output: `{text}`")
 
+    def complete_prefix(self, text: str) -> str | None:
+        """
+        Incremental parsing for streamed output.
+        :param text: the output generated so far
+        :return: the prefix containing a complete action, once an Observation or Thought line follows its
+        Action Input; None otherwise. Inputs may span several lines, so the end of a line is not enough.
+        Choices ended by `<Sep>` and final answers are only complete at the end of the choice.
+        """
+        if FINAL_ANSWER_ACTION in text:
+            return None
+        match = ACTION_INPUT_REGEX.search(text)
+        if match is None:
+            return None
+        end = ACTION_INPUT_END_REGEX.search(text, match.end())
+        if end is None:
+            return None
+        return text[:end.start()]
+
     @property
     def _type(self) -> str:
         return "react-single-input"
@@ -8,6 +8,7 @@ from typing import Self
 from .config import RUN_DIR
 from .context import Context
 from .subscriber import Subscriber, SubscriberMessageType
+from .transposition import TranspositionTable
 
 
 @define
@@ -19,6 +20,7 @@ class Session:
     tools: List[BaseTool] = Factory(list)
     subscriber: Subscriber = Factory(Subscriber)
     namespace: Dict = Factory(dict)
+    transpositions: TranspositionTable = Factory(TranspositionTable)
 
     @property
     def id(self):
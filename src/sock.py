@@ -7,9 +7,9 @@ from aiohttp import web
 from threading import Thread
 from PIL import Image
 
-from . import utils
+from . import utils, models
 from urllib.request import urlopen
-from .subscriber import SIOSubscriber, default_subscriber, SubscriberMessageType
+from .subscriber import SIOSubscriber, default_subscriber, SubscriberMessageType, set_server_loop
 from .agent import Agent, default_agent
 from .config import *
 from .feeder import process_url
@@ -33,8 +33,16 @@ def connect(sid, environ):
 def disconnect(sid):
     print("disconnect ", sid)
 
+def run_session(agent: Agent, prompt: str):
+    try:
+        agent.run(prompt, True)
+    finally:
+        agent.close()
+        agent.subscriber.close()
+
 @sio.on("start_session")
 def start_session(sid, data):
+    agent = None
     try:
         img_b64 = data['img_b64']
         with urlopen(img_b64) as response:
@@ -45,31 +53,39 @@ def start_session(sid, data):
         a_path = "run/user_upload.png" # TODO: fix this to be session specific
         im = Image.open(io.BytesIO(img_b64))
         im.save(a_path)
-        th = Thread(target=agent.lats, args=(agent.image_pmpt(a_path, description), True))
+        th = Thread(target=run_session, args=(agent, agent.image_pmpt(a_path, description)))
         th.start()
         return ses.id
     except Exception as e:
         print(e)
+        if agent is not None:
+            agent.close()
+            agent.subscriber.close()
         asyncio.run(sio.emit("error", str(e), room=sid))
         return
 
 @sio.on("from_social")
 def from_social(sid, data):
-    sub = default_subscriber(sio)
+    agent = None
     try:
         url = data['url']
         agent = default_agent(sio)
+        sub = agent.subscriber
         ses = agent.session
         sub.push(SubscriberMessageType.SetSessionInfoKey, (ses.id, "status", "Processing social media url..."))
         prompt = process_url(ses, url)
         sub.push(SubscriberMessageType.SetSessionInfoKey, (ses.id, "status", "Social media url processed."))
         sub.push(SubscriberMessageType.UrlProcessed, (url))
-        th = Thread(target=agent.lats, args=(prompt, True))
+        th = Thread(target=run_session, args=(agent, prompt))
         th.start()
         return ses.id
     except Exception as e:
         print(e)
+        if agent is not None:
+            agent.close()
+        sub = agent.subscriber if agent is not None else default_subscriber(sio)
         sub.push(SubscriberMessageType.Error, str(e))
+        sub.close()
         return
 
 app.router.add_static('/run', 'run')
@@ -79,6 +95,7 @@ app.router.add_static('/datasets', 'datasets')
 def run_srv():
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    set_server_loop(loop)
     runner = web.AppRunner(app)
     loop.run_until_complete(runner.setup())
     site = web.TCPSite(runner, 'localhost', 3141)
@@ -92,6 +109,7 @@ def start_srv():
 
 if __name__ == '__main__':
     sio, srv_thread = start_srv()
+    models.warmup()
     sio_sub = SIOSubscriber(sio)
     input("Press Enter to start...")
     input("Press Enter to stop...")
@@ -1,5 +1,5 @@
-from .subscriber import Subscriber, MultiSubscriber
-from .sio_sub import SIOSubscriber
+from .subscriber import Subscriber, MultiSubscriber, QueuedSubscriber
+from .sio_sub import SIOSubscriber, set_server_loop
 from .sqlite_sub import SQLiteSubscriber
 from .utils import default_subscriber
 from .subscriber_message import SubscriberMessageType
@@ -1,15 +1,52 @@
 from . import Subscriber
-from typing import Optional
+from typing import Optional, List, Tuple, Any
+from threading import Event
+import logging
 import socketio
 import asyncio
 from .subscriber_message import SubscriberMessageType
 
+_server_loop: Optional[asyncio.AbstractEventLoop] = None
+_server_loop_ready = Event()
+
+
+def set_server_loop(loop: asyncio.AbstractEventLoop):
+    """
+    Register the event loop the aiohttp/socketio server runs on.
+    """
+    global _server_loop
+    _server_loop = loop
+    _server_loop_ready.set()
+
+
+def server_loop(timeout: float | None = 30) -> asyncio.AbstractEventLoop:
+    if not _server_loop_ready.wait(timeout):
+        raise RuntimeError("Socket.io server loop is not running")
+    return _server_loop
+
+
 class SIOSubscriber(Subscriber):
-    def __init__(self, sio: Optional[socketio.AsyncServer] = None):
+    def __init__(self, sio: Optional[socketio.AsyncServer] = None, loop: Optional[asyncio.AbstractEventLoop] = None):
         if sio is None:
             from ..sock import start_srv
             sio, sub_thread = start_srv()
         self.sio = sio
+        self.loop = loop
+
+    def _submit(self, coro):
+        self.loop = self.loop or server_loop()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
 
     def push(self, msg_type: SubscriberMessageType, msg):
-        asyncio.run(self.sio.emit(msg_type.value, msg))
+        self._submit(self._emit([(msg_type, msg)]))
+
+    def push_batch(self, batch: List[Tuple[SubscriberMessageType, Any]]):
+        # Called from a QueuedSubscriber worker, so waiting here only holds back that worker
+        self._submit(self._emit(batch)).result()
+
+    async def _emit(self, batch: List[Tuple[SubscriberMessageType, Any]]):
+        for msg_type, msg in batch:
+            try:
+                await self.sio.emit(msg_type.value, msg)
+            except Exception:
+                logging.exception(f"Could not emit {msg_type.value}")
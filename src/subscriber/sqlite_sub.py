@@ -1,30 +1,125 @@
 from . import Subscriber
 from .subscriber_message import SubscriberMessageType
+from queue import Queue, Empty
+from threading import Thread, Lock
+from typing import Dict, List, Tuple, Any
+import atexit
 import sqlite3
 import datetime
+import time
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, type TEXT, message TEXT, timestamp TEXT, session_id TEXT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_type ON messages (type)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)",
+]
+INSERT = "INSERT INTO messages (type, message, timestamp, session_id) VALUES (?, ?, ?, ?)"
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for stmt in SCHEMA:
+        conn.execute(stmt)
+    conn.commit()
+    return conn
+
+
+class SQLiteWriter:
+    """
+    Process-wide writer for one database.
+    Keeps a single WAL-mode connection on its own thread, and inserts buffered rows with executemany
+    once FLUSH_SIZE rows are pending or FLUSH_INTERVAL seconds have passed.
+    """
+    FLUSH_SIZE = 500
+    FLUSH_INTERVAL = 0.5
+
+    _writers: Dict[str, "SQLiteWriter"] = {}
+    _writers_lock = Lock()
+
+    @classmethod
+    def get(cls, db_path: str) -> "SQLiteWriter":
+        with cls._writers_lock:
+            if db_path not in cls._writers:
+                writer = SQLiteWriter(db_path)
+                atexit.register(writer.flush)
+                cls._writers[db_path] = writer
+            return cls._writers[db_path]
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # Create the schema up front, so readers can query right away
+        connect(db_path).close()
+        self.queue = Queue()
+        self.worker = Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def write(self, rows: List[Tuple]):
+        for row in rows:
+            self.queue.put(row)
+
+    def flush(self):
+        """
+        Block until every buffered row has been committed.
+        """
+        self.queue.join()
+
+    def _next_batch(self) -> List[Tuple]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.FLUSH_INTERVAL
+        while len(batch) < self.FLUSH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = connect(self.db_path)
+        while True:
+            batch = self._next_batch()
+            try:
+                conn.executemany(INSERT, batch)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Could not write {len(batch)} analytics rows: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
 
 
 class SQLiteSubscriber(Subscriber):
+    queued = True  # SQLiteWriter already buffers off the producer's thread
+
     def __init__(self, db_path: str = "logs/analytics.db"):
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, type TEXT, message TEXT, timestamp TEXT, session_id TEXT NULL)")
-        conn.commit()
         self.db_path = db_path
+        self.writer = SQLiteWriter.get(db_path)
 
-    def push(self, msg_type: SubscriberMessageType, msg, session_id=None):
+    @staticmethod
+    def _row(msg_type: SubscriberMessageType, msg, session_id=None) -> Tuple:
         timestamp = datetime.datetime.now().isoformat()
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute("INSERT INTO messages (type, message, timestamp, session_id) VALUES (?, ?, ?, ?)",
-                         (msg_type.value, str(msg), timestamp, session_id))
-        conn.commit()
+        return msg_type.value, str(msg), timestamp, session_id
+
+    def push(self, msg_type: SubscriberMessageType, msg, session_id=None):
+        self.writer.write([self._row(msg_type, msg, session_id)])
+
+    def push_batch(self, batch: List[Tuple[SubscriberMessageType, Any]]):
+        self.writer.write([self._row(msg_type, msg) for msg_type, msg in batch])
+
+    def flush(self):
+        self.writer.flush()
 
 def replay_session(session_id, db_path:str = "logs/analytics.db"):
+    if db_path in SQLiteWriter._writers:
+        SQLiteWriter._writers[db_path].flush()
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
     cur.execute("SELECT * FROM messages WHERE type = 'session' AND message = ?", (session_id,))
     messages = cur.fetchall()
     conn.close()
-    return messages
\ No newline at end of file
+    return messages
@@ -1,22 +1,165 @@
-from threading import Thread
-from typing import List
+import logging
+import time
+from queue import Queue, Empty
+from threading import Lock, Thread
+from typing import List, Tuple, Any
 from .subscriber_message import SubscriberMessageType
 
+COALESCE_WINDOW = 0.05  # seconds a worker waits to gather a batch
+MAX_BATCH = 256
+_CLOSE = object()
+
 
 class Subscriber:
+    queued = False  # Whether push already returns without waiting on delivery
+
     def push(self, msg_type: SubscriberMessageType, msg):
         pass
 
+    def push_batch(self, batch: List[Tuple[SubscriberMessageType, Any]]):
+        for msg_type, msg in batch:
+            try:
+                self.push(msg_type, msg)
+            except Exception:
+                logging.exception(f"{type(self).__name__} could not deliver {msg_type}")
+
+    def close(self):
+        """
+        Release the resources of the subscriber once its session ended.
+        """
+        pass
+
+
+def merge_delta(a: dict, b: dict) -> dict:
+    res = {**a, **b}
+    if "cur_messages" in b:
+        # The history replaces, and already includes, the messages appended before it
+        res.pop("messages", None)
+    elif "messages" in a and "messages" in b:
+        res["messages"] = a["messages"] + b["messages"]
+    if "auxiliary" in a and "auxiliary" in b:
+        res["auxiliary"] = {**a["auxiliary"], **b["auxiliary"]}
+    return res
+
+
+def coalesce(batch: List[Tuple[SubscriberMessageType, Any]]) -> List[Tuple[SubscriberMessageType, Any]]:
+    """
+    Merge repeated node updates for the same node within a batch.
+    The merged update takes the place of the first one, so it still follows the node's creation.
+    """
+    res = []
+    index = {}
+    for msg_type, msg in batch:
+        match msg_type:
+            case SubscriberMessageType.UpdateNode:
+                key = (msg_type, msg[0])
+                if key in index:
+                    res[index[key]] = (msg_type, msg)
+                    continue
+            case SubscriberMessageType.UpdateNodeDelta:
+                key = (msg_type, msg[0])
+                if key in index:
+                    _, (node_id, _, delta) = res[index[key]]
+                    res[index[key]] = (msg_type, (node_id, msg[1], merge_delta(delta, msg[2])))
+                    continue
+            case _:
+                res.append((msg_type, msg))
+                continue
+        index[key] = len(res)
+        res.append((msg_type, msg))
+    return res
+
+
+class QueuedSubscriber(Subscriber):
+    """
+    Moves delivery off the producer's thread.
+    Messages are queued, and a worker drains them in coalesced batches into the wrapped subscriber until `close`.
+    """
+    queued = True
+
+    def __init__(self, subscriber: Subscriber, window: float = COALESCE_WINDOW, max_batch: int = MAX_BATCH):
+        self.subscriber = subscriber
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = Queue()
+        self.closed = False
+        self.close_lock = Lock()
+        self.worker = Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def push(self, msg_type: SubscriberMessageType, msg):
+        with self.close_lock:
+            if not self.closed:
+                self.queue.put((msg_type, msg))
+                return
+        # Late updates, e.g. from nodes outliving their session, are delivered on the caller's thread
+        self.subscriber.push(msg_type, msg)
+
+    def flush(self):
+        """
+        Block until every queued message has been delivered.
+        """
+        self.queue.join()
+
+    def close(self):
+        """
+        Stop the worker once it delivered the queued messages. Does not wait for it, use `flush` for that:
+        delivery may need the thread calling this, e.g. the socket.io server loop.
+        """
+        with self.close_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(_CLOSE)
+
+    def _next_batch(self) -> List[Tuple[SubscriberMessageType, Any]]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch and batch[-1] is not _CLOSE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            closing = batch[-1] is _CLOSE
+            messages = batch[:-1] if closing else batch
+            try:
+                if messages:
+                    self.subscriber.push_batch(coalesce(messages))
+            except Exception:
+                logging.exception(f"Subscriber {type(self.subscriber).__name__} could not deliver "
+                                  f"{len(messages)} messages")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if closing:
+                self.subscriber.close()
+                return
+
 
 class MultiSubscriber(Subscriber):
     def __init__(self, subscribers: List[Subscriber]):
-        self.subscribers = subscribers
+        self.subscribers = [
+            sub if sub.queued else QueuedSubscriber(sub)
+            for sub in subscribers
+        ]
 
     def push(self, msg_type: SubscriberMessageType, msg):
-        tasks = []
         for sub in self.subscribers:
-            t = Thread(target=sub.push, args=(msg_type, msg))
-            tasks.append(t)
-            t.start()
-        for t in tasks:
-            t.join()
\ No newline at end of file
+            sub.push(msg_type, msg)
+
+    def flush(self):
+        for sub in self.subscribers:
+            if hasattr(sub, "flush"):
+                sub.flush()
+
+    def close(self):
+        for sub in self.subscribers:
+            sub.close()
@@ -8,6 +8,7 @@ class SubscriberMessageType(Enum):
     AddNode = "add_node"
     RootNode = "root_node"
     UpdateNode = "update_node"
+    UpdateNodeDelta = "update_node_delta"
     UrlProcessed = "url_processed"
     Error = "error"
     SetSessionId = "set_session_id"
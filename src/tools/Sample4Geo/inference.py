@@ -2,26 +2,35 @@ import os
 import time
 from typing import List
 
+import albumentations as A
+import cv2
+import numpy as np
 import torch
+from albumentations.pytorch import ToTensorV2
 from dataclasses import dataclass
 from pathlib import Path
 
-from torch import autocast
 from tqdm import tqdm
 from PIL import Image
 from langchain.tools import tool
 
-from torchvision import transforms
+from torch.utils.data import DataLoader, Dataset
 
-from ...coords import Coords
+from ...coords import Coords, Auxiliary
 from ...session import Session
-from ... import utils
-from ..ml import load_image, using_mps, cosine_similarity
+from ... import utils, models
+from ..ml import load_image, using_mps, cosine_similarity, inference_context, precision_for, prepare_input, \
+    with_precision
 from ..wrapper import gtool, ToolResponse
+from ..vpr.descriptor_store import DescriptorStore, embed_cached
 from .sample4geo.model import TimmModel
+from .sample4geo.transforms import get_transforms_val
 
 CUR_PATH = Path(__file__).parent
 TOP_N = 15
+MODEL_NAME = "sample4geo-convnext_base-cvusa"  # descriptor store key with the precision, change with the checkpoint
+# Images per forward pass, the training batch size is far too large for CPU inference
+SAT_BATCH_SIZE = int(os.getenv("SAT_BATCH_SIZE") or 16)
 
 
 @dataclass
@@ -54,52 +63,67 @@ def get_model(config):
     return model
 
 
-def predict_from_paths(train_config, model, image_paths):
-    model.eval()
+models.register("sample4geo", with_precision("sample4geo", lambda: get_model(Configuration())))
 
-    preprocess = transforms.Compose([
-        transforms.ToTensor(),
-    ])
 
-    if train_config.verbose:
-        bar = tqdm(image_paths, total=len(image_paths))
-    else:
-        bar = image_paths
+# Validation transforms of the training setup. Ground queries are ordinary photos rather than the panoramas
+# the ground branch was trained on, so they are normalized without being resized to the panorama shape.
+satellite_transforms, _ = get_transforms_val(
+    (Configuration.img_size, Configuration.img_size), (Configuration.img_size, Configuration.img_size)
+)
+query_transforms = A.Compose([A.Normalize(), ToTensorV2()])
 
-    img_features_list = []
 
-    ids_list = []
+class PathDataset(Dataset):
+    def __init__(self, image_paths: List[str | Path], transforms: A.Compose):
+        self.image_paths = image_paths
+        self.transforms = transforms
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, index):
+        img = cv2.imread(str(self.image_paths[index]))
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return self.transforms(image=img)["image"]
+
+
+def encode_stream(train_config, model, image_paths, image_transforms=satellite_transforms):
+    """
+    Encode images in batches, decoded by DataLoader workers.
+    :return: yields the indices of the images in each batch, and their features as float32
+    """
+    batches = -(-len(image_paths) // SAT_BATCH_SIZE)
+    loader = DataLoader(
+        PathDataset(image_paths, image_transforms),
+        batch_size=SAT_BATCH_SIZE,
+        num_workers=min(train_config.num_workers, batches) if batches > 1 else 0,
+    )
     cast_dev = "cuda" if train_config.device == "cuda" else "cpu"
+    precision = precision_for("sample4geo")
+    start = 0
     with torch.no_grad():
-        for idx, img_path in enumerate(bar):
-            image = Image.open(img_path).convert("RGB")
-            image = preprocess(image).unsqueeze(0)  # Add batch dimension
-
-            with autocast(cast_dev):
-                image = image.to(train_config.device)
-                img_feature = model(image)
+        for batch in tqdm(loader, disable=not train_config.verbose):
+            with inference_context(precision, cast_dev):
+                img_feature = model(prepare_input(batch.to(train_config.device), precision))
 
                 # normalize is calculated in fp32
                 if train_config.normalize_features:
-                    img_feature = torch.nn.functional.normalize(img_feature, dim=-1)
+                    img_feature = torch.nn.functional.normalize(img_feature.float(), dim=-1)
 
-            # save features in fp32 for sim calculation
-            img_features_list.append(img_feature.to(torch.float32))
-            ids_list.append(idx)  # Use idx as ID if no other IDs are provided
+            yield list(range(start, start + len(batch))), img_feature.to(torch.float32).cpu().numpy()
+            start += len(batch)
 
-        # keep Features on GPU
-        img_features = torch.cat(img_features_list, dim=0)
-        ids_list = torch.tensor(ids_list).to(train_config.device)
 
-    if train_config.verbose:
-        bar.close()
-
-    return img_features, ids_list
+def predict_from_paths(train_config, model, image_paths, image_transforms=satellite_transforms):
+    img_features = np.concatenate([f for _, f in encode_stream(train_config, model, image_paths, image_transforms)])
+    ids_list = torch.arange(len(image_paths)).to(train_config.device)
+    return torch.from_numpy(img_features).to(train_config.device), ids_list
 
 
 def loc_sim(target: Path, db: List[Path], config: Configuration):
-    model = get_model(config)
-    w_target, _ = predict_from_paths(config, model, [target])
+    model = models.get("sample4geo")
+    w_target, _ = predict_from_paths(config, model, [target], query_transforms)
     w_db, _ = predict_from_paths(config, model, db)
     s = cosine_similarity(w_target, w_db)
     return s
@@ -116,26 +140,29 @@ def satellite_locate(img_id: str, db_loc: str, session: Session) -> ToolResponse
     """
     db_coords = Coords.load(utils.try_find_loc(session, db_loc, [".geojson", ".csv"]))
     cfig = Configuration()
-    res = loc_sim(Path(session.get_loc(img_id)), [Path(x["satellite_imagery"]) for x in db_coords.auxiliary], cfig)
-    new_coords = Coords(
-        coords=db_coords.coords,
-        auxiliary=[
-            {"confidence": float(x), "satellite_imagery": y["satellite_imagery"]}
-            for (x, y) in zip(res.flatten(), db_coords.auxiliary)
-        ],
-    )
-    top_n = torch.argsort(res, descending=True).flatten()[:TOP_N]
+    image_paths = db_coords.auxiliary.column("satellite_imagery")
+    model = models.get("sample4geo")
+    # Satellite tiles are stored by content, so tiles seen from another branch are not encoded again.
+    # Descriptors of one precision are only compared with each other
+    key = f"{MODEL_NAME}@{precision_for('sample4geo')}"
+    digests = embed_cached(key, image_paths.tolist(),
+                           lambda paths: encode_stream(cfig, model, paths))
+    _, query = next(encode_stream(cfig, model, [session.get_loc(img_id)], query_transforms))
+    scores = DescriptorStore.get(key).similarity(digests, query[0]).astype(np.float64)
+    new_coords = Coords(db_coords.latlon,
+                        Auxiliary({"confidence": scores, "satellite_imagery": image_paths}, len(db_coords)))
+    top = new_coords.top_k(scores, TOP_N)
     res = f"Top {TOP_N} possible locations based on visual place recognition: \n"
-    for t in range(len(top_n)):
+    for t, (coord, aux) in enumerate(zip(top, top.auxiliary)):
         res += (
             f"Location {t + 1}:\n"
-            f"Image: {utils.image_to_prompt(db_coords.auxiliary[top_n[t]]['satellite_imagery'], session)}\n"
-            f"Coordinate: {new_coords.coords[top_n[t]]}\n"
+            f"Image: {utils.image_to_prompt(aux['satellite_imagery'], session)}\n"
+            f"Coordinate: {coord}\n"
         )
     res += f"Full results: \n {new_coords.to_prompt(session, 'satloc_', render=False)}"
     return ToolResponse(res, {
-        "geojson": Coords([new_coords.coords[t] for t in top_n]).to_geojson(), 
-        "images": [db_coords.auxiliary[t]["satellite_imagery"] for t in top_n]}
+        "geojson": Coords(top.latlon).to_geojson(),
+        "images": top.auxiliary.column("satellite_imagery").tolist()}
     )
 
 
@@ -4,6 +4,7 @@ from tqdm import tqdm
 from .utils import AverageMeter
 from torch.cuda.amp import autocast
 import torch.nn.functional as F
+from ...ml import inference_context, precision_for, prepare_input
 
 
 def train(
@@ -142,18 +143,21 @@ def predict(train_config, model, dataloader):
 
     img_features_list = []
 
+    # torch.cuda.amp.autocast does nothing on CPU, use the configured precision on either device
+    precision = precision_for("sample4geo")
+    device_type = "cuda" if train_config.device == "cuda" else "cpu"
     ids_list = []
     with torch.no_grad():
         for img, ids in bar:
             ids_list.append(ids)
 
-            with autocast():
-                img = img.to(train_config.device)
+            with inference_context(precision, device_type):
+                img = prepare_input(img.to(train_config.device), precision)
                 img_feature = model(img)
 
                 # normalize is calculated in fp32
                 if train_config.normalize_features:
-                    img_feature = F.normalize(img_feature, dim=-1)
+                    img_feature = F.normalize(img_feature.float(), dim=-1)
 
             # save features in fp32 for sim calculation
             img_features_list.append(img_feature.to(torch.float32))
@@ -0,0 +1,76 @@
+"""
+A local stand-in for the Static Maps API, for running satellite tools offline.
+It serves synthetic imagery that is a function of the global web mercator pixel,
+so adjacent requests line up exactly and stitched mosaics can be checked for seams.
+
+Usage: python -m src.tools.gcp.mock_staticmap [--port 8090] [--latency 0.2]
+then set STATICMAP_URL=http://localhost:8090/maps/api/staticmap
+"""
+import argparse
+import asyncio
+import random
+from io import BytesIO
+
+import numpy as np
+from aiohttp import web
+from PIL import Image
+
+from ...map_render import project
+
+BLOCK = 64  # pixels per "field" of the synthetic imagery
+
+
+def synthetic(lat: float, lon: float, zoom: int, width: int, height: int) -> Image.Image:
+    cx, cy = project(lat, lon, zoom)
+    gx = np.arange(width) + round(cx - width / 2)
+    gy = np.arange(height) + round(cy - height / 2)
+    bx, by = np.meshgrid(gx // BLOCK, gy // BLOCK)
+    # A fixed pseudo-random color per block, with darker "roads" between blocks
+    seed = (bx * 73856093) ^ (by * 19349663)
+    rgb = np.stack([(seed >> s) & 0xFF for s in (0, 8, 16)], axis=-1).astype(np.uint8) // 2 + 64
+    road = (np.mod(gx, BLOCK)[None, :] < 4) | (np.mod(gy, BLOCK)[:, None] < 4)
+    rgb[road] = 30
+    return Image.fromarray(rgb, "RGB")
+
+
+class MockStaticMap:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.served = 0
+
+    async def staticmap(self, request: web.Request) -> web.Response:
+        q = request.query
+        try:
+            lat, lon = map(float, q["center"].split(","))
+            zoom = int(q["zoom"])
+            width, height = map(int, q["size"].split("x"))
+        except (KeyError, ValueError):
+            return web.Response(status=400, text="center, zoom and size are required")
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        im = synthetic(lat, lon, zoom, width, height)
+        buf = BytesIO()
+        fmt = "JPEG" if q.get("format", "png").startswith("jp") else "PNG"
+        im.save(buf, format=fmt)
+        self.served += 1
+        return web.Response(body=buf.getvalue(), content_type=f"image/{fmt.lower()}")
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"served": self.served})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/maps/api/staticmap", self.staticmap)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Static Maps server")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.2, help="mean response latency in seconds")
+    args = parser.parse_args()
+    web.run_app(MockStaticMap(args.latency).app(), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
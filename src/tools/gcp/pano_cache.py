@@ -0,0 +1,161 @@
+"""
+Persistent cache of Street View panorama searches and images, shared by every session and process on the host.
+
+Searches are stored by location cell (lat, lon rounded to PANO_CACHE_CELL_DECIMALS) and images by panorama id,
+in a SQLite index next to a content-addressed directory of JPEG blobs under PANO_CACHE_DIR (default cache/streetview,
+`off` disables the cache). Entries expire after PANO_CACHE_TTL_DAYS, and the least recently used images are evicted
+once the blobs exceed PANO_CACHE_MB.
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from threading import get_ident
+from typing import List, Tuple
+
+PANO_CACHE_DIR = os.getenv("PANO_CACHE_DIR") or "cache/streetview"
+PANO_CACHE_TTL_DAYS = float(os.getenv("PANO_CACHE_TTL_DAYS") or 90)
+PANO_CACHE_MB = float(os.getenv("PANO_CACHE_MB") or 2048)
+PANO_CACHE_CELL_DECIMALS = 4  # ~11m, below the spacing searched locations are thinned to
+EVICT_EVERY = 50  # image writes between size checks
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS cells (cell TEXT PRIMARY KEY, panos TEXT, fetched REAL)",
+    "CREATE TABLE IF NOT EXISTS images (pano_id TEXT PRIMARY KEY, digest TEXT, size INTEGER, fetched REAL, used REAL)",
+    "CREATE INDEX IF NOT EXISTS idx_images_used ON images (used)",
+    "CREATE INDEX IF NOT EXISTS idx_images_digest ON images (digest)",
+]
+
+Pano = Tuple[str, float, float]  # panorama id, lat, lon
+
+
+def cell(lat: float, lon: float) -> str:
+    return f"{lat:.{PANO_CACHE_CELL_DECIMALS}f},{lon:.{PANO_CACHE_CELL_DECIMALS}f}"
+
+
+class PanoCache:
+    """
+    Thread and process safe: each thread has its own WAL-mode connection, blobs are written then renamed.
+    """
+
+    def __init__(self, cache_dir: str | Path = PANO_CACHE_DIR, ttl_days: float = PANO_CACHE_TTL_DAYS,
+                 max_mb: float = PANO_CACHE_MB):
+        self.cache_dir = Path(cache_dir)
+        self.blob_dir = self.cache_dir / "blobs"
+        self.db_path = self.cache_dir / "index.sqlite"
+        self.ttl = ttl_days * 86400
+        self.max_bytes = int(max_mb * 1e6)
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        for stmt in SCHEMA:
+            conn.execute(stmt)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / f"{digest}.jpg"
+
+    def get_panos(self, lat: float, lon: float) -> List[Pano] | None:
+        """
+        The panoramas found by a search near a location, None if it was not searched within the TTL.
+        """
+        row = self._conn().execute(
+            "SELECT panos FROM cells WHERE cell = ? AND fetched > ?", (cell(lat, lon), time.time() - self.ttl)
+        ).fetchone()
+        return None if row is None else [tuple(p) for p in json.loads(row[0])]
+
+    def put_panos(self, lat: float, lon: float, panos: List[Pano]):
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO cells VALUES (?, ?, ?)",
+                         (cell(lat, lon), json.dumps(panos), time.time()))
+
+    def get_image(self, pano_id: str) -> bytes | None:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT digest FROM images WHERE pano_id = ? AND fetched > ?", (pano_id, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            data = self._blob_path(row[0]).read_bytes()
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            return None
+        with conn:
+            conn.execute("UPDATE images SET used = ? WHERE pano_id = ?", (time.time(), pano_id))
+        return data
+
+    def put_image(self, pano_id: str, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)", (pano_id, digest, len(data), now, now))
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop expired entries, then the least recently used images until the blobs fit in the size budget.
+        """
+        conn = self._conn()
+        expired = time.time() - self.ttl
+        with conn:
+            conn.execute("DELETE FROM cells WHERE fetched <= ?", (expired,))
+            stale = conn.execute("SELECT pano_id, digest FROM images WHERE fetched <= ?", (expired,)).fetchall()
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM images WHERE fetched > ?", (expired,)).fetchone()[0]
+            victims = list(stale)
+            if total > self.max_bytes:
+                for pano_id, digest, size in conn.execute(
+                        "SELECT pano_id, digest, size FROM images WHERE fetched > ? ORDER BY used", (expired,)):
+                    victims.append((pano_id, digest))
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+            conn.executemany("DELETE FROM images WHERE pano_id = ?", [(pano_id,) for pano_id, _ in victims])
+            digests = {digest for _, digest in victims}
+            # Blobs are shared by content, keep those another panorama still refers to
+            orphans = [d for d in digests
+                       if conn.execute("SELECT 1 FROM images WHERE digest = ? LIMIT 1", (d,)).fetchone() is None]
+        for digest in orphans:
+            try:
+                self._blob_path(digest).unlink()
+            except FileNotFoundError:
+                pass
+        if victims:
+            logging.info(f"Evicted {len(victims)} panoramas from the panorama cache")
+
+
+@functools.cache
+def get_pano_cache() -> PanoCache | None:
+    """
+    The process-wide panorama cache, created on first use so importing this module leaves no files behind.
+    None if PANO_CACHE_DIR is `off`.
+    """
+    return None if PANO_CACHE_DIR == "off" else PanoCache()
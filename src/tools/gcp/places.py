@@ -1,13 +1,15 @@
 from .auth import GOOGLE_MAPS_API_KEY
+from . import satellite_tiles
 from ...coords import Coords
 from PIL import Image
-import io
+from collections import defaultdict
 from functools import cache
 from ... import utils
 from ...session import Session
 from ..wrapper import gtool, ToolResponse
 from langchain.tools import tool
 
+import os
 import requests
 
 AUTH_HEAD = {"Content-Type": "application/json", "X-Goog-Api-Key": GOOGLE_MAPS_API_KEY}
@@ -63,6 +65,9 @@ def text_search(query: str, session: Session):
 
 SATELLITE_CAP = 125
 TOP_N = 15
+SATELLITE_SPACING_M = 40
+# Show clustered points as one stitched image instead of one image per point
+SATELLITE_MOSAIC = (os.getenv("SATELLITE_MOSAIC") or "off") == "on"
 
 
 @gtool(cached=True)
@@ -72,39 +77,61 @@ def plot_satellite(coords_loc: str, session: Session) -> ToolResponse:
     :param coords_loc: the location of the coordinate csv or geojson file
     :return:
     """
-    coords = Coords.load(utils.try_find_loc(session, coords_loc, [".geojson", ".csv"]))
+    # Points closer than this fall in the same tile
+    coords = Coords.load(utils.try_find_loc(session, coords_loc, [".geojson", ".csv"])).thin(SATELLITE_SPACING_M)
     if len(coords) > SATELLITE_CAP:
         return ToolResponse(f"Too many coordinates: {len(coords)} > {SATELLITE_CAP}")
+    # Clustered points share grid cells, so overlapping neighbourhoods are fetched once
+    images, cells = satellite_tiles.images_around([(lat, lon) for lat, lon in coords])
+    utils.make_run_dir(session)
     retrieved = []
-    for coord in coords:
-        r = requests.get(
-            "https://maps.googleapis.com/maps/api/staticmap",
-            params={
-                "center": f"{coord[0]},{coord[1]}",
-                "zoom": 19,
-                "size": "640x640",
-                "maptype": "satellite",
-                "key": GOOGLE_MAPS_API_KEY,
-            },
-        )
-        im = Image.open(io.BytesIO(r.content))
-        loc = utils.save_img(im, "satellite_res", session)
+    for coord, im in zip(coords, images):
+        if im is None:
+            continue
+        loc = utils.find_valid_loc(session, "satellite_res", ".jpg")
+        im.save(loc, quality=90)
         retrieved.append((coord, loc))
-    sim = "".join(
-        [f"{coord}: {utils.image_to_prompt(loc, session)}\n" for (coord, loc) in retrieved[:TOP_N]]
-    )
+    if not retrieved:
+        return ToolResponse("Could not retrieve satellite imagery for these coordinates.")
+
+    previews = [f"{coord}: {utils.image_to_prompt(loc, session)}\n" for coord, loc in retrieved]
+    if SATELLITE_MOSAIC:
+        previews = _mosaic_previews(retrieved, cells, session)
+    sim = "".join(previews[:TOP_N])
     full_res = Coords(
         coords=[x[0] for x in retrieved],
         auxiliary=[{"satellite_imagery": str(x[1])} for x in retrieved],
     )
     return ToolResponse(f"""
-    Satellite Images({len(retrieved)} available, showing top {len(sim)}):
+    Satellite Images({len(retrieved)} available, showing top {min(len(previews), TOP_N)}):
     {sim}
     Full Results:
     {full_res.to_prompt(session, 'satellite_', render=False)}
     """, {"images": [str(x[1]) for x in retrieved], "geojson": full_res.to_geojson()})
 
 
+def _mosaic_previews(retrieved, cells, session: Session):
+    """
+    One stitched image per cluster of points in adjacent cells, points on their own keep their own image.
+    """
+    by_cell = defaultdict(list)
+    for coord, loc in retrieved:
+        by_cell[satellite_tiles.cell_of(*coord)].append((coord, loc))
+    previews = []
+    for group in satellite_tiles.clusters(by_cell):
+        members = [x for c in sorted(group) for x in by_cell[c]]
+        if len(members) == 1:
+            coord, loc = members[0]
+            previews.append(f"{coord}: {utils.image_to_prompt(loc, session)}\n")
+            continue
+        loc = utils.find_valid_loc(session, "satellite_mosaic", ".jpg")
+        # Points fetched as centered images did not load their cells
+        cells.update(satellite_tiles.load_cells(c for c in group if c not in cells))
+        satellite_tiles.mosaic(group, cells).save(loc, quality=90)
+        previews.append(f"{[coord for coord, _ in members]}: {utils.image_to_prompt(loc, session)}\n")
+    return previews
+
+
 if __name__ == "__main__":
     from rich import print
     ses = Session()
@@ -0,0 +1,246 @@
+"""
+Satellite imagery on a fixed web mercator grid, fetched concurrently and cached on disk.
+
+The world at zoom z is cut into CELL x CELL pixel cells, each fetched once as a static map centered on the cell.
+Images around clustered points are cropped from the cells covering them, so nearby points share their fetches,
+and can be shown as one stitched mosaic. Isolated points, whose window would need up to 4 cells, are fetched as one
+image centered on the point instead. Cells are stored as served under SATELLITE_TILE_DIR/z/x/y.jpg, centered images
+under SATELLITE_TILE_DIR/z/windows (default cache/satellite), and fetched from STATICMAP_URL, which can point at
+`mock_staticmap` to run offline.
+"""
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from threading import get_ident
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+from ...map_render import project, unproject
+from .auth import GOOGLE_MAPS_API_KEY
+
+ZOOM = 19
+CELL = 640  # the largest size the Static Maps API serves
+STATICMAP_URL = os.getenv("STATICMAP_URL") or "https://maps.googleapis.com/maps/api/staticmap"
+SATELLITE_TILE_DIR = Path(os.getenv("SATELLITE_TILE_DIR") or "cache/satellite")
+SATELLITE_WORKERS = int(os.getenv("SATELLITE_WORKERS") or 8)
+MOSAIC_MAX_CELLS = 3  # per side
+BLANK = (40, 40, 40)
+
+Cell = Tuple[int, int, int]  # zoom, x, y
+
+tile_executor = ThreadPoolExecutor(max_workers=SATELLITE_WORKERS)
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=SATELLITE_WORKERS))
+_http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=SATELLITE_WORKERS))
+
+
+def pixel(lat: float, lon: float, zoom: int = ZOOM) -> Tuple[float, float]:
+    return project(lat, lon, zoom)
+
+
+def cell_center(cell: Cell) -> Tuple[float, float]:
+    zoom, x, y = cell
+    return unproject((x + 0.5) * CELL, (y + 0.5) * CELL, zoom)
+
+
+def cell_of(lat: float, lon: float, zoom: int = ZOOM) -> Cell:
+    px, py = pixel(lat, lon, zoom)
+    return zoom, math.floor(px / CELL), math.floor(py / CELL)
+
+
+def cells_around(lat: float, lon: float, zoom: int = ZOOM, size: int = CELL) -> List[Cell]:
+    """
+    The cells covering a size x size window centered on a point.
+    """
+    left, top = _window(lat, lon, zoom, size)
+    x0, y0 = math.floor(left / CELL), math.floor(top / CELL)
+    x1, y1 = math.floor((left + size - 1) / CELL), math.floor((top + size - 1) / CELL)
+    return [(zoom, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def _window(lat: float, lon: float, zoom: int, size: int) -> Tuple[int, int]:
+    """
+    The top left global pixel of a size x size window centered on a point.
+    """
+    px, py = pixel(lat, lon, zoom)
+    return round(px - size / 2), round(py - size / 2)
+
+
+def _path(cell: Cell) -> Path:
+    zoom, x, y = cell
+    return SATELLITE_TILE_DIR / str(zoom) / str(x) / f"{y}.jpg"
+
+
+def _window_path(zoom: int, left: int, top: int, size: int) -> Path:
+    return SATELLITE_TILE_DIR / str(zoom) / "windows" / f"{left}_{top}_{size}.jpg"
+
+
+def _fetch(path: Path, lat: float, lon: float, zoom: int, size: int) -> Image.Image | None:
+    """
+    A size x size static map centered on a point, from the disk cache at path, fetched if missing.
+    None if it could not be fetched.
+    """
+    if not path.exists():
+        try:
+            r = _http.get(STATICMAP_URL, timeout=30, params={
+                "center": f"{lat},{lon}",
+                "zoom": zoom,
+                "size": f"{size}x{size}",
+                "maptype": "satellite",
+                "format": "jpg",
+                "key": GOOGLE_MAPS_API_KEY,
+            })
+            r.raise_for_status()
+            Image.open(BytesIO(r.content)).verify()
+        except Exception as e:
+            logging.warning(f"Could not fetch satellite image at {lat},{lon}: {e}")
+            return None
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{get_ident()}.tmp")
+        tmp.write_bytes(r.content)
+        os.replace(tmp, path)
+    return Image.open(path).convert("RGB")
+
+
+def load_cell(cell: Cell) -> Image.Image | None:
+    """
+    A cell from the tile cache, fetched if missing. None if it could not be fetched.
+    """
+    return _fetch(_path(cell), *cell_center(cell), cell[0], CELL)
+
+
+def load_window(lat: float, lon: float, zoom: int = ZOOM, size: int = CELL) -> Image.Image | None:
+    """
+    The same image as `crop`, fetched as one static map centered on the window rather than cut from cells.
+    """
+    left, top = _window(lat, lon, zoom, size)
+    center = unproject(left + size / 2, top + size / 2, zoom)
+    return _fetch(_window_path(zoom, left, top, size), *center, zoom, size)
+
+
+def load_cells(cells: Iterable[Cell]) -> Dict[Cell, Image.Image | None]:
+    """
+    Load cells in parallel, each distinct cell once.
+    """
+    cells = list(set(cells))
+    return dict(zip(cells, tile_executor.map(load_cell, cells)))
+
+
+def images_around(points: Sequence[Tuple[float, float]], zoom: int = ZOOM,
+                  size: int = CELL) -> Tuple[List[Image.Image | None], Dict[Cell, Image.Image | None]]:
+    """
+    The size x size image centered on each point, fetched with as few requests as possible.
+    Points whose windows share cells are grouped. A group is cut from cells when that needs fewer fetches
+    than one centered image per point, which is the case for clustered points but not for isolated ones,
+    whose window usually straddles 4 cells.
+    :return: the images (None where a fetch failed), and the cells loaded for the grouped points
+    """
+    windows = [cells_around(lat, lon, zoom, size) for lat, lon in points]
+    # Union-find over points sharing a cell
+    parent = list(range(len(points)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner: Dict[Cell, int] = {}
+    for i, window in enumerate(windows):
+        for c in window:
+            if c in owner:
+                parent[find(i)] = find(owner[c])
+            else:
+                owner[c] = i
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(points)):
+        groups.setdefault(find(i), []).append(i)
+
+    by_cells: List[int] = []
+    for members in groups.values():
+        cells = {c for i in members for c in windows[i]}
+        cell_fetches = sum(not _path(c).exists() for c in cells)
+        window_fetches = sum(not _window_path(zoom, *_window(*points[i], zoom, size), size).exists()
+                             for i in members)
+        if cell_fetches < window_fetches:
+            by_cells += members
+    loaded = load_cells(c for i in by_cells for c in windows[i])
+    res: List[Image.Image | None] = [None] * len(points)
+    for i in by_cells:
+        res[i] = crop(*points[i], loaded, zoom, size)
+    grouped = set(by_cells)
+    rest = [i for i in range(len(points)) if i not in grouped]
+    for i, im in zip(rest, tile_executor.map(lambda i: load_window(*points[i], zoom, size), rest)):
+        res[i] = im
+    return res, loaded
+
+
+def _stitch(cells: Dict[Cell, Image.Image | None], zoom: int, left: int, top: int, width: int,
+            height: int, partial: bool = False) -> Image.Image | None:
+    """
+    The window of global pixels [left, left + width) x [top, top + height).
+    :param partial: leave missing cells blank, rather than returning None
+    """
+    im = Image.new("RGB", (width, height), BLANK)
+    for x in range(math.floor(left / CELL), math.floor((left + width - 1) / CELL) + 1):
+        for y in range(math.floor(top / CELL), math.floor((top + height - 1) / CELL) + 1):
+            tile = cells.get((zoom, x, y))
+            if tile is None:
+                if partial:
+                    continue
+                return None
+            im.paste(tile, (x * CELL - left, y * CELL - top))
+    return im
+
+
+def crop(lat: float, lon: float, cells: Dict[Cell, Image.Image | None], zoom: int = ZOOM,
+         size: int = CELL) -> Image.Image | None:
+    """
+    A size x size image centered on a point, cut from loaded cells. None if a cell it needs is missing.
+    """
+    left, top = _window(lat, lon, zoom, size)
+    return _stitch(cells, zoom, left, top, size, size)
+
+
+def clusters(cells: Iterable[Cell]) -> List[Set[Cell]]:
+    """
+    Groups of adjacent cells (8-connected), grown so none spans more than MOSAIC_MAX_CELLS cells per side.
+    """
+    remaining = set(cells)
+    groups = []
+    while remaining:
+        seed = min(remaining)
+        remaining.discard(seed)
+        group, frontier = {seed}, [seed]
+        x0 = x1 = seed[1]
+        y0 = y1 = seed[2]
+        while frontier:
+            zoom, x, y = frontier.pop()
+            for c in [(zoom, x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]:
+                if c not in remaining:
+                    continue
+                nx0, nx1, ny0, ny1 = min(x0, c[1]), max(x1, c[1]), min(y0, c[2]), max(y1, c[2])
+                if nx1 - nx0 >= MOSAIC_MAX_CELLS or ny1 - ny0 >= MOSAIC_MAX_CELLS:
+                    continue
+                x0, x1, y0, y1 = nx0, nx1, ny0, ny1
+                remaining.discard(c)
+                group.add(c)
+                frontier.append(c)
+        groups.append(group)
+    return groups
+
+
+def mosaic(group: Set[Cell], cells: Dict[Cell, Image.Image | None]) -> Image.Image:
+    """
+    The bounding rectangle of a group of cells as one image, cells that are not loaded are left blank.
+    """
+    zoom = next(iter(group))[0]
+    xs, ys = [c[1] for c in group], [c[2] for c in group]
+    return _stitch(cells, zoom, min(xs) * CELL, min(ys) * CELL,
+                   (max(xs) - min(xs) + 1) * CELL, (max(ys) - min(ys) + 1) * CELL, partial=True)
@@ -1,20 +1,38 @@
 from .auth import GOOGLE_MAPS_API_KEY
+from .pano_cache import get_pano_cache, Pano
 from ...tools.output import debug
 
 from streetview import search_panoramas, get_streetview
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, TimeoutError
 from functools import cache
 from PIL import Image
 from langchain.tools import tool
 from tqdm import tqdm
+from typing import Any, Dict, Iterator, List, Tuple
 from ... import utils
 from ...coords import Coords
 from ..wrapper import gtool, ToolResponse
 from ...session import Session
+import logging
+import os
 import random
+import requests
 import textwrap
+import time
 
 PANO_LIMIT = 120
 PANO_VIEW_LIMIT = 15
+PANO_SEARCH_SPACING_M = 25
+STREETVIEW_URL = "https://maps.googleapis.com/maps/api/streetview"
+STREETVIEW_SIZE = 640
+STREETVIEW_FOV = 120
+# Seconds a single call may take, panoramas still pending by then are left out of the results
+STREETVIEW_DEADLINE_S = float(os.getenv("STREETVIEW_DEADLINE_S") or 60)
+
+# Shared between all calls, so concurrent branches together stay within these many requests
+search_executor = ThreadPoolExecutor(max_workers=int(os.getenv("STREETVIEW_SEARCH_WORKERS") or 8))
+download_executor = ThreadPoolExecutor(max_workers=int(os.getenv("STREETVIEW_DOWNLOAD_WORKERS") or 8))
+_http = requests.Session()
 
 
 def get_pano(lat: float, lon: float) -> str | Image.Image:
@@ -31,6 +49,66 @@ def get_pano(lat: float, lon: float) -> str | Image.Image:
     return get_streetview(pid, api_key=GOOGLE_MAPS_API_KEY)
 
 
+def fetch_streetview(pid: str) -> bytes:
+    """
+    Downloads a panorama view as the JPEG served by the Street View Static API, without decoding it.
+    Same request as `streetview.get_streetview`, over a pooled connection.
+    """
+    r = _http.get(STREETVIEW_URL, timeout=30, params={
+        "size": f"{STREETVIEW_SIZE}x{STREETVIEW_SIZE}",
+        "fov": STREETVIEW_FOV,
+        "pitch": 0,
+        "heading": 0,
+        "pano": pid,
+        "key": GOOGLE_MAPS_API_KEY,
+    })
+    r.raise_for_status()
+    return r.content
+
+
+def search_cached(lat: float, lon: float) -> List[Pano]:
+    """
+    Panoramas near a location, as (panorama id, lat, lon), through the persistent panorama cache.
+    """
+    pano_cache = get_pano_cache()
+    if pano_cache is not None:
+        res = pano_cache.get_panos(lat, lon)
+        if res is not None:
+            return res
+    res = [(x.pano_id, x.lat, x.lon) for x in search_panoramas(lat=lat, lon=lon)]
+    if pano_cache is not None:
+        pano_cache.put_panos(lat, lon, res)
+    return res
+
+
+def fetch_cached(pid: str) -> bytes:
+    pano_cache = get_pano_cache()
+    if pano_cache is not None:
+        data = pano_cache.get_image(pid)
+        if data is not None:
+            return data
+    data = fetch_streetview(pid)
+    if pano_cache is not None:
+        pano_cache.put_image(pid, data)
+    return data
+
+
+def until_deadline(futures: Dict[Future, Any], deadline: float) -> Iterator[Tuple[Any, Any]]:
+    """
+    Yields (key, result) of futures as they complete, until the deadline.
+    Futures still pending at the deadline are cancelled, failed ones are logged and skipped.
+    """
+    try:
+        for future in as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                logging.warning(f"Streetview request for {futures[future]} failed: {e}")
+    except TimeoutError:
+        for future in futures:
+            future.cancel()
+
+
 @gtool("Get StreetViews", cached=True)
 def get_panos(coords_path: str, session: Session) -> ToolResponse:
     """
@@ -41,27 +119,35 @@ def get_panos(coords_path: str, session: Session) -> ToolResponse:
     # TODO: pano tiles
     # Note: the sampling of streetview images could perhaps be improved in the future. Now it's just a SRS
     # e.g. ensure that each coordinate is represented, and that the coordinates are not too close to each other.
-    coords = Coords.load(utils.try_find_loc(session, coords_path, [".geojson", ".csv"])).coords
-    print(coords)
+    # Panorama search already covers a neighbourhood, so nearby points would return the same panoramas
+    coords = Coords.load(utils.try_find_loc(session, coords_path, [".geojson", ".csv"])).thin(PANO_SEARCH_SPACING_M).coords
+    deadline = time.monotonic() + STREETVIEW_DEADLINE_S
+    searches = {search_executor.submit(search_cached, lat, lon): (lat, lon) for lat, lon in coords}
     pid_set = set()
-    for coord in coords:
-        pids = search_panoramas(lat=coord[0], lon=coord[1])
-        pid_set = pid_set.union({(x.pano_id, (x.lat, x.lon)) for x in pids})
+    searched = 0
+    for _, pids in until_deadline(searches, deadline):
+        searched += 1
+        pid_set.update((pid, (lat, lon)) for pid, lat, lon in pids)
 
     if len(pid_set) == 0:
+        if searched < len(coords):
+            return ToolResponse(f"No panoramas found before the deadline, {len(coords) - searched} of "
+                                f"{len(coords)} locations were not searched. Try fewer coordinates.")
         return ToolResponse("No panoramas found for this location.")
 
-    # print(pid_set)
     res = "Google Streetview Results \n ------------ \n"
     debug("Getting streetviews...")
     coord_l = []
     auxiliary_l = []
     sample_previews = []
-    for pid, coord in tqdm(
-        random.sample(sorted(pid_set), min(len(pid_set), PANO_LIMIT))
-    ):
-        im = get_streetview(pid, api_key=GOOGLE_MAPS_API_KEY)
-        loc = utils.save_img(im, "streetview_res", session)
+    sample = dict(random.sample(sorted(pid_set), min(len(pid_set), PANO_LIMIT)))
+    downloads = {download_executor.submit(fetch_cached, pid): pid for pid in sample}
+    utils.make_run_dir(session)
+    # Written as they arrive, in the JPEG encoding they were served in
+    for pid, data in tqdm(until_deadline(downloads, deadline), total=len(downloads)):
+        loc = utils.find_valid_loc(session, "streetview_res", ".jpg")
+        loc.write_bytes(data)
+        coord = sample[pid]
         sample_previews.append(
             textwrap.dedent(
                 f"""\
@@ -73,6 +159,9 @@ def get_panos(coords_path: str, session: Session) -> ToolResponse:
         coord_l.append(coord)
         auxiliary_l.append({"panorama_id": pid, "image_path": str(loc)})
 
+    if not sample_previews:
+        return ToolResponse("Could not download any of the panoramas found for this location.")
+
     for sample in random.sample(
         sample_previews, min(len(sample_previews), PANO_VIEW_LIMIT)
     ):
@@ -84,6 +173,11 @@ def get_panos(coords_path: str, session: Session) -> ToolResponse:
             f"highly recommend using the `Streetview Locate` tool."
         )
 
+    missing = (len(coords) - searched, len(downloads) - len(sample_previews))
+    if any(missing):
+        res += (f"Partial results: {missing[0]} locations were not searched and {missing[1]} panoramas "
+                f"were not downloaded before the deadline or failed. \n")
+
     coords = Coords(coord_l, auxiliary_l)
     res += coords.to_prompt(session, "streetview_")
     return ToolResponse(res, {"geojson": coords.to_geojson(), "images": [x['image_path'] for x in auxiliary_l]})
@@ -7,28 +7,27 @@ from langchain.tools import tool
 from functools import cache
 
 from .model.GeoCLIP import GeoCLIP
-from ... import utils
+from ... import utils, models
 from ...coords import Coords
 from ...session import Session
 from ..wrapper import gtool
 from ..response import ToolResponse
+from ..ml import inference_context, precision_for, with_precision
 
 
 PAR_DIR = Path(__file__).parent
 
-model = None
-
 
 def initialize_model():
-    global model
-    model = GeoCLIP(gps_gallary_path=PAR_DIR / "model/gps_gallery_100K.csv")
-    model.eval()
+    return GeoCLIP(gps_gallary_path=PAR_DIR / "model/gps_gallery_100K.csv")
+
+
+models.register("geoclip", with_precision("geoclip", initialize_model))
 
 
 def predict(image: Image.Image, top_n=5) -> List[Tuple[Tuple[float, float], float]]:
-    if model is None:
-        initialize_model()
-    with torch.no_grad():
+    model = models.get("geoclip")
+    with torch.no_grad(), inference_context(precision_for("geoclip")):
         top_pred_gps, top_pred_prob = model.predict(image, top_k=5)
 
     tops = [
@@ -11,6 +11,15 @@ from torchvision.transforms import ToPILImage
 from pathlib import Path
 
 PAR_DIR = Path(__file__).parent
+GALLERY_BATCH_SIZE = 8192
+
+
+def gallery_features_path(gps_gallary_path) -> Path:
+    """
+    Location of the precomputed gallery features, stored next to the gallery csv.
+    """
+    gps_gallary_path = Path(gps_gallary_path)
+    return gps_gallary_path.with_name(f"{gps_gallary_path.stem}_features.npy")
 
 
 class GeoCLIP(nn.Module):
@@ -30,6 +39,8 @@ class GeoCLIP(nn.Module):
         self.location_encoder = LocationEncoder()
 
         self.gps_gallery = load_gps_data(gps_gallary_path)
+        self.gallery_features_path = gallery_features_path(gps_gallary_path)
+        self.gallery_features = None
 
         # Load weights
         self.logit_scale = nn.Parameter(
@@ -55,8 +66,50 @@ class GeoCLIP(nn.Module):
 
         return logits_per_image, logits_per_location
 
+    @torch.no_grad()
+    def build_gallery_features(self, dtype=np.float16, batch_size=GALLERY_BATCH_SIZE) -> Path:
+        """
+        Encode and L2-normalize the whole gps gallery once, and store it as a .npy next to the gallery csv.
+        :param dtype: np.float16 or np.float32
+        :param batch_size: number of gallery points encoded per forward pass
+        :return: path to the stored features
+        """
+        features = np.lib.format.open_memmap(
+            self.gallery_features_path, mode="w+", dtype=dtype, shape=(len(self.gps_gallery), 512)
+        )
+        for i in range(0, len(self.gps_gallery), batch_size):
+            batch = self.location_encoder(self.gps_gallery[i:i + batch_size])
+            features[i:i + batch_size] = F.normalize(batch, dim=1).numpy().astype(dtype)
+        features.flush()
+        del features
+        self.gallery_features = None
+        return self.gallery_features_path
+
+    def load_gallery_features(self) -> np.ndarray | None:
+        """
+        Memory-map the precomputed gallery features, if they have been built.
+        The mapping is read-only, so worker processes share the same pages.
+        """
+        if self.gallery_features is None and self.gallery_features_path.exists():
+            self.gallery_features = np.load(self.gallery_features_path, mmap_mode="r")
+        return self.gallery_features
+
+    @torch.no_grad()
+    def gallery_logits(self, image, gallery_features: np.ndarray):
+        image_features = F.normalize(self.image_encoder(image).float(), dim=1).numpy()
+        sims = np.empty((image_features.shape[0], gallery_features.shape[0]), dtype=np.float32)
+        # float16 has no BLAS path, upcast one chunk at a time to keep memory bounded
+        for i in range(0, gallery_features.shape[0], GALLERY_BATCH_SIZE):
+            chunk = np.asarray(gallery_features[i:i + GALLERY_BATCH_SIZE], dtype=np.float32)
+            sims[:, i:i + GALLERY_BATCH_SIZE] = image_features @ chunk.T
+        return self.logit_scale.exp() * torch.from_numpy(sims)
+
     def predict(self, image, top_k):
-        logits_per_image, logits_per_location = self.forward(image, self.gps_gallery)
+        gallery_features = self.load_gallery_features()
+        if gallery_features is not None:
+            logits_per_image = self.gallery_logits(image, gallery_features)
+        else:
+            logits_per_image, logits_per_location = self.forward(image, self.gps_gallery)
         probs_per_image = logits_per_image.softmax(dim=-1)
 
         # Get top k prediction
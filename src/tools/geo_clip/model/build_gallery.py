@@ -0,0 +1,16 @@
+"""
+Precompute the GeoCLIP gps gallery features.
+Usage: python -m src.tools.geo_clip.model.build_gallery [float16|float32]
+"""
+import sys
+
+import numpy as np
+
+from .GeoCLIP import GeoCLIP, PAR_DIR
+
+if __name__ == "__main__":
+    dtype = np.dtype(sys.argv[1] if len(sys.argv) > 1 else "float16")
+    model = GeoCLIP(gps_gallary_path=PAR_DIR / "gps_gallery_100K.csv")
+    model.eval()
+    path = model.build_gallery_features(dtype=dtype)
+    print(f"Gallery features written to {path}")
@@ -1,7 +1,10 @@
 # Utility functions for machine learning
+import logging
 import os
+from contextlib import nullcontext
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, List
 
 import torch
 from PIL import Image
@@ -25,3 +28,75 @@ def cosine_similarity(vec1: torch.Tensor, vec2: torch.Tensor) -> torch.Tensor:
     similarity = dot_product / (norm_vec1 * norm_vec2)
     return similarity
 
+
+@dataclass(frozen=True)
+class Precision:
+    """
+    How a model runs inference. Written as options joined by `+`, e.g. `bf16+channels_last`:
+    - bf16 / fp16: autocast to that dtype
+    - int8: dynamic int8 quantization of linear layers (CPU only)
+    - channels_last: NHWC memory format for convolutions
+    - fp32: none of the above
+    """
+    autocast: torch.dtype | None = None
+    int8: bool = False
+    channels_last: bool = False
+
+    @staticmethod
+    def parse(spec: str) -> "Precision":
+        options = {o.strip() for o in spec.split("+") if o.strip()} - {"fp32"}
+        unknown = options - {"bf16", "fp16", "int8", "channels_last"}
+        if unknown:
+            raise ValueError(f"Unknown precision options: {unknown}")
+        dtype = torch.bfloat16 if "bf16" in options else torch.float16 if "fp16" in options else None
+        return Precision(dtype, "int8" in options, "channels_last" in options)
+
+    def __str__(self):
+        options = [{torch.bfloat16: "bf16", torch.float16: "fp16"}.get(self.autocast)]
+        options += ["int8" if self.int8 else None, "channels_last" if self.channels_last else None]
+        return "+".join(o for o in options if o) or "fp32"
+
+
+# Sample4Geo always ran under autocast, whose default dtype is bfloat16 on CPU and float16 on CUDA
+DEFAULT_PRECISION = {"sample4geo": "fp16" if torch.cuda.is_available() else "bf16"}
+
+
+def precision_for(name: str) -> Precision:
+    """
+    The inference precision of a model: INFERENCE_PRECISION_<NAME>, then INFERENCE_PRECISION, then the model default.
+    """
+    spec = (os.getenv(f"INFERENCE_PRECISION_{name.upper().replace('-', '_')}")
+            or os.getenv("INFERENCE_PRECISION")
+            or DEFAULT_PRECISION.get(name, "fp32"))
+    return Precision.parse(spec)
+
+
+def prepare_model(model: torch.nn.Module, precision: Precision) -> torch.nn.Module:
+    if precision.int8:
+        device = next(model.parameters()).device
+        if device.type == "cpu":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            logging.warning(f"int8 quantization is CPU only, not applied on {device}")
+    if precision.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def with_precision(name: str, loader: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    Wrap a model loader to prepare the model for its configured precision, see `precision_for`
+    """
+    return lambda: prepare_model(loader(), precision_for(name))
+
+
+def inference_context(precision: Precision, device_type: str = "cpu"):
+    if precision.autocast is None:
+        return nullcontext()
+    return torch.autocast(device_type, dtype=precision.autocast)
+
+
+def prepare_input(x: torch.Tensor, precision: Precision) -> torch.Tensor:
+    if precision.channels_last and x.dim() == 4:
+        return x.contiguous(memory_format=torch.channels_last)
+    return x
@@ -0,0 +1,156 @@
+"""
+Compare inference precision settings of a vision model, for latency and agreement with fp32.
+
+For each setting the model is prepared as the tools would prepare it (see `ml.Precision`), a folder of images is
+embedded, and the descriptors are compared with the fp32 ones: cosine similarity, and whether each image keeps
+the same nearest neighbours. Pick a setting per model with INFERENCE_PRECISION_<MODEL>.
+
+Usage: python -m src.tools.precision_bench <model> <image_dir> [--settings fp32,bf16,int8,bf16+channels_last]
+       [--limit 64] [--batch-size 8] [--out results.json]
+Models: eigenplaces, anyloc, sample4geo, geoclip
+"""
+import argparse
+import copy
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from .ml import Precision, inference_context, load_image, prepare_model
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+Encoder = Callable[[torch.nn.Module, Sequence[Path], Precision, int], np.ndarray]
+
+
+def transform_encoder(transform) -> Encoder:
+    """
+    Embeds images through the same streaming path as the tools.
+    """
+    def encode(model, paths, precision, batch_size):
+        from .vpr.embedding import embed_stream
+        res = None
+        for idx, descriptors in embed_stream(model, paths, transform, batch_size=batch_size, num_workers=0,
+                                             precision=precision):
+            if res is None:
+                res = np.empty((len(paths), descriptors.shape[1]), dtype=np.float32)
+            res[idx] = descriptors
+        return res
+
+    return encode
+
+
+def eigenplaces() -> Tuple[Callable, Encoder]:
+    from .vpr import inference
+    return inference.load_model, transform_encoder(inference.base_transform)
+
+
+def anyloc() -> Tuple[Callable, Encoder]:
+    from .vpr import anyloc_inference
+    return anyloc_inference.load_model, transform_encoder(anyloc_inference.stream_transform)
+
+
+def sample4geo() -> Tuple[Callable, Encoder]:
+    from .Sample4Geo import inference
+    return (lambda: inference.get_model(inference.Configuration()),
+            transform_encoder(lambda im: inference.satellite_transforms(image=np.asarray(im))["image"]))
+
+
+def geoclip() -> Tuple[Callable, Encoder]:
+    from .geo_clip.inference import initialize_model
+
+    def encode(model, paths, precision, batch_size):
+        features = []
+        with torch.inference_mode(), inference_context(precision):
+            for i in range(0, len(paths), batch_size):
+                images = [load_image(p) for p in paths[i:i + batch_size]]
+                features.append(model.image_encoder(images).float().numpy())
+        return np.concatenate(features)
+
+    return initialize_model, encode
+
+
+MODELS: Dict[str, Callable[[], Tuple[Callable, Encoder]]] = {
+    "eigenplaces": eigenplaces,
+    "anyloc": anyloc,
+    "sample4geo": sample4geo,
+    "geoclip": geoclip,
+}
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def neighbours(features: np.ndarray, k: int) -> np.ndarray:
+    sims = features @ features.T
+    np.fill_diagonal(sims, -np.inf)
+    return np.argsort(-sims, axis=1)[:, :k]
+
+
+def compare(features: np.ndarray, reference: np.ndarray, k: int = 5) -> Dict[str, float]:
+    cos = (features * reference).sum(axis=1)
+    k = min(k, len(features) - 1)
+    if k < 1:
+        return {"cos_mean": float(cos.mean()), "cos_min": float(cos.min())}
+    ours, theirs = neighbours(features, k), neighbours(reference, k)
+    return {
+        "cos_mean": float(cos.mean()),
+        "cos_min": float(cos.min()),
+        "nn_agreement": float((ours[:, 0] == theirs[:, 0]).mean()),
+        f"top{k}_overlap": float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ours, theirs)])),
+    }
+
+
+def run(model_name: str, image_dir: str | Path, settings: List[str], limit: int = 64,
+        batch_size: int = 8) -> List[Dict]:
+    loader, encode = MODELS[model_name]()
+    paths = sorted(p for p in Path(image_dir).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)[:limit]
+    if not paths:
+        raise ValueError(f"No images in {image_dir}")
+    base = loader().eval()
+    results, reference = [], None
+    # fp32 first, as the reference of the others
+    for spec in ["fp32"] + [s for s in settings if s != "fp32"]:
+        precision = Precision.parse(spec)
+        model = prepare_model(copy.deepcopy(base), precision)
+        encode(model, paths[:batch_size], precision, batch_size)  # warm up
+        start = time.perf_counter()
+        features = normalize(encode(model, paths, precision, batch_size))
+        elapsed = time.perf_counter() - start
+        reference = features if reference is None else reference
+        results.append({
+            "setting": str(precision),
+            "images": len(paths),
+            "ms_per_image": 1000 * elapsed / len(paths),
+            "images_per_s": len(paths) / elapsed,
+            **compare(features, reference),
+        })
+        del model
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare inference precision settings of a vision model")
+    parser.add_argument("model", choices=list(MODELS))
+    parser.add_argument("image_dir")
+    parser.add_argument("--settings", default="fp32,bf16,int8,channels_last,bf16+channels_last")
+    parser.add_argument("--limit", type=int, default=64, help="number of images embedded per setting")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--out", help="also write the results to this json file")
+    args = parser.parse_args()
+    results = run(args.model, args.image_dir, args.settings.split(","), args.limit, args.batch_size)
+    columns = list(dict.fromkeys(k for r in results for k in r))
+    print("  ".join(f"{c:>18}" for c in columns))
+    for r in results:
+        print("  ".join(f"{r.get(c, ''):>18.4f}" if isinstance(r.get(c), float) else f"{r.get(c, ''):>18}"
+                        for c in columns))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"model": args.model, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
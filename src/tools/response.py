@@ -1,8 +1,27 @@
+import re
+
 import attr
 from attr import Factory
 
+IMG_TAG_PATTERN = re.compile(r"<img (.*?)>")
+SUMMARY_CHARS = 400
+
+
 @attr.s
 class ToolResponse:
     raw: str = attr.ib()
     auxiliary: dict = attr.ib(default=Factory(dict))
+    summary: str | None = attr.ib(default=None)  # Short form of `raw`, shown once the observation is stale
 
+    def summarize(self) -> str:
+        """
+        The summary if the tool provided one, otherwise `raw` without images, truncated.
+        Paths of stored results are kept, so later actions can still refer to them.
+        """
+        if self.summary is not None:
+            return self.summary
+        text = re.sub(r"\s+", " ", IMG_TAG_PATTERN.sub("(image omitted)", self.raw)).strip()
+        if len(text) <= SUMMARY_CHARS:
+            return text
+        stored = re.findall(r"stored at \S+", text[SUMMARY_CHARS:])
+        return f"{text[:SUMMARY_CHARS]} ... (truncated) {' '.join(stored)}".strip()
@@ -8,17 +8,30 @@ from pathlib import Path
 from langchain.tools import tool
 
 from ..wrapper import gtool
-from ...coords import Coords
+from ...coords import Coords, Auxiliary
 from ...session import Session
-from ... import utils
+from ... import utils, models
+from .descriptor_store import DescriptorStore, embed_cached
+from .embedding import embed_stream
+from ..ml import precision_for, with_precision
 
-model = None
+MODEL_NAME = "anyloc-dinov2-vlad"  # descriptor store key with the precision, change with the model
 TOP_N = 15
+
+
+def resize_to_patches(x: torch.Tensor) -> torch.Tensor:
+    # DINO wants height and width as multiple of 14, therefore resize them
+    # to the nearest multiple of 14
+    h, w = x.shape[-2:]
+    return transforms.functional.resize(x, [round(h / 14) * 14, round(w / 14) * 14], antialias=True)
+
+
 base_transform = transforms.Compose(
     [
         transforms.ToTensor(),
     ]
 )
+stream_transform = transforms.Compose([transforms.ToTensor(), resize_to_patches])
 
 
 def using_mps():
@@ -33,10 +46,7 @@ def load_image(loc: str | Path):
     return Image.open(loc).convert("RGB")
 
 
-def get_model():
-    global model
-    if model is not None:
-        return model
+def load_model():
     model = torch.hub.load("AnyLoc/DINO", "get_vlad_model", backbone="DINOv2")
     if using_mps():
         mps_device = torch.device("mps")
@@ -44,6 +54,14 @@ def get_model():
     return model
 
 
+models.register("anyloc", with_precision("anyloc", load_model))
+
+
+def get_model():
+    return models.get("anyloc")
+
+
+@torch.no_grad()
 def weight_im(im: Image.Image | List[Image.Image]):
     mod = get_model()
     if not isinstance(im, list):
@@ -78,6 +96,11 @@ def loc_sim(target: Image.Image, db: List[Image.Image]):
     return s
 
 
+def embed_paths(paths: List[str | Path]):
+    return embed_stream(get_model(), paths, stream_transform, torch.device("mps") if using_mps() else None,
+                        precision=precision_for("anyloc"))
+
+
 @gtool("Streetview Locate")
 def locate_image(im_loc: str, db_loc: str, session: Session):
     """
@@ -87,22 +110,21 @@ def locate_image(im_loc: str, db_loc: str, session: Session):
     :return:
     """
     db_coords = Coords.load(db_loc)
-    im = load_image(im_loc)
-    res = loc_sim(im, [load_image(x["image_path"]) for x in db_coords.auxiliary])
-    new_coords = Coords(
-        coords=db_coords.coords,
-        auxiliary=[
-            {"confidence": float(x), "image_path": y["image_path"]}
-            for (x, y) in zip(res.flatten(), db_coords.auxiliary)
-        ],
-    )
-    top_n = torch.argsort(res, descending=True).flatten()[:TOP_N]
+    image_paths = db_coords.auxiliary.column("image_path")
+    # Descriptors of one precision are only compared with each other
+    key = f"{MODEL_NAME}@{precision_for('anyloc')}"
+    store = DescriptorStore.get(key)
+    query = store.lookup(embed_cached(key, [im_loc], embed_paths))[0]
+    digests = embed_cached(key, image_paths.tolist(), embed_paths)
+    scores = store.similarity(digests, query).astype(np.float64)
+    new_coords = Coords(db_coords.latlon, Auxiliary({"confidence": scores, "image_path": image_paths}, len(db_coords)))
+    top = new_coords.top_k(scores, TOP_N)
     res = f"Top {TOP_N} possible locations based on visual place recognition: \n"
-    for t in range(TOP_N):
+    for t, (coord, aux) in enumerate(zip(top, top.auxiliary)):
         res += (
             f"Location {t+1}:\n"
-            f"Image: {utils.image_to_prompt(db_coords.auxiliary[top_n[t]]['image_path'], session)}\n"
-            f"Coordinate: {new_coords.coords[top_n[t]]}\n"
+            f"Image: {utils.image_to_prompt(aux['image_path'], session)}\n"
+            f"Coordinate: {coord}\n"
         )
     res += f"Full results: \n {new_coords.to_prompt(session, 'vpr_', render=False)}"
     return res
@@ -0,0 +1,215 @@
+"""
+Persistent store of image descriptors, keyed by model and image content hash.
+
+Each model gets a directory under VPR_INDEX_DIR (default cache/vpr) holding append-only segments of
+L2-normalized float16 descriptors (.npy, memory-mapped when read) and a manifest.json listing the image digests
+in each segment. Writers take a file lock and publish a segment by rewriting the manifest atomically,
+so processes on one host share the store safely.
+"""
+import fcntl
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock, get_ident
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from ... import utils
+
+VPR_INDEX_DIR = Path(os.getenv("VPR_INDEX_DIR") or "cache/vpr")
+MAX_SEGMENTS = 32  # segments are merged into one beyond this
+ADD_CHUNK = 1024  # descriptors buffered before they are written as a segment
+SCORE_CHUNK = 8192  # descriptors read at once when scoring
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+class DescriptorStore:
+    _stores: Dict[str, "DescriptorStore"] = {}
+    _stores_lock = Lock()
+
+    @classmethod
+    def get(cls, model_name: str) -> "DescriptorStore":
+        with cls._stores_lock:
+            if model_name not in cls._stores:
+                cls._stores[model_name] = DescriptorStore(VPR_INDEX_DIR / model_name)
+            return cls._stores[model_name]
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / "manifest.json"
+        self.lock = Lock()
+        self._mtime = None
+        self._rows: Dict[str, Tuple[str, int]] = {}  # digest -> (segment, row)
+        self._segments: Dict[str, np.ndarray] = {}
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.root / ".lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> Dict[str, List[str]]:
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)["segments"]
+        except FileNotFoundError:
+            return {}
+
+    def _refresh(self):
+        """
+        Reload the manifest if another writer changed it. Caller holds self.lock.
+        """
+        try:
+            mtime = self.manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        segments = self._read_manifest()
+        self._rows = {d: (seg, i) for seg, digests in segments.items() for i, d in enumerate(digests)}
+        self._segments = {k: v for k, v in self._segments.items() if k in segments}
+        self._mtime = mtime
+
+    def _segment(self, name: str) -> np.ndarray:
+        if name not in self._segments:
+            self._segments[name] = np.load(self.root / name, mmap_mode="r")
+        return self._segments[name]
+
+    def missing(self, digests: Sequence[str]) -> List[int]:
+        """
+        Indices of the digests that have no stored descriptor.
+        """
+        with self.lock:
+            self._refresh()
+            return [i for i, d in enumerate(digests) if d not in self._rows]
+
+    def lookup(self, digests: Sequence[str]) -> np.ndarray:
+        """
+        The stored descriptors of the digests, as one float32 matrix in the same order.
+        """
+        with self.lock:
+            try:
+                return self._lookup(digests)
+            except FileNotFoundError:
+                # A segment was merged away by another process since the manifest was read
+                self._mtime = None
+                return self._lookup(digests)
+
+    def _lookup(self, digests: Sequence[str]) -> np.ndarray:
+        self._refresh()
+        locs = [self._rows[d] for d in digests]
+        by_segment: Dict[str, List[int]] = {}
+        for i, (seg, _) in enumerate(locs):
+            by_segment.setdefault(seg, []).append(i)
+        res = None
+        for seg, idx in by_segment.items():
+            rows = self._segment(seg)[[locs[i][1] for i in idx]]
+            if res is None:
+                res = np.empty((len(digests), rows.shape[1]), dtype=np.float32)
+            res[idx] = rows
+        return res if res is not None else np.empty((0, 0), dtype=np.float32)
+
+    def similarity(self, digests: Sequence[str], query: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity of a query descriptor to the stored descriptors of the digests,
+        read in chunks so the descriptors are never all in memory at once.
+        """
+        query = normalize(query.reshape(1, -1))[0]
+        res = np.empty(len(digests), dtype=np.float32)
+        for i in range(0, len(digests), SCORE_CHUNK):
+            res[i:i + SCORE_CHUNK] = self.lookup(digests[i:i + SCORE_CHUNK]) @ query
+        return res
+
+    def add(self, digests: Sequence[str], descriptors: np.ndarray):
+        """
+        Store L2-normalized float16 descriptors for the digests, as a new segment.
+        """
+        if len(digests) == 0:
+            return
+        descriptors = normalize(descriptors).astype(np.float16)
+        with self.lock, self._file_lock():
+            segments = self._read_manifest()
+            known = {d for ds in segments.values() for d in ds}
+            keep = []
+            for i, d in enumerate(digests):
+                if d not in known:
+                    known.add(d)
+                    keep.append(i)
+            if keep:
+                name = self._write_segment(descriptors[keep])
+                segments[name] = [digests[i] for i in keep]
+            stale = []
+            if len(segments) > MAX_SEGMENTS:
+                stale = list(segments)
+                segments = self._merge(segments)
+            self._write_manifest(segments)
+            # Only once the manifest no longer refers to them, readers holding mappings keep them until they refresh
+            for seg in stale:
+                (self.root / seg).unlink(missing_ok=True)
+            self._mtime = None
+
+    def _write_segment(self, descriptors: np.ndarray) -> str:
+        name = f"seg-{uuid.uuid4().hex[:12]}.npy"
+        tmp = self.root / f"{name}.{os.getpid()}.{get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, descriptors)
+        os.replace(tmp, self.root / name)
+        return name
+
+    def _write_manifest(self, segments: Dict[str, List[str]]):
+        tmp = self.manifest_path.with_suffix(f".{os.getpid()}.{get_ident()}.tmp")
+        tmp.write_text(json.dumps({"dtype": "float16", "segments": segments}))
+        os.replace(tmp, self.manifest_path)
+
+    def _merge(self, segments: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """
+        Concatenate all segments into one, copying segment by segment.
+        """
+        parts = [np.load(self.root / seg, mmap_mode="r") for seg in segments]
+        name = f"seg-{uuid.uuid4().hex[:12]}.npy"
+        tmp = self.root / f"{name}.{os.getpid()}.{get_ident()}.tmp"
+        merged = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float16,
+                                           shape=(sum(len(p) for p in parts), parts[0].shape[1]))
+        i = 0
+        for part in parts:
+            merged[i:i + len(part)] = part
+            i += len(part)
+        merged.flush()
+        del merged
+        os.replace(tmp, self.root / name)
+        return {name: [d for ds in segments.values() for d in ds]}
+
+
+def embed_cached(model_name: str, paths: Sequence[str | Path],
+                 embed: Callable[[List[str | Path]], Iterator[Tuple[List[int], np.ndarray]]]) -> List[str]:
+    """
+    Make sure the store has descriptors for the images, embedding only those it does not have yet.
+    :param embed: streams descriptors of a list of image paths, as (indices in the list, descriptors) batches
+    :return: the digests of the images, to look their descriptors up in the store
+    """
+    store = DescriptorStore.get(model_name)
+    digests = [utils.im_cache.digest(p) for p in paths]
+    missing = store.missing(digests)
+    if not missing:
+        return digests
+    pending_digests, pending = [], []
+    for idx, descriptors in embed([paths[i] for i in missing]):
+        pending_digests += [digests[missing[i]] for i in idx]
+        pending.append(descriptors)
+        if len(pending_digests) >= ADD_CHUNK:
+            store.add(pending_digests, np.concatenate(pending))
+            pending_digests, pending = [], []
+    if pending:
+        store.add(pending_digests, np.concatenate(pending))
+    return digests
@@ -0,0 +1,77 @@
+"""
+Streaming image embedding for the VPR models.
+
+Images are decoded by DataLoader workers and batched by size, so mixed-resolution panoramas never end up
+in the same tensor, and at most a few batches are held in memory however many images there are.
+Configured with VPR_BATCH_SIZE and VPR_WORKERS.
+"""
+import logging
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+
+from ..ml import Precision, inference_context, load_image, prepare_input
+
+VPR_BATCH_SIZE = int(os.getenv("VPR_BATCH_SIZE") or 16)
+VPR_WORKERS = int(os.getenv("VPR_WORKERS") or 2)
+
+
+class ImageDataset(Dataset):
+    def __init__(self, paths: Sequence[str | Path], transform: Callable[[Image.Image], torch.Tensor]):
+        self.paths = paths
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i: int) -> torch.Tensor:
+        return self.transform(load_image(self.paths[i]))
+
+
+def image_size(path: str | Path) -> Tuple[int, int]:
+    """
+    Read from the header, without decoding the image.
+    """
+    with Image.open(path) as im:
+        return im.size
+
+
+def size_batches(sizes: Sequence[Tuple[int, int]], batch_size: int) -> List[List[int]]:
+    """
+    Batches of indices of images of the same size.
+    """
+    buckets = defaultdict(list)
+    for i, size in enumerate(sizes):
+        buckets[size].append(i)
+    return [idx[j:j + batch_size] for idx in buckets.values() for j in range(0, len(idx), batch_size)]
+
+
+def embed_stream(model: torch.nn.Module, paths: Sequence[str | Path], transform: Callable[[Image.Image], torch.Tensor],
+                 device: torch.device | None = None, batch_size: int = VPR_BATCH_SIZE,
+                 num_workers: int = VPR_WORKERS,
+                 precision: Precision = Precision()) -> Iterator[Tuple[List[int], np.ndarray]]:
+    """
+    Embed images batch by batch.
+    :param precision: autocast and input memory format, the model itself is prepared when it is loaded
+    :return: yields the indices of the images in each batch, and their descriptors
+    """
+    batches = size_batches([image_size(p) for p in paths], batch_size)
+    # Worker processes are not worth starting for a single batch, e.g. a query image
+    workers = min(num_workers, len(batches), os.cpu_count() or 1) if len(batches) > 1 else 0
+    loader = DataLoader(ImageDataset(paths, transform), batch_sampler=batches, num_workers=workers)
+    start = time.perf_counter()
+    device_type = "cpu" if device is None else device.type
+    with torch.inference_mode(), inference_context(precision, device_type):
+        for idx, batch in zip(batches, loader):
+            if device is not None:
+                batch = batch.to(device)
+            yield idx, model(prepare_input(batch, precision)).float().cpu().numpy()
+    elapsed = time.perf_counter() - start
+    logging.info(f"Embedded {len(paths)} images in {elapsed:.1f}s ({len(paths) / max(elapsed, 1e-9):.1f} images/s)")
@@ -7,12 +7,14 @@ import torchvision.transforms as transforms
 from pathlib import Path
 from langchain.tools import tool
 
-from ...coords import Coords
-from ... import utils
-from ..ml import using_mps, load_image, cosine_similarity
+from ...coords import Coords, Auxiliary
+from ... import utils, models
+from ..ml import using_mps, load_image, cosine_similarity, precision_for, with_precision
+from .descriptor_store import DescriptorStore, embed_cached
+from .embedding import embed_stream
 from ..wrapper import gtool, Session, ToolResponse
 
-model = None
+MODEL_NAME = "eigenplaces-resnet50-2048"  # descriptor store key with the precision, change with the model
 TOP_N = 15
 base_transform = transforms.Compose(
     [
@@ -22,10 +24,7 @@ base_transform = transforms.Compose(
 )
 
 
-def get_model():
-    global model
-    if model is not None:
-        return model
+def load_model():
     model = torch.hub.load(
         "gmberton/eigenplaces",
         "get_trained_model",
@@ -38,6 +37,14 @@ def get_model():
     return model
 
 
+models.register("eigenplaces", with_precision("eigenplaces", load_model))
+
+
+def get_model():
+    return models.get("eigenplaces")
+
+
+@torch.no_grad()
 def weight_im(im: Image.Image | List[Image.Image]):
     mod = get_model()
     if not isinstance(im, list):
@@ -57,6 +64,12 @@ def loc_sim(target: Image.Image, db: List[Image.Image]):
     s = cosine_similarity(w_target, w_db)
     return s
 
+
+def embed_paths(paths: List[str | Path]):
+    return embed_stream(get_model(), paths, base_transform, torch.device("mps") if using_mps() else None,
+                        precision=precision_for("eigenplaces"))
+
+
 @gtool("Streetview Locate")
 def locate_image(img_id: str, db_loc: str, session: Session) -> ToolResponse:
     """
@@ -67,27 +80,27 @@ def locate_image(img_id: str, db_loc: str, session: Session) -> ToolResponse:
     :return:
     """
     db_coords = Coords.load(utils.try_find_loc(session, db_loc, [".geojson", ".csv"]))
-    im = load_image(session.get_loc(img_id))
-    res = loc_sim(im, [load_image(x["image_path"]) for x in db_coords.auxiliary])
-    new_coords = Coords(
-        coords=db_coords.coords,
-        auxiliary=[
-            {"confidence": float(x), "image_path": y["image_path"]}
-            for (x, y) in zip(res.flatten(), db_coords.auxiliary)
-        ],
-    )
-    top_n = torch.argsort(res, descending=True).flatten()[:TOP_N]
+    image_paths = db_coords.auxiliary.column("image_path")
+    # Descriptors are stored by image content, so only images not seen before are embedded
+    # Descriptors of one precision are only compared with each other
+    key = f"{MODEL_NAME}@{precision_for('eigenplaces')}"
+    store = DescriptorStore.get(key)
+    query = store.lookup(embed_cached(key, [session.get_loc(img_id)], embed_paths))[0]
+    digests = embed_cached(key, image_paths.tolist(), embed_paths)
+    scores = store.similarity(digests, query).astype(np.float64)
+    new_coords = Coords(db_coords.latlon, Auxiliary({"confidence": scores, "image_path": image_paths}, len(db_coords)))
+    top = new_coords.top_k(scores, TOP_N)
     res = f"Top {TOP_N} possible locations based on visual place recognition: \n"
-    for t in range(TOP_N):
+    for t, (coord, aux) in enumerate(zip(top, top.auxiliary)):
         res += (
             f"Location {t+1}:\n"
-            f"Image: {utils.image_to_prompt(db_coords.auxiliary[top_n[t]]['image_path'], session)}\n"
-            f"Coordinate: {new_coords.coords[top_n[t]]}\n"
+            f"Image: {utils.image_to_prompt(aux['image_path'], session)}\n"
+            f"Coordinate: {coord}\n"
         )
     res += f"Full results: \n {new_coords.to_prompt(session, 'vpr_', render=False)}"
     return ToolResponse(res, {
-        "geojson": Coords([new_coords.coords[t] for t in top_n]).to_geojson(), 
-        "images": [db_coords.auxiliary[t]["image_path"] for t in top_n]
+        "geojson": Coords(top.latlon).to_geojson(),
+        "images": top.auxiliary.column("image_path").tolist()
     })
 
 
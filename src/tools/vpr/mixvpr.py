@@ -2,6 +2,8 @@
 # Parts of this code are from https://github.com/amaralibey/MixVPR
 
 import os
+from functools import partial
+
 import gdown
 import torch
 import torchvision
@@ -9,6 +11,9 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torchvision.transforms as transforms
 
+from ... import models
+from ..ml import with_precision
+
 MODELS_INFO = {
     128: (
         "https://drive.google.com/file/d/1DQnefjk1hVICOEYPwE4-CZAZOvi1NSJz/view",
@@ -158,3 +163,14 @@ def get_mixvpr(descriptors_dimension):
     model = model.eval()
 
     return model
+
+
+for _dim in MODELS_INFO:
+    models.register(f"mixvpr-{_dim}", with_precision(f"mixvpr-{_dim}", partial(get_mixvpr, _dim)))
+
+
+def mixvpr(descriptors_dimension) -> MixVPRModel:
+    """
+    The shared instance of a MixVPR model, see `get_mixvpr`
+    """
+    return models.get(f"mixvpr-{descriptors_dimension}")
@@ -0,0 +1,56 @@
+import re
+from concurrent.futures import Future
+from threading import Lock
+from typing import Callable, Dict, Tuple, Any
+
+
+class TranspositionTable:
+    """
+    Per-session table of tool results, keyed by (tool name, normalized input).
+    Lets identical actions taken in different branches of the search tree share one tool call.
+    Concurrent lookups of an action that is still running wait for the first call instead of repeating it.
+    """
+
+    def __init__(self):
+        self.entries: Dict[Tuple[str, str], Future] = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(tool_name: str, tool_input: str) -> Tuple[str, str]:
+        return tool_name.strip().lower(), re.sub(r"\s+", " ", tool_input).strip()
+
+    def lookup_or_run(self, key: Tuple[str, str], source: str, fn: Callable[[], Any]) -> Tuple[Any, str | None]:
+        """
+        Get the result of an action, running it only if no other node has.
+        Failed calls are not stored.
+        :param key: the key returned by `TranspositionTable.key`
+        :param source: id of the node asking for the result
+        :param fn: runs the action
+        :return: the result, and the id of the node whose call produced it if it was reused
+        """
+        with self.lock:
+            fut = self.entries.get(key)
+            owner = fut is None
+            if owner:
+                fut = Future()
+                self.entries[key] = fut
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            res, origin = fut.result()
+            return res, origin
+        try:
+            res = fn()
+        except BaseException as e:
+            with self.lock:
+                self.entries.pop(key, None)
+            fut.set_exception(e)
+            raise
+        fut.set_result((res, source))
+        return res, None
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
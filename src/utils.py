@@ -16,6 +16,7 @@ import inspect
 
 from .session import Session
 from .config import RUN_DIR, DEBUG_DIR
+from .image_cache import ImageCache
 
 # Mutable Global Variable: Whether to render a black bar at the bottom with the location of image
 GLOB_RENDER_BLACKBAR = False
@@ -124,22 +125,27 @@ def enforce_image(loc: str | Path, session: Session):
     return loc
 
 
-im_cache = {}
+im_cache = ImageCache()
 
 
 def proc_image_url(url: str | Path, session: Session) -> str:
     if isinstance(url, Path): url = str(url)
     if url.startswith("http"):
         return url
-    global im_cache
-    if url in im_cache:
-        return im_cache[url]
-    match os.getenv("PROC_IMAGE_USE"):
+    mode = os.getenv("PROC_IMAGE_USE") or "encode"
+    key = f"{mode}:{im_cache.digest(url)}"
+    if GLOB_RENDER_BLACKBAR:
+        # the rendered bar contains the path, so identical content under another path differs
+        key += f":{url}"
+    res = im_cache.get(key)
+    if res is not None:
+        return res
+    match mode:
         case 'gcp' | 'upload':
             res = upload_image(session, Path(url))
         case _:
             res = encode_image(Path(url))
-    im_cache[url] = res
+    im_cache.put(key, res)
     return res
 
 